@@ -0,0 +1,152 @@
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+from radar_track import FEATURE_NAMES, PLOT_FIELDS
+
+
+def _segment_sum(values, segments, num_segments):
+    """
+    Sums the non-NaN values of every segment.
+    :param values: The values to sum.
+    :param segments: The segment index of each value.
+    :param num_segments: The total number of segments.
+    :return: A tuple (sums, counts) of arrays with one entry per segment.
+    """
+    valid = ~np.isnan(values)
+    sums = np.bincount(segments[valid], weights=values[valid], minlength=num_segments)
+    counts = np.bincount(segments[valid], minlength=num_segments)
+    return sums, counts
+
+
+def _segment_mean(values, segments, num_segments):
+    """
+    Mean of the non-NaN values of every segment (NaN for segments with no values), like pandas' Series.mean.
+    """
+    sums, counts = _segment_sum(values, segments, num_segments)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def _segment_std(values, segments, num_segments):
+    """
+    Unbiased standard deviation of the non-NaN values of every segment (NaN for segments with fewer than two
+    values), computed in two passes like pandas' Series.std.
+    """
+    mean = _segment_mean(values, segments, num_segments)
+    squares, counts = _segment_sum((values - mean[segments]) ** 2, segments, num_segments)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 1, np.sqrt(squares / (counts - 1)), np.nan)
+
+
+def _segment_diff_moments(diff, segments, n):
+    """
+    Calculates the m1 and m2 smoothness statistics of every segment from the first differences of a signal.
+    :param diff: The first differences of the signal (NaN where a difference is missing).
+    :param segments: The segment index of each difference.
+    :param n: The number of updates in each segment.
+    :return: A tuple (m1, m2) of arrays with one entry per segment.
+    """
+    num_segments = len(n)
+    q = _segment_sum(diff, segments, num_segments)[0] / n
+    m1 = _segment_sum((diff - q[segments]) ** 2, segments, num_segments)[0] / n
+    m2 = m1 / (_segment_sum(np.abs(diff), segments, num_segments)[0] / n + 1e-6)
+    return m1, m2
+
+
+def segment_features(values, starts):
+    """
+    Calculates the feature vector of every track in a flat array of updates, using segment reductions instead of
+    per-track objects.
+    :param values: A 2D array with one row per update and one column per PLOT_FIELDS entry; the updates of each track
+    must be contiguous and in chronological order.
+    :param starts: The row each track starts at (in increasing order).
+    :return: A 2D array with one row per track and one column per FEATURE_NAMES entry.
+    """
+    num_rows = len(values)
+    num_segments = len(starts)
+    segments = np.repeat(np.arange(num_segments), np.diff(np.append(starts, num_rows)))
+    n = np.bincount(segments, minlength=num_segments).astype(np.float64)
+    speed, az, el, range_, lat, lon, _, rcs = values.T
+
+    # pairs (i, i + 1) and triples (i, i + 1, i + 2) of updates that belong to the same track
+    pair = segments[1:] == segments[:-1]
+    triple = pair[1:] & pair[:-1]
+    pair_segments = segments[:-1][pair]
+    triple_segments = segments[:-2][triple]
+
+    # headings between consecutive positions (NaN across track boundaries)
+    lat_diff = lat[:-1] - lat[1:]
+    lon_diff = lon[:-1] - lon[1:]
+    headings = np.where(pair, np.arctan2(lat_diff, lon_diff), np.nan)
+
+    # curvature of every triple (see radar_track.average_curvature)
+    a = np.sqrt(lat_diff[:-1] ** 2 + lon_diff[:-1] ** 2)[triple]
+    b = np.sqrt((lat[:-2] - lat[2:]) ** 2 + (lon[:-2] - lon[2:]) ** 2)[triple]
+    c = np.sqrt(lat_diff[1:] ** 2 + lon_diff[1:] ** 2)[triple]
+    with np.errstate(invalid="ignore"):
+        curvature = np.arccos((a ** 2 - b ** 2 - c ** 2) / (2 * b * c + 1e-6))
+
+    features = dict()
+    features['avg_speed'] = _segment_mean(speed, segments, num_segments)
+    features['std_speed'] = _segment_std(speed, segments, num_segments)
+    features['std_heading'] = _segment_std(headings[pair], pair_segments, num_segments)
+    features['mav_factor'] = features['avg_speed'] / (features['std_heading'] + 1e-6)
+    features['avg_curvature'] = _segment_mean(curvature, triple_segments, num_segments)
+    features['avg_rcs'] = _segment_mean(rcs, segments, num_segments)
+
+    for name, signal in [('range', range_), ('az', az), ('el', el), ('speed', speed)]:
+        diff = (signal[1:] - signal[:-1])[pair]
+        features['m1_' + name], features['m2_' + name] = _segment_diff_moments(diff, pair_segments, n)
+    heading_diff = (headings[1:] - headings[:-1])[triple]
+    features['m1_heading'], features['m2_heading'] = _segment_diff_moments(heading_diff, triple_segments, n)
+
+    return np.column_stack([features[name] for name in FEATURE_NAMES])
+
+
+def _segment_features_worker(args):
+    """
+    Pool wrapper around segment_features (the chunk's starts are relative to the chunk).
+    """
+    values, starts = args
+    return segment_features(values, starts)
+
+
+def calculate_features(data, workers=1):
+    """
+    Calculates the feature vectors of every track in a dataset in one pass. Produces the same features as the original
+    per-track pandas implementation (see benchmark.reference_features), without creating any per-track Python objects.
+    :param data: A DataFrame of track updates with a UUID column, the PLOT_FIELDS columns and (optionally) Label and
+    Track columns; the updates of each track must be in chronological order.
+    :param workers: The number of processes to split the tracks across (1 computes everything in this process).
+    :return: A DataFrame with one row per track (sorted by UUID): the UUID, the FEATURE_NAMES columns, and the Label and
+    Track of the track's first update (if data has them).
+    """
+    # sort once by UUID (stable, so each track keeps its chronological order); updates without a UUID are dropped, as
+    # they are by groupby
+    codes, uuids = pd.factorize(data["UUID"], sort=True)
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]
+    codes = codes[order]
+    values = data[PLOT_FIELDS].to_numpy(dtype=np.float64)[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) > 0 else np.array([], dtype=int)
+
+    # calculate the features, splitting the tracks into contiguous chunks if there are several workers
+    if workers > 1 and len(starts) > workers:
+        bounds = [starts[i] for i in np.linspace(0, len(starts), workers, endpoint=False).astype(int)] + [len(values)]
+        chunks = []
+        for lower, upper in zip(bounds[:-1], bounds[1:]):
+            chunk_starts = starts[(starts >= lower) & (starts < upper)] - lower
+            chunks.append((values[lower:upper], chunk_starts))
+        with mp.Pool(workers) as pool:
+            matrix = np.concatenate(pool.map(_segment_features_worker, chunks))
+    else:
+        matrix = segment_features(values, starts)
+
+    features = pd.DataFrame(matrix, columns=FEATURE_NAMES)
+    features.insert(0, "UUID", uuids[codes[starts]] if len(starts) > 0 else [])
+    if "Label" in data.columns:
+        features["Label"] = data["Label"].to_numpy()[order][starts]
+    if "Track" in data.columns:
+        features["Track"] = data["Track"].to_numpy()[order][starts]
+    return features
@@ -0,0 +1,499 @@
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import batch_features
+import dictionary
+import feature_kernels
+import flat_forest
+import model
+import model_artifact
+import pickle
+from radar_track import FEATURE_NAMES, PLOT_FIELDS, STREAMING_TOLERANCE, evaluate_window_sizes
+from utilities import constants as c
+
+
+def synthetic_track(uuid, length, seed):
+    """
+    Generates a synthetic radar track (a noisy random walk with a label).
+    :param uuid: The UUID of the track.
+    :param length: The number of updates in the track.
+    :param seed: The random seed used to generate the track.
+    :return: A DataFrame with the UUID, PLOT_FIELDS and Label columns, one row per update.
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "UUID": uuid,
+        "Speed": np.abs(rng.normal(12.0, 3.0, length)),
+        "AZ": np.mod(np.cumsum(rng.normal(0.0, 0.5, length)) + rng.uniform(0, 360), 360),
+        "EL": np.abs(np.cumsum(rng.normal(0.0, 0.1, length)) + 5.0),
+        "Range": np.abs(np.cumsum(rng.normal(5.0, 2.0, length)) + 1000.0),
+        "Position (lat)": 40.0 + np.cumsum(rng.normal(0.0, 1e-4, length)),
+        "Position (lon)": -90.0 + np.cumsum(rng.normal(0.0, 1e-4, length)),
+        "Position (alt MSL)": rng.uniform(100.0, 300.0, length),
+        "Radar Cross Section": rng.normal(-20.0, 5.0, length),
+        "Label": seed % 2,
+    })
+
+
+def reference_features(track):
+    """
+    Calculates the feature vector of a whole track with the original pandas implementation (the per-track
+    RADARTrack.calculate_new_values the optimized paths replaced), kept here as the reference they are checked against.
+    :param track: A DataFrame with the PLOT_FIELDS columns, one row per update.
+    :return: A list of the FEATURE_NAMES values.
+    """
+    features = dict()
+    features['avg_speed'] = np.mean(track['Speed'])
+    features['std_speed'] = np.std(track['Speed'], ddof=1)
+    heading = np.arctan2(track["Position (lat)"].diff(-1), track["Position (lon)"].diff(-1))
+    features['std_heading'] = np.std(heading, ddof=1)
+
+    # the curvature of the triangle formed by each three consecutive positions
+    lat_diff = track["Position (lat)"].diff(-1)
+    lon_diff = track["Position (lon)"].diff(-1)
+    a = np.sqrt(lat_diff ** 2 + lon_diff ** 2)
+    b = np.sqrt(track["Position (lat)"].diff(-2) ** 2 + track["Position (lon)"].diff(-2) ** 2)
+    c_ = np.sqrt(lat_diff.shift(-1).dropna() ** 2 + lon_diff.shift(-1).dropna() ** 2)
+    with np.errstate(invalid="ignore"):
+        features['avg_curvature'] = np.arccos((a ** 2 - b ** 2 - c_ ** 2) / (2 * b * c_ + 1e-6)).mean()
+
+    features['avg_rcs'] = np.mean(track['Radar Cross Section'])
+    features['mav_factor'] = features['avg_speed'] / (features['std_heading'] + 1e-6)
+
+    signals = track[['Speed', 'Range', 'AZ', 'EL']].assign(Heading=heading)
+    for name, field in [('speed', 'Speed'), ('range', 'Range'), ('az', 'AZ'), ('el', 'EL'), ('heading', 'Heading')]:
+        diff = signals[field].diff(1)
+        q = np.sum(diff) / len(signals)
+        m1 = np.sum((diff - q) ** 2) / len(signals)
+        features['m1_' + name] = m1
+        features['m2_' + name] = m1 / (np.sum(np.abs(diff)) / len(signals) + 1e-6)
+    return [features[name] for name in FEATURE_NAMES]
+
+
+def run_reference(tracks):
+    """
+    Runs the reference implementation (reference_features) on a set of tracks.
+    :param tracks: The tracks to compute features for.
+    :return: A tuple (feature matrix, seconds elapsed, peak bytes traced while computing one track).
+    """
+    start = time.perf_counter()
+    rows = [reference_features(track) for track in tracks]
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    reference_features(tracks[0])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return np.array(rows, dtype=np.float64), elapsed, peak
+
+
+def run_batch(tracks, repeats=3):
+    """
+    Runs the vectorized training path (batch_features.calculate_features) on a set of tracks.
+    :param tracks: The tracks to compute features for.
+    :param repeats: The number of times the batch is timed (the fastest time is reported, since a single batch only
+    takes a few milliseconds and is easily thrown off by the rest of the machine).
+    :return: A tuple (feature matrix, seconds elapsed, peak bytes traced per track).
+    """
+    data = pd.concat(tracks, ignore_index=True)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        features = batch_features.calculate_features(data)
+        times.append(time.perf_counter() - start)
+    elapsed = min(times)
+
+    # memory is traced in a separate run, since tracing slows everything down
+    tracemalloc.start()
+    batch_features.calculate_features(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # calculate_features sorts by UUID, so put the rows back in the order of the tracks
+    features = features.set_index("UUID").loc[[track["UUID"].iloc[0] for track in tracks]]
+    return features[FEATURE_NAMES].to_numpy(), elapsed, peak / len(tracks)
+
+
+def feed_live(records, plots):
+    """
+    Feeds a set of tracks through a Dictionary the way the classify path does: each update is added (add_plot) and the
+    track's feature vector is read right after it, under the dictionary's lock like Dictionary.classify (features are
+    computed lazily, when they're read, so reading them is where the feature evaluation happens).
+    :param records: The Dictionary to feed.
+    :param plots: A list of (UUID, list of plots) tuples, one per track.
+    :return: A tuple (feature matrix after the last update of each track, number of seconds elapsed).
+    """
+    features = []
+    start = time.perf_counter()
+    for uuid, rows in plots:
+        for row in rows:
+            records.add_plot(uuid, row)
+            with records.lock:
+                vector = records.store.feature_matrix([uuid])
+        features.append(vector[0])
+    return np.array(features), time.perf_counter() - start
+
+
+def run_live(tracks, streaming):
+    """
+    Runs the live path (one Dictionary.add_plot call and one feature read per update) on a set of tracks.
+    :param tracks: The tracks to feed through the dictionary.
+    :param streaming: True to use the streaming accumulator, False to recompute features over the history window.
+    :return: A tuple (feature matrix, seconds elapsed, resident bytes per track).
+    """
+    plots = [(track["UUID"].iloc[0], track[PLOT_FIELDS].to_dict('records')) for track in tracks]
+    records = dictionary.Dictionary(streaming=streaming)
+    features, elapsed = feed_live(records, plots)
+    records.close()
+
+    # the store's arrays are preallocated, so a track costs one row of them plus whatever is still allocated for it
+    # once its updates have been processed (traced in a separate run, since tracing slows everything down)
+    records = dictionary.Dictionary(streaming=streaming)
+    tracemalloc.start()
+    feed_live(records, plots)
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    per_track = records.store.nbytes / records.store.capacity + traced / len(tracks)
+    records.close()
+    return features, elapsed, per_track
+
+
+def check_parity(reference, features, tolerance):
+    """
+    Checks that two feature matrices agree within a relative tolerance (NaNs must match).
+    :return: The largest relative difference between the matrices, or infinity if their NaNs don't match.
+    """
+    if not np.array_equal(np.isnan(reference), np.isnan(features)):
+        return np.inf
+    valid = ~np.isnan(reference)
+    if not valid.any():
+        return 0.0
+    return float(np.max(np.abs(reference[valid] - features[valid]) / np.maximum(np.abs(reference[valid]), 1e-12)))
+
+
+def run_benchmarks(lengths, updates_per_length):
+    """
+    Runs every feature path on synthetic tracks of each length, timing them and checking them against the reference
+    implementation (see reference_features).
+    :param lengths: The track lengths (number of updates) to benchmark.
+    :param updates_per_length: Roughly how many updates to process per length (short tracks are repeated).
+    :return: A list of result dictionaries, one per (path, length).
+    """
+    results = []
+    for length in lengths:
+        tracks = [synthetic_track(f"track-{i}", length, seed=i) for i in range(max(1, updates_per_length // length))]
+        total_updates = length * len(tracks)
+
+        reference, elapsed, peak = run_reference(tracks)
+        results.append({'path': 'reference', 'length': length, 'updates': total_updates,
+                        'us_per_update': 1e6 * elapsed / total_updates, 'bytes_per_track': peak, 'max_rel_error': 0.0,
+                        'parity': True})
+
+        # the history window only covers the full track when the track fits in it
+        runs = [('batch', lambda: run_batch(tracks), True),
+                ('live_streaming', lambda: run_live(tracks, streaming=True), True),
+                ('live_window', lambda: run_live(tracks, streaming=False), length <= c.HISTORY_CAPACITY)]
+        for path, run, comparable in runs:
+            features, elapsed, memory = run()
+            error = check_parity(reference, features, STREAMING_TOLERANCE) if comparable else float('nan')
+            results.append({'path': path, 'length': length, 'updates': total_updates,
+                            'us_per_update': 1e6 * elapsed / total_updates, 'bytes_per_track': memory,
+                            'max_rel_error': error, 'parity': bool(not comparable or error <= STREAMING_TOLERANCE)})
+    return results
+
+
+def check_kernel_backends(backends=('numpy', 'numba')):
+    """
+    Checks each feature kernel backend against the golden values (see feature_kernels.check_golden_values), whichever
+    backend is active.
+    :param backends: The names of the backends to check.
+    :return: A list of result dictionaries, one per backend (backends that aren't installed are reported as such).
+    """
+    results = []
+    for backend in backends:
+        if backend not in feature_kernels.BACKENDS:
+            results.append({'backend': backend, 'active': False, 'installed': False, 'golden': False, 'error': ''})
+            continue
+        try:
+            feature_kernels.check_golden_values(backend)
+            error = ''
+        except AssertionError as e:
+            error = str(e)
+        results.append({'backend': backend, 'active': backend == feature_kernels.BACKEND, 'installed': True,
+                        'golden': not error, 'error': error})
+    return results
+
+
+def forest_inputs(n_rows, seed=0):
+    """
+    Generates classifier inputs: the feature vectors of synthetic tracks, resampled and randomly scaled to n_rows rows.
+    :param n_rows: The number of rows to generate.
+    :param seed: The random seed.
+    :return: A DataFrame with the FEATURE_NAMES columns (missing values replaced with 0, as in inference).
+    """
+    rng = np.random.default_rng(seed)
+    tracks = pd.concat([synthetic_track(f"track-{i}", 50, seed=i) for i in range(200)], ignore_index=True)
+    features = batch_features.calculate_features(tracks)[FEATURE_NAMES].fillna(0).to_numpy()
+    rows = features[rng.integers(0, len(features), n_rows)] * rng.lognormal(0.0, 1.0, (n_rows, len(FEATURE_NAMES)))
+    return pd.DataFrame(rows, columns=FEATURE_NAMES)
+
+
+def run_forest_benchmarks(model_path, batch_sizes, min_seconds=0.5):
+    """
+    Times scikit-learn's predict and predict_proba against the flattened forest's predict on batches of each size, and
+    checks that they agree bit for bit.
+    :param model_path: The path of the pickled RandomForestClassifier.
+    :param batch_sizes: The batch sizes (number of rows) to benchmark.
+    :param min_seconds: Each path is timed for roughly this many seconds per batch size.
+    :return: A list of result dictionaries, one per batch size.
+    """
+    with open(model_path, 'rb') as f:
+        sklearn_model = pickle.load(f)
+    forest = flat_forest.FlatForest.from_sklearn(sklearn_model)
+    inputs = forest_inputs(max(batch_sizes))
+
+    def time_per_batch(predict, batch):
+        predict(batch)  # warm-up (and JIT compilation)
+        repeats, start = 0, time.perf_counter()
+        while time.perf_counter() - start < min_seconds:
+            predict(batch)
+            repeats += 1
+        return (time.perf_counter() - start) / repeats
+
+    results = []
+    for size in batch_sizes:
+        batch = inputs.iloc[:size]
+        proba = sklearn_model.predict_proba(batch)
+        predictions, confidence = forest.predict(batch)
+        exact = (np.array_equal(proba, forest.predict_proba(batch))
+                 and np.array_equal(sklearn_model.predict(batch), predictions)
+                 and np.array_equal(proba.max(axis=1), confidence))
+
+        sklearn_time = time_per_batch(lambda b: (sklearn_model.predict(b), sklearn_model.predict_proba(b)), batch)
+        flat_time = time_per_batch(forest.predict, batch.to_numpy())
+        results.append({'batch_size': size, 'sklearn_us_per_batch': 1e6 * sklearn_time,
+                        'flat_us_per_batch': 1e6 * flat_time, 'speedup': sklearn_time / flat_time, 'exact': exact})
+    return results
+
+
+def run_early_exit_benchmark(model_path, cutoffs, n_rows=4096, min_seconds=0.5):
+    """
+    Times the flattened forest's early-exit classification against evaluating every tree, at each cut-off, and checks
+    that both give the same classes.
+    :param model_path: The path of the pickled RandomForestClassifier.
+    :param cutoffs: The cut-offs to benchmark.
+    :param n_rows: The number of rows classified per call.
+    :param min_seconds: Each path is timed for roughly this many seconds per cut-off.
+    :return: A list of result dictionaries, one per cut-off.
+    """
+    with open(model_path, 'rb') as f:
+        forest = flat_forest.FlatForest.from_sklearn(pickle.load(f))
+    inputs = forest_inputs(n_rows).to_numpy()
+
+    def time_per_call(predict):
+        predict(inputs)  # warm-up (and JIT compilation)
+        repeats, start = 0, time.perf_counter()
+        while time.perf_counter() - start < min_seconds:
+            predict(inputs)
+            repeats += 1
+        return (time.perf_counter() - start) / repeats
+
+    results = []
+    for cutoff in cutoffs:
+        predictions, _, evaluated = forest.predict_early_exit(inputs, cutoff)
+        full_time = time_per_call(lambda X: forest.predict(X, cutoff))
+        early_time = time_per_call(lambda X: forest.predict_early_exit(X, cutoff))
+        results.append({'cutoff': cutoff, 'trees': len(forest), 'mean_trees': float(evaluated.mean()),
+                        'full_us_per_row': 1e6 * full_time / n_rows, 'early_us_per_row': 1e6 * early_time / n_rows,
+                        'speedup': full_time / early_time,
+                        'exact': bool(np.array_equal(predictions, forest.predict(inputs, cutoff)[0]))})
+    return results
+
+
+def run_cache_benchmark(model_path, n_tracks, length):
+    """
+    Streams synthetic tracks through Model.make_inference one scan at a time (one update of every track per call), with
+    and without the prediction cache, and compares the two output streams.
+    :param model_path: The path of the pickled model.
+    :param n_tracks: The number of tracks in every scan.
+    :param length: The number of scans (updates per track).
+    :return: A dictionary with the cache's hit rate, the time per scan with and without the cache, the fraction of
+    output rows whose prediction differs, and the largest difference in confidence.
+    """
+    tracks = [synthetic_track(i, length, seed=i) for i in range(n_tracks)]
+    scans = [pd.concat([track.iloc[[k]] for track in tracks], ignore_index=True)[["UUID"] + PLOT_FIELDS]
+             for k in range(length)]
+
+    # a throwaway pass first, so that neither timed run pays for the first classification (numba compilation, caches)
+    warmup = model.Model(path=model_path, cache=True)
+    for scan in scans[:10]:
+        warmup.make_inference(scan.copy(), demo=True)
+    warmup.close()
+
+    outputs, times, stats = [], [], None
+    for cache in (False, True):
+        classifier = model.Model(path=model_path, cache=cache)
+        start = time.perf_counter()
+        outputs.append(pd.concat([classifier.make_inference(scan.copy(), demo=True) for scan in scans]))
+        times.append(time.perf_counter() - start)
+        stats = classifier.records.cache_stats()
+        classifier.close()
+
+    uncached, cached = outputs
+    return {'tracks': n_tracks, 'scans': length, 'hit_rate': stats['hit_rate'],
+            'uncached_ms_per_scan': 1000 * times[0] / length, 'cached_ms_per_scan': 1000 * times[1] / length,
+            'changed_predictions': float(np.mean(uncached["Prediction"].to_numpy() != cached["Prediction"].to_numpy())),
+            'max_confidence_change': float(np.max(np.abs(uncached["Confidence"] - cached["Confidence"])))}
+
+
+def run_load_benchmark(model_path, repeats=5):
+    """
+    Times loading a pickled model against loading the same model as a memory-mapped artifact (converted to a
+    temporary file), with and without a first prediction (which pages in the artifact's node arrays).
+    :param model_path: The path of the pickled model.
+    :param repeats: The number of times each load is timed (the fastest time is reported).
+    :return: A list of result dictionaries, one per format.
+    """
+    with open(model_path, 'rb') as f:
+        forest = flat_forest.FlatForest.from_sklearn(pickle.load(f))
+    row = forest_inputs(1).to_numpy()
+
+    with tempfile.TemporaryDirectory() as directory:
+        artifact_path = os.path.join(directory, "model" + model_artifact.EXTENSION)
+        model_artifact.save_artifact(forest, artifact_path)
+
+        def load_pickle():
+            with open(model_path, 'rb') as f:
+                return flat_forest.FlatForest.from_sklearn(pickle.load(f))
+
+        def load_artifact():
+            return model_artifact.load_artifact(artifact_path, FEATURE_NAMES)[0]
+
+        results = []
+        for name, path, load in (('pickle', model_path, load_pickle), ('artifact', artifact_path, load_artifact)):
+            load_times, first_prediction_times = [], []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                loaded = load()
+                load_times.append(time.perf_counter() - start)
+                loaded.predict(row)
+                first_prediction_times.append(time.perf_counter() - start)
+            results.append({'format': name, 'bytes': os.path.getsize(path), 'load_ms': 1000 * min(load_times),
+                            'load_and_predict_ms': 1000 * min(first_prediction_times)})
+    return results
+
+
+def compare_to_baseline(results, baseline, time_tolerance, memory_tolerance):
+    """
+    Compares benchmark results to a stored baseline.
+    :param results: The results of run_benchmarks.
+    :param baseline: The results stored in the baseline file (only results over the same number of updates are
+    compared, since the per-update cost of short runs includes more warm-up).
+    :param time_tolerance: The allowed relative slowdown in time per update (e.g. 0.5 for 50%).
+    :param memory_tolerance: The allowed relative growth in memory per track.
+    :return: A list of messages, one per regression (empty if there are none).
+    """
+    previous = {(result['path'], result['length'], result.get('updates')): result for result in baseline}
+    regressions = []
+    for result in results:
+        key = (result['path'], result['length'], result['updates'])
+        if not result['parity']:
+            regressions.append(f"{key}: features differ from the reference implementation (max rel error "
+                               f"{result['max_rel_error']:.3g})")
+        # the reference implementation is only there to check the others against, so its timings aren't gated
+        if key not in previous or result['path'] == 'reference':
+            continue
+        if result['us_per_update'] > previous[key]['us_per_update'] * (1 + time_tolerance):
+            regressions.append(f"{key}: {result['us_per_update']:.2f} us/update, baseline "
+                               f"{previous[key]['us_per_update']:.2f}")
+        if result['bytes_per_track'] > previous[key]['bytes_per_track'] * (1 + memory_tolerance):
+            regressions.append(f"{key}: {result['bytes_per_track']:.0f} bytes/track, baseline "
+                               f"{previous[key]['bytes_per_track']:.0f}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Feature Benchmark',
+        description='Benchmarks the batch (training) and live feature paths on synthetic tracks and checks that '
+                    'they produce the same features as the original pandas implementation.')
+
+    parser.add_argument('-l', '--trackLengths', type=int, default=[10, 100, 1000, 10000], nargs='+', help="Track lengths to benchmark")
+    parser.add_argument('-u', '--updates', type=int, default=10000, help="Approximate number of updates processed per track length")
+    parser.add_argument('-b', '--baseline', type=str, default=c.BENCHMARK_BASELINE, help="Baseline JSON file to compare the results to (an empty string skips the comparison)")
+    parser.add_argument('-s', '--saveBaseline', type=str, default=None, help="Saves the results as a baseline JSON file")
+    parser.add_argument('-t', '--timeTolerance', type=float, default=0.5, help="Allowed relative slowdown before a timing counts as a regression")
+    parser.add_argument('-m', '--memoryTolerance', type=float, default=0.1, help="Allowed relative memory growth before it counts as a regression")
+    parser.add_argument('-f', '--forestBatchSizes', type=int, default=[], nargs='+', help="Also benchmarks the flattened forest against scikit-learn at these batch sizes (e.g. 1 64 4096)")
+    parser.add_argument('-e', '--earlyExit', type=float, default=[], nargs='+', help="Also benchmarks early-exit classification against evaluating every tree at these cut-offs (e.g. 0.5 0.9)")
+    parser.add_argument('-M', '--model', type=str, default='../models/apr17_full.sav', help="Pickled model used by the forest, cache and load-time benchmarks")
+    parser.add_argument('-L', '--loadTime', action='store_true', help="Also times loading the pickled model against loading it as a model artifact")
+    parser.add_argument('-c', '--cacheScans', type=int, default=0, help="Also benchmarks the prediction cache by streaming this many scans of 64 tracks through the model")
+    parser.add_argument('-k', '--requireNumba', action='store_true', help="Counts a missing numba backend as a regression (its kernels can't be checked against the golden values without it)")
+    parser.add_argument('-w', '--windowSizes', type=int, default=[], nargs='+', help="Also reports memory against feature drift for these history window sizes")
+
+    args = parser.parse_args()
+
+    # every kernel backend is checked, not just the active one, so a broken fallback can't go unnoticed
+    kernel_results = check_kernel_backends()
+    print("Feature kernels")
+    print(pd.DataFrame(kernel_results).drop(columns='error').to_string(index=False) + "\n")
+
+    results = run_benchmarks(args.trackLengths, args.updates)
+    print(pd.DataFrame(results).to_string(index=False))
+
+    if args.windowSizes:
+        tracks = pd.concat([synthetic_track(f"track-{i}", 1000, seed=i) for i in range(20)], ignore_index=True)
+        print("\nHistory window sizes")
+        print(evaluate_window_sizes(tracks, args.windowSizes).iloc[:, :4].to_string(index=False))
+
+    forest_results = []
+    if args.forestBatchSizes:
+        forest_results = run_forest_benchmarks(args.model, args.forestBatchSizes)
+        print(f"\nFlattened forest ({flat_forest.BACKEND})")
+        print(pd.DataFrame(forest_results).to_string(index=False))
+
+    early_exit_results = []
+    if args.earlyExit:
+        early_exit_results = run_early_exit_benchmark(args.model, args.earlyExit)
+        print(f"\nEarly exit ({flat_forest.BACKEND})")
+        print(pd.DataFrame(early_exit_results).to_string(index=False))
+
+    if args.loadTime:
+        print("\nModel load time")
+        print(pd.DataFrame(run_load_benchmark(args.model)).to_string(index=False))
+
+    if args.cacheScans:
+        print("\nPrediction cache")
+        print(pd.DataFrame([run_cache_benchmark(args.model, 64, args.cacheScans)]).to_string(index=False))
+
+    if args.saveBaseline:
+        with open(args.saveBaseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("\nSaved baseline to " + args.saveBaseline)
+
+    regressions = [f"{(r['path'], r['length'])}: features differ from the reference implementation"
+                   for r in results if not r['parity']]
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.timeTolerance, args.memoryTolerance)
+
+    regressions += [r['error'] for r in kernel_results if r['installed'] and not r['golden']]
+    if args.requireNumba:
+        regressions += [f"{r['backend']} feature kernels: not installed" for r in kernel_results if not r['installed']]
+    regressions += [f"forest batch size {r['batch_size']}: predictions differ from scikit-learn"
+                    for r in forest_results if not r['exact']]
+    regressions += [f"early exit cut-off {r['cutoff']}: classes differ from evaluating every tree"
+                    for r in early_exit_results if not r['exact']]
+
+    if regressions:
+        print("\nRegressions:")
+        print("\n".join(regressions))
+        sys.exit(1)
@@ -0,0 +1,137 @@
+import numpy as np
+
+from flat_forest import FlatForest
+from sklearn.ensemble import RandomForestClassifier
+from utilities import constants as c
+
+
+class Cascade:
+    """
+    This class is the first stage of a two-stage classifier: a shallow decision tree that classifies the easy rows
+    (slow, faint birds; fast, steady drones) on its own and escalates the rest to the full model. A row is escalated
+    when the first stage's confidence is below a threshold, which is calibrated against the full model on held-out data
+    (see calibrate).
+
+    The first stage is stored as a one-tree FlatForest, so it's evaluated by the same kernels as the full model and
+    saved in the same model artifact.
+
+    Attributes:
+        first_stage: The shallow tree, as a one-tree FlatForest.
+        threshold: Rows whose first-stage confidence is at least this are classified by the first stage alone.
+    """
+    def __init__(self, first_stage, threshold):
+        self.first_stage = first_stage
+        self.threshold = threshold
+
+    @staticmethod
+    def fit_first_stage(X, y, depth=c.CASCADE_DEPTH):
+        """
+        Fits a shallow decision tree (as a one-tree random forest without bootstrapping or feature sampling, which is
+        the same tree) and flattens it.
+        :param X: The feature vectors.
+        :param y: Their labels.
+        :param depth: The depth of the tree.
+        :return: The flattened tree.
+        """
+        tree = RandomForestClassifier(n_estimators=1, max_depth=depth, bootstrap=False, max_features=None,
+                                      class_weight='balanced')
+        tree.fit(X, y)
+        return FlatForest.from_sklearn(tree)
+
+    @classmethod
+    def calibrate(cls, first_stage, full_predict, X, y, tolerance=c.CASCADE_TOLERANCE):
+        """
+        Picks the lowest escalation threshold (so the fewest escalated rows) at which the cascade's accuracy on held-out
+        data is at most tolerance below the full model's.
+        :param first_stage: The flattened first-stage tree.
+        :param full_predict: A function classifying a feature matrix with the full model, returning a tuple
+        (predictions, confidences).
+        :param X: The held-out feature matrix (not used to fit either stage).
+        :param y: Its labels.
+        :param tolerance: The accuracy the cascade may lose against the full model.
+        :return: A tuple (the calibrated Cascade, dictionary with the full model's, the first stage's (on the rows it
+        keeps, None if it keeps none) and the cascade's accuracy, the fraction of rows escalated and the threshold).
+        """
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y)
+        first_pred, first_conf = first_stage.predict(X)
+        full_pred = full_predict(X)[0]
+        full_accuracy = np.mean(full_pred == y)
+
+        # every distinct first-stage confidence is a candidate threshold (a shallow tree only has a few), and an
+        # infinite threshold escalates every row; thresholds are tried from the lowest up
+        chosen = np.inf
+        for threshold in np.unique(first_conf):
+            kept = first_conf >= threshold
+            accuracy = np.mean(np.where(kept, first_pred, full_pred) == y)
+            if accuracy >= full_accuracy - tolerance:
+                chosen = float(threshold)
+                break
+
+        kept = first_conf >= chosen
+        report = {'full_accuracy': float(full_accuracy),
+                  'first_stage_accuracy': float(np.mean(first_pred[kept] == y[kept])) if kept.any() else None,
+                  'cascade_accuracy': float(np.mean(np.where(kept, first_pred, full_pred) == y)),
+                  'escalated': float(np.mean(~kept)),
+                  'threshold': chosen}
+        return cls(first_stage, chosen), report
+
+    def predict(self, X, full_predict):
+        """
+        Classifies each row with the first stage, and re-classifies the rows it isn't confident about with the full
+        model.
+        :param X: The (n_rows, n_features) input.
+        :param full_predict: A function classifying a feature matrix with the full model, returning a tuple
+        (predictions, confidences).
+        :return: A tuple (predicted class of each row, confidence of each prediction, boolean array of the escalated
+        rows).
+        """
+        X = np.asarray(X)
+        predictions, confidence = self.first_stage.predict(X)
+        escalated = confidence < self.threshold
+        if escalated.any():
+            predictions[escalated], confidence[escalated] = full_predict(X[escalated])
+        return predictions, confidence, escalated
+
+    def threshold_crossings(self, A, B):
+        """
+        Counts the first stage's split points between each pair of rows of A and B (see
+        FlatForest.threshold_crossings).
+        """
+        return self.first_stage.threshold_crossings(A, B)
+
+    def to_dict(self):
+        """
+        Serializes the cascade into a JSON-compatible dictionary (stored in the model artifact's header).
+        :return: The dictionary.
+        """
+        forest = self.first_stage
+        return {'threshold': self.threshold, 'classes': forest.classes.tolist(), 'n_features': int(forest.n_features),
+                'feature_names': forest.feature_names, 'max_depth': int(forest.max_depth),
+                'nodes': {name: getattr(forest, name).tolist()
+                          for name in ('roots', 'feature', 'threshold', 'left', 'right', 'proba')}}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds a cascade serialized by to_dict.
+        :param data: The dictionary.
+        :return: The cascade.
+        """
+        dtypes = {'roots': np.int64, 'feature': np.int32, 'threshold': np.float32, 'left': np.int32, 'right': np.int32,
+                  'proba': np.float64}
+        nodes = {name: np.array(data['nodes'][name], dtype=dtype) for name, dtype in dtypes.items()}
+        first_stage = FlatForest(classes=np.array(data['classes']), n_features=data['n_features'],
+                                 feature_names=data['feature_names'], max_depth=data['max_depth'], **nodes)
+        return cls(first_stage, data['threshold'])
+
+    @classmethod
+    def from_header(cls, header):
+        """
+        Rebuilds the cascade stored in a model artifact's header.
+        :param header: The artifact header (or None, for models that weren't loaded from an artifact).
+        :return: The cascade, or None if the artifact has none.
+        """
+        if header is None or header.get('cascade') is None:
+            return None
+        return cls.from_dict(header['cascade'])
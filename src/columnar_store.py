@@ -0,0 +1,153 @@
+import json
+import numpy as np
+import os
+import pandas as pd
+import shutil
+
+from feature_cache import file_digest
+from radar_track import PLOT_FIELDS
+from utilities import constants as c
+
+# the file describing a converted capture (its presence marks a directory as one)
+META_FILE = 'meta.json'
+
+# the columns a capture is converted to, and their types (UUIDs are stored as codes into the capture's uuids.npy, and
+# each update's Combat ID is the partition it's stored in)
+COLUMN_DTYPES = dict({'row': np.int64, 'uuid': np.int32}, **{name: np.float64 for name in PLOT_FIELDS})
+
+# the partition of the updates without a Combat ID
+NO_COMBAT_ID = '_none'
+
+
+def is_capture(path):
+    """
+    Checks whether a path is a converted capture.
+    :param path: The path.
+    :return: True if path is a directory written by convert_csv.
+    """
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def list_captures(directory):
+    """
+    Lists the converted captures in a directory.
+    :param directory: The directory (usually c.COLUMNAR_DIR).
+    :return: The paths to the captures, sorted (none if the directory doesn't exist).
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.dirname(path) for path in
+                  (os.path.join(directory, name, META_FILE) for name in os.listdir(directory)) if os.path.isfile(path))
+
+
+def read_meta(capture):
+    """
+    Reads the description of a converted capture.
+    :param capture: The path to the capture.
+    :return: The dictionary written by convert_csv.
+    """
+    with open(os.path.join(capture, META_FILE)) as file:
+        return json.load(file)
+
+
+def convert_csv(path, directory=c.COLUMNAR_DIR, chunk_size=c.INGEST_CHUNK_ROWS):
+    """
+    Converts a CSV capture into a columnar capture: the UUID, Combat ID and PLOT_FIELDS columns (every other column is
+    dropped), partitioned by Combat ID, with one .npy file per column and partition. Updates keep their row number, so
+    reading several partitions restores the capture's order. The CSV is read in chunks of chunk_size rows, and the
+    capture is written to a temporary directory and renamed into place.
+    :param path: The path to the CSV file.
+    :param directory: The directory the capture is written to (as a subdirectory named after the CSV file).
+    :param chunk_size: The number of rows read at a time.
+    :return: The path to the capture.
+    """
+    capture = os.path.join(directory, os.path.splitext(os.path.basename(path))[0])
+    temporary = capture + f".tmp{os.getpid()}"
+    shutil.rmtree(temporary, ignore_errors=True)
+
+    codes = dict()
+    partitions = dict()
+    rows = dropped = 0
+    dtypes = dict({'UUID': str, 'Combat ID': str}, **{name: np.float64 for name in PLOT_FIELDS})
+    for chunk in pd.read_csv(path, usecols=lambda column: column in dtypes, dtype=dtypes, chunksize=chunk_size):
+        row = np.arange(rows, rows + len(chunk), dtype=np.int64)
+        rows += len(chunk)
+
+        # updates without a UUID can't belong to a track
+        has_uuid = chunk['UUID'].notna().to_numpy()
+        dropped += int(np.count_nonzero(~has_uuid))
+        chunk, row = chunk[has_uuid], row[has_uuid]
+
+        # map the chunk's UUIDs to codes that are shared by the whole capture
+        local, uuids = pd.factorize(chunk['UUID'])
+        mapping = np.array([codes.setdefault(uuid, len(codes)) for uuid in uuids], dtype=np.int32)
+        columns = dict({'row': row, 'uuid': mapping[local]},
+                       **{name: chunk[name].to_numpy(dtype=np.float64) for name in PLOT_FIELDS})
+
+        for combat_id, indices in chunk.groupby(chunk['Combat ID'].fillna(NO_COMBAT_ID), sort=False).indices.items():
+            partition = partitions.setdefault(combat_id, {name: [] for name in COLUMN_DTYPES})
+            for name, values in columns.items():
+                partition[name].append(values[indices])
+
+    # one directory per partition, with one file per column
+    os.makedirs(temporary)
+    np.save(os.path.join(temporary, 'uuids.npy'), np.array(list(codes), dtype=str))
+    for combat_id, partition in partitions.items():
+        os.makedirs(os.path.join(temporary, combat_id))
+        for name, dtype in COLUMN_DTYPES.items():
+            np.save(os.path.join(temporary, combat_id, name + '.npy'), np.concatenate(partition[name]).astype(dtype))
+
+    # the source's digest identifies the capture's contents (see feature_cache.cache_key)
+    meta = {'source': os.path.basename(path), 'source_sha256': file_digest(path), 'rows': rows,
+            'rows_without_uuid': dropped, 'tracks': len(codes),
+            'columns': {name: np.dtype(dtype).name for name, dtype in COLUMN_DTYPES.items()},
+            'partitions': {combat_id: int(sum(len(values) for values in partition['row']))
+                           for combat_id, partition in partitions.items()}}
+    with open(os.path.join(temporary, META_FILE), 'w') as file:
+        json.dump(meta, file)
+
+    shutil.rmtree(capture, ignore_errors=True)
+    os.replace(temporary, capture)
+    return capture
+
+
+def read_capture(capture, columns=PLOT_FIELDS, combat_ids=None, rows=None):
+    """
+    Reads a converted capture. Only the requested columns of the requested partitions are read (memory-mapped, then
+    gathered into the DataFrame).
+    :param capture: The path to the capture.
+    :param columns: The PLOT_FIELDS columns to read.
+    :param combat_ids: The Combat IDs whose updates are read (None reads every update, including those without a
+    Combat ID).
+    :param rows: If not None, a tuple (first, last): only the updates from row first (included) to row last (excluded)
+    of the original CSV file are read.
+    :return: A DataFrame with the UUID, the requested columns and the Combat ID of each update read, in the order of the
+    original CSV file.
+    """
+    meta = read_meta(capture)
+    selected = [combat_id for combat_id in meta['partitions'] if combat_ids is None or combat_id in combat_ids]
+    first, last = rows if rows is not None else (0, meta['rows'])
+
+    parts = {name: [] for name in ['row', 'uuid'] + list(columns)}
+    lengths = []
+    for combat_id in selected:
+        # a partition's rows are increasing, so a range of rows is a slice of each of its columns (and only that slice
+        # of the memory-mapped files is read)
+        row = np.load(os.path.join(capture, combat_id, 'row.npy'), mmap_mode='r')
+        lower, upper = np.searchsorted(row, [first, last])
+        for name in parts:
+            parts[name].append(np.load(os.path.join(capture, combat_id, name + '.npy'), mmap_mode='r')[lower:upper])
+        lengths.append(upper - lower)
+
+    # the partitions are merged back into the capture's order
+    row = np.concatenate(parts.pop('row')) if selected else np.zeros(0, dtype=np.int64)
+    order = np.argsort(row, kind='stable')
+    uuids = np.load(os.path.join(capture, 'uuids.npy'))
+    codes = np.concatenate(parts.pop('uuid'))[order] if selected else np.zeros(0, dtype=np.int32)
+
+    data = pd.DataFrame({'UUID': uuids[codes].astype(object)})
+    for name, values in parts.items():
+        data[name] = np.concatenate(values)[order] if selected else np.zeros(0)
+    combat_id = np.repeat(np.array(selected, dtype=object), lengths)[order]
+    data['Combat ID'] = np.where(combat_id == NO_COMBAT_ID, None, combat_id)
+    return data
@@ -0,0 +1,47 @@
+import argparse
+import datetime
+import os
+import pickle
+import sklearn
+import warnings
+from sklearn.ensemble import RandomForestClassifier
+
+import model_artifact
+from flat_forest import FlatForest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Convert Model',
+        description='Converts a pickled (.sav) random forest into a memory-mappable model artifact.')
+
+    parser.add_argument('-i', '--inputFile', type=str, required=True, help="Pickled model to convert")
+    parser.add_argument('-o', '--outputFile', type=str, default=None, help="Artifact filename (defaults to the input filename with the " + model_artifact.EXTENSION + " extension)")
+
+    args = parser.parse_args()
+
+    output_file = args.outputFile or os.path.splitext(args.inputFile)[0] + model_artifact.EXTENSION
+
+    # scikit-learn warns when a model was pickled by another version; the warning is the only record of that version
+    with open(args.inputFile, 'rb') as f, warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        forest = pickle.load(f)
+    # only random forests can be flattened (see FlatForest.from_sklearn)
+    if not isinstance(forest, RandomForestClassifier):
+        parser.error(f"{args.inputFile} holds a {type(forest).__name__}, not a scikit-learn RandomForestClassifier")
+    versions = [getattr(w.message, 'original_sklearn_version', None) for w in caught]
+    versions = [version for version in versions if version is not None]
+
+    # the training metadata that survives in the pickle
+    metadata = {
+        'source': os.path.basename(args.inputFile),
+        'converted': datetime.datetime.now().isoformat(timespec='seconds'),
+        'sklearn_version': versions[0] if versions else sklearn.__version__,
+        'params': {key: value for key, value in forest.get_params().items()
+                   if isinstance(value, (int, float, str, bool, type(None)))},
+    }
+
+    model_artifact.save_artifact(FlatForest.from_sklearn(forest), output_file, metadata)
+
+    print(f"Converted {args.inputFile} ({os.path.getsize(args.inputFile)} bytes) to {output_file} "
+          f"({os.path.getsize(output_file)} bytes)")
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import preprocess as pre
+
+from concurrent.futures import ThreadPoolExecutor
+from radar_track import PLOT_FIELDS
+
+# the label of each Combat ID used for training and testing (updates with any other Combat ID are dropped)
+LABELS = {'HOSTILE': 1, 'UNKNOWN_THREAT': 0}
+
+# the columns read from the input files
+INPUT_COLUMNS = ['UUID', 'Combat ID'] + PLOT_FIELDS
+
+
+def segment_names(uuids, segments):
+    """
+    Names the segments of split tracks "<UUID>-<segment index>" (the names are the same on every run).
+    :param uuids: The UUID of each update's track.
+    :param segments: The segment index of each update.
+    :return: A Series with the segment name of each update.
+    """
+    return uuids.astype(str) + '-' + pd.Series(segments, index=uuids.index).astype(str)
+
+
+def split_tracks(data, track_length):
+    """
+    Splits every track longer than track_length updates into segments of track_length updates (the last segment also
+    takes the remaining updates, if there are fewer than track_length of them), in one vectorized pass.
+    :param data: A DataFrame of track updates with a UUID column, each track's updates in chronological order.
+    :param track_length: The length tracks are split into.
+    :return: A copy of data in which the UUID of each update of a split track is the name of its segment (see
+    segment_names); tracks of at most track_length updates keep their UUID, and updates without a UUID are dropped.
+    The Track column holds each update's original UUID (the segments of a track share it).
+    """
+    data = data[data['UUID'].notna()].copy()
+    data['Track'] = data['UUID']
+    grouped = data.groupby('UUID', sort=False)
+    position = grouped.cumcount().to_numpy()
+    length = grouped['UUID'].transform('size').to_numpy()
+
+    # a track of n updates has n // track_length segments, and the updates past the last full one join it
+    segment = np.minimum(position // track_length, np.maximum(length // track_length - 1, 0))
+    split = length > track_length
+    data.loc[split, 'UUID'] = segment_names(data.loc[split, 'UUID'], segment[split])
+    return data
+
+
+def label_tracks(data):
+    """
+    Labels every update from its Combat ID (see LABELS) and drops the updates without a label. A track with both
+    labels is a drone (every one of its updates gets label 1).
+    :param data: A DataFrame of track updates with UUID and Combat ID columns.
+    :return: A copy of data with the labelled updates only, and an integer Label column.
+    """
+    labels = data['Combat ID'].map(LABELS)
+    data = data[labels.notna()].copy()
+    data['Label'] = labels[labels.notna()].astype(np.int64)
+    data['Label'] = data.groupby('UUID', sort=False)['Label'].transform('max')
+    return data
+
+
+def read_inputs(files, workers=1):
+    """
+    Reads the labelled updates of a set of input files, several files at a time. Only the INPUT_COLUMNS are read, and
+    updates without a training label are skipped (columnar captures don't even read them).
+    :param files: The CSV files or columnar captures (see columnar_store.py), in order.
+    :param workers: The number of files read at the same time.
+    :return: A DataFrame of the files' updates, in order.
+    """
+    def read(file):
+        return pre.read_df(file, INPUT_COLUMNS, list(LABELS))
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        frames = list(pool.map(read, files))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=INPUT_COLUMNS)
+
+
+def load_labeled_data(files, track_length, num_rows=None, workers=1):
+    """
+    Loads files of track updates, splits their tracks and labels them: the dataset train.py and test.py compute
+    feature vectors from. Updates without a training label are dropped when the files are read, so they don't count
+    toward a track's length.
+    :param files: The CSV files or columnar captures, in the order they're loaded.
+    :param track_length: The length tracks are split into (see split_tracks).
+    :param num_rows: If not None, only the first num_rows labelled updates (over all files) are used.
+    :param workers: The number of files read at the same time.
+    :return: A tuple (DataFrame of labelled track updates, number of tracks after splitting).
+    """
+    data = read_inputs(files, workers)
+    if num_rows:
+        data = data[:num_rows]
+    print("Number of unique UUIDs:", data['UUID'].nunique())
+
+    print("Splitting tracks into length " + str(track_length))
+    data = split_tracks(data, track_length)
+    num_tracks = data['UUID'].nunique()
+    print("Number of unique UUIDs after track-splitting:", num_tracks)
+
+    data = label_tracks(data)
+    for combat_id in LABELS:
+        print(f"{combat_id} updates: ", int((data['Combat ID'] == combat_id).sum()))
+    print("")
+    return data.reset_index(drop=True), num_tracks
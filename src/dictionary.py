@@ -1,20 +1,51 @@
+import numpy as np
 import pandas as pd
-import schedule
+import threading
+import time
+import weakref
 
-from radar_track import RADARTrack
+from radar_track import FEATURE_NAMES, PLOT_FIELDS
+from timer_wheel import TimerWheel
+from track_store import TrackStore
+from utilities import constants as c
 
 
 class Dictionary:
-    def __init__(self):
-        self.dictionary = dict()
+    def __init__(self, streaming=c.STREAMING_FEATURES, timeout=c.STALE_TRACK_TIMEOUT,
+                 resolution=c.EXPIRY_RESOLUTION, cache=c.PREDICTION_CACHE):
+        """
+        Initializes an empty dictionary of tracks, and starts the background thread that evicts stale tracks.
+        :param streaming: True to maintain each track's features incrementally (see radar_track.accumulate), False to
+        recompute them over the track's history window on every update.
+        :param timeout: The number of seconds without an update after which a track is evicted.
+        :param resolution: How often (in seconds) stale tracks are evicted.
+        :param cache: True to reuse each track's last classification until it goes stale (see
+        TrackStore.stale_predictions), False to re-classify every track every time.
+        """
+        self.store = TrackStore(streaming=streaming)
+        self.streaming = streaming
         self.first_half = True
-        schedule.every(30).seconds.do(self.clear_stale_feature_vectors)
+
+        # prediction cache hits and misses, counted per classified track
+        self.cache = cache
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # stale tracks are found through a timer wheel keyed on each track's last update (on the monotonic clock, so
+        # wall-clock adjustments can't evict live tracks), and evicted off the per-message path by a daemon thread; the
+        # thread only holds a weak reference, so it also stops once the dictionary is garbage collected
+        self.expiry = TimerWheel(timeout, resolution, now=time.monotonic())
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.expiry_thread = threading.Thread(target=_expire_forever,
+                                              args=(weakref.ref(self), self.stopped, resolution), daemon=True)
+        self.expiry_thread.start()
 
     def __len__(self):
         """
         Return number of feature vectors in the dictionary.
         """
-        return len(self.dictionary)
+        return len(self.store)
 
     def add_plot(self, uuid, plot):
         """
@@ -23,64 +54,147 @@ class Dictionary:
         create a new feature vector object using the update values and 
         add it to the dictionary. Otherwise, update the feature vector entries 
         with the new update values. 
-        Afterwards, if the cleanup procedure is queued, run the cleanup 
-        procedure to remove any tracks which haven't been updated in over
-        a minute.
-        """
-        # if the uuid is already in the dictionary, add it to the collection
-        vals = {
-            "Speed": [plot["Speed"]],
-            "AZ": [plot["AZ"]],
-            "EL": [plot["EL"]],
-            "Range": [plot["Range"]],
-            "Position (lat)": [plot["Position (lat)"]],
-            "Position (lon)": [plot["Position (lon)"]],
-            "Position (alt MSL)": [plot["Position (alt MSL)"]],
-            "Radar Cross Section": [plot["Radar Cross Section"]],
-        }
-        if uuid in self.dictionary:
-            self.dictionary[uuid].calculate_new_values(vals)
-
-        # if the uuid is not in the dictionary, create a new entry for it
-        else:
-            new_track = RADARTrack(uuid=uuid, init_vals=vals)
-            self.dictionary[uuid] = new_track
-        schedule.run_pending()
-
+        The track's expiry deadline is pushed back to the stale timeout.
+        """
+        # the track store creates the track if the uuid hasn't been seen yet, otherwise it updates the track
+        values = [float(plot[field]) for field in PLOT_FIELDS]
+        now = time.monotonic()
+        with self.lock:
+            self.store.add(uuid, values, now)
+            self.expiry.touch(uuid, now)
 
     def get_features(self, curr_uuids):
-        res_list = []
-        for uuid in curr_uuids:
-            res_list.append(self.get_feature_vector(uuid))
-        df = pd.DataFrame(res_list)
-        df.fillna(0, inplace=True)
+        """
+        Function to return the feature vectors of a sequence of tracks as a DataFrame.
+        """
+        df = pd.DataFrame(self.get_feature_matrix(curr_uuids), columns=FEATURE_NAMES)
+        df.insert(0, 'UUID', list(curr_uuids))
         return df
 
+    def get_feature_matrix(self, curr_uuids):
+        """
+        Function to return the feature vectors of a sequence of tracks as one row-gather of the track store's
+        feature matrix (missing values are replaced with 0).
+        """
+        with self.lock:
+            # raise an exception if a UUID isn't in the dictionary
+            for uuid in curr_uuids:
+                if uuid not in self.store:
+                    raise Exception(
+                        f"The following UUID was not found in the dictionary: {uuid}"
+                    )
+            matrix = self.store.feature_matrix(curr_uuids)
+        matrix[np.isnan(matrix)] = 0
+        return matrix
+
+    def classify(self, curr_uuids, classifier, distance=None):
+        """
+        Function to classify a sequence of (distinct) tracks. Tracks whose cached classification is still valid reuse
+        it; the rest are passed to the classifier in one batch and their classifications are cached.
+        :param curr_uuids: The UUIDs of the tracks.
+        :param classifier: A function taking a feature matrix and returning a tuple (predictions, confidences).
+        :param distance: A function returning the distance between each pair of rows of two feature matrices, used to
+        decide whether a track's features moved too far from its cached classification (None disables the cache).
+        :return: A tuple (predicted class of each track, confidence of each prediction).
+        """
+        with self.lock:
+            for uuid in curr_uuids:
+                if uuid not in self.store:
+                    raise Exception(
+                        f"The following UUID was not found in the dictionary: {uuid}"
+                    )
+            slots = self.store.slots(curr_uuids)
+            features = self.store.feature_matrix(curr_uuids)
+            features[np.isnan(features)] = 0
+            now = time.monotonic()
+
+            if self.cache and distance is not None:
+                stale = self.store.stale_predictions(slots, features, now, distance)
+            else:
+                stale = np.ones(len(slots), dtype=bool)
+            if stale.any():
+                predictions, confidence = classifier(features[stale])
+                self.store.cache_predictions(slots[stale], features[stale], predictions, confidence, now)
+            self.cache_hits += int(len(slots) - stale.sum())
+            self.cache_misses += int(stale.sum())
+            return self.store.prediction[slots], self.store.confidence[slots]
+
+    def set_live_features(self, names):
+        """
+        Function to set the features computed for every track (the ones the loaded model uses). The tracks that are
+        already live compute the new features over their whole history.
+        """
+        with self.lock:
+            self.store.set_live_features(names)
+
+    def invalidate_predictions(self):
+        """
+        Function to drop every cached prediction (e.g., after the model changed), keeping the tracks themselves.
+        """
+        with self.lock:
+            self.store.classified[:] = False
+
+    def cache_stats(self):
+        """
+        Function to return the prediction cache's hit and miss counts and its hit rate.
+        """
+        lookups = self.cache_hits + self.cache_misses
+        return {'hits': self.cache_hits, 'misses': self.cache_misses,
+                'hit_rate': self.cache_hits / lookups if lookups else 0.0}
+
     def get_feature_vector(self, uuid):
         """
         Function to return a feature vector entry from the dictionary.
         """
-        # raise an exception if the UUID isn't in the dictionary
-        if uuid not in self.dictionary:
-            raise Exception(
-                f"The following UUID was not found in the dictionary: {uuid}"
-            )
-        return self.dictionary[uuid].get_feature_vector()
+        features = self.get_feature_matrix([uuid])[0]
+        feature_vector = {'UUID': uuid}
+        feature_vector.update(zip(FEATURE_NAMES, features.tolist()))
+        return feature_vector
 
-    
     def clear_stale_feature_vectors(self):
         """
         Function run periodically to clear feature vector entries which haven't had a recent
-        track update. 
+        track update. Only the expired tracks are visited.
+        """
+        with self.lock:
+            for uuid in self.expiry.expire(time.monotonic()):
+                self.store.remove(uuid)
+
+    def drop_tracks(self, uuids):
+        """
+        Function called when the radar drops tracks (track drop messages): the tracks are removed right away instead of
+        waiting to go stale. UUIDs that aren't in the dictionary are ignored.
+        """
+        dropped = 0
+        with self.lock:
+            for uuid in uuids:
+                if uuid in self.store:
+                    self.store.remove(uuid)
+                    self.expiry.discard(uuid)
+                    dropped += 1
+        return dropped
+
+    def close(self):
+        """
+        Function to stop the background eviction thread (stale tracks are no longer evicted afterwards).
         """
-        stale_list = []
-        if len(self) > 0:
-            for uuid, fv in self.dictionary.items():
-                # Pop every feature vector which has had over a minute since its last update, stale
-                if fv.past_stale_time():
-                    stale_list.append(uuid)
-            for uuid in stale_list:
-                self.dictionary.pop(uuid)
+        self.stopped.set()
+        if self.expiry_thread is not threading.current_thread():
+            self.expiry_thread.join()
 
 
-            
+def _expire_forever(records, stopped, resolution):
+    """
+    Body of the background eviction thread; clears a dictionary's stale tracks once per wheel tick, until the
+    dictionary is closed or garbage collected.
+    :param records: A weak reference to the Dictionary.
+    :param stopped: The Event set when the dictionary is closed.
+    :param resolution: The number of seconds between eviction passes.
+    :return: None
+    """
+    while not stopped.wait(resolution):
+        dictionary = records()
+        if dictionary is None:
+            return
+        dictionary.clear_stale_feature_vectors()
+        del dictionary
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import shutil
+
+from radar_track import FEATURE_NAMES, FEATURE_VERSION
+from utilities import constants as c
+
+# the arrays of a cache entry, each stored as a .npy file in the entry's directory (so they can be memory-mapped)
+ARRAYS = ('features', 'labels', 'track_ids', 'tracks')
+
+
+def file_digest(path, block_size=1 << 20):
+    """
+    Hashes the contents of a file, reading it in blocks so that large files aren't loaded into memory.
+    :param path: The path to the file.
+    :param block_size: The number of bytes read at a time.
+    :return: The SHA-256 digest of the file, as a hexadecimal string.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(files, track_length, num_rows=None, idle_rows=None):
+    """
+    Computes the key a feature matrix is cached under: a hash of everything the matrix depends on, so that any change
+    to the inputs, to the way they're split into labelled tracks or to the feature calculations gives a new key (and
+    the old entry is no longer used).
+    :param files: The input CSV files (or columnar captures, see columnar_store.py), in the order they're loaded.
+    :param track_length: The length tracks are split into.
+    :param num_rows: The number of input rows used, or None for all of them.
+    :param idle_rows: The number of rows after which chunked ingestion closes an idle track (see ingest.ChunkedIngest),
+    or None if tracks are only closed at the end of the input.
+    :return: The key, as a hexadecimal string.
+    """
+    # a columnar capture is identified by its description, which holds the digest of the CSV file it was converted from
+    digests = [file_digest(os.path.join(file, 'meta.json') if os.path.isdir(file) else file) for file in files]
+    inputs = {'files': digests, 'track_length': track_length, 'num_rows': num_rows,
+              'feature_version': FEATURE_VERSION, 'dataset_version': c.DATASET_VERSION, 'feature_names': FEATURE_NAMES}
+    if idle_rows is not None:
+        inputs['idle_rows'] = idle_rows
+    return hashlib.sha256(json.dumps(inputs).encode('utf-8')).hexdigest()
+
+
+def load(key, directory=c.FEATURE_CACHE_DIR):
+    """
+    Loads a cached feature matrix.
+    :param key: The key of the entry (see cache_key).
+    :param directory: The cache directory.
+    :return: A tuple (DataFrame with one row per track: the UUID, the FEATURE_NAMES columns, the Label and the Track,
+    dictionary of metadata saved with it), or None if there's no entry for the key.
+    """
+    entry = os.path.join(directory, key)
+    try:
+        with open(os.path.join(entry, 'meta.json')) as file:
+            metadata = json.load(file)
+        arrays = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+    except (OSError, ValueError):
+        return None
+
+    # the feature names are part of the key, so this only guards against entries written by hand
+    if metadata.get('feature_names') != FEATURE_NAMES:
+        return None
+
+    table = pd.DataFrame(arrays['features'], columns=FEATURE_NAMES)
+    table.insert(0, 'UUID', arrays['track_ids'].astype(object))
+    table['Label'] = arrays['labels']
+    table['Track'] = arrays['tracks'].astype(object)
+    return table, metadata
+
+
+def save(key, table, metadata=None, directory=c.FEATURE_CACHE_DIR, max_entries=c.FEATURE_CACHE_ENTRIES):
+    """
+    Caches a feature matrix, then deletes the oldest entries beyond max_entries. The entry is written to a temporary
+    directory and renamed into place, so an interrupted run never leaves a partial entry behind.
+    :param key: The key of the entry (see cache_key).
+    :param table: A DataFrame with one row per track: the UUID, the FEATURE_NAMES columns, the Label and the Track (the
+    UUID each track was split from).
+    :param metadata: A JSON-serializable dictionary saved with the entry (returned by load).
+    :param directory: The cache directory.
+    :param max_entries: The number of entries kept.
+    :return: The path to the entry.
+    """
+    entry = os.path.join(directory, key)
+    temporary = entry + f".tmp{os.getpid()}"
+    os.makedirs(temporary, exist_ok=True)
+
+    arrays = {'features': table[FEATURE_NAMES].to_numpy(dtype=np.float64),
+              'labels': table['Label'].to_numpy(dtype=np.int64),
+              'track_ids': table['UUID'].to_numpy().astype(str),
+              'tracks': table['Track'].to_numpy().astype(str)}
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary, name + '.npy'), array)
+    with open(os.path.join(temporary, 'meta.json'), 'w') as file:
+        json.dump(dict(metadata or {}, key=key, feature_names=FEATURE_NAMES, feature_version=FEATURE_VERSION,
+                       dataset_version=c.DATASET_VERSION), file)
+
+    # an entry written by a concurrent run holds the same data
+    if os.path.isdir(entry):
+        shutil.rmtree(temporary)
+    else:
+        os.replace(temporary, entry)
+
+    entries = [os.path.join(directory, name) for name in os.listdir(directory) if '.tmp' not in name]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for stale in entries[max_entries:]:
+        shutil.rmtree(stale, ignore_errors=True)
+    return entry
@@ -0,0 +1,172 @@
+import math
+import numpy as np
+
+# numba is optional: when it's installed the kernels are JIT-compiled, otherwise the NumPy versions are used
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _numpy_heading(lat, lon):
+    """
+    Calculates the heading between each pair of consecutive positions of a track.
+    :param lat: The latitudes of the track's positions (in chronological order).
+    :param lon: The longitudes of the track's positions (in chronological order).
+    :return: An array with len(lat) - 1 headings (NaN wherever a position is missing).
+    """
+    return np.arctan2(lat[:-1] - lat[1:], lon[:-1] - lon[1:])
+
+
+def _numpy_average_curvature(lat, lon):
+    """
+    Calculates the average curvature of a track, using the angle of the triangle formed by every three consecutive
+    positions.
+    :param lat: The latitudes of the track's positions (in chronological order).
+    :param lon: The longitudes of the track's positions (in chronological order).
+    :return: The average curvature, or NaN if no valid curvature could be calculated.
+    """
+    lat_diff = lat[:-1] - lat[1:]
+    lon_diff = lon[:-1] - lon[1:]
+
+    # distances between the first and second, first and third, and second and third positions of each triple
+    a = np.sqrt(lat_diff[:-1] ** 2 + lon_diff[:-1] ** 2)
+    b = np.sqrt((lat[:-2] - lat[2:]) ** 2 + (lon[:-2] - lon[2:]) ** 2)
+    c = np.sqrt(lat_diff[1:] ** 2 + lon_diff[1:] ** 2)
+
+    # arccos returns NaN outside of [-1, 1]; those angles are left out of the mean
+    with np.errstate(invalid="ignore"):
+        curvature = np.arccos((a ** 2 - b ** 2 - c ** 2) / (2 * b * c + 1e-6))
+    curvature = curvature[~np.isnan(curvature)]
+    return curvature.mean() if len(curvature) > 0 else math.nan
+
+
+def _numpy_diff_moments(values, n):
+    """
+    Calculates the m1 and m2 smoothness statistics of a signal from its first differences.
+    :param values: The signal (in chronological order); NaNs are skipped.
+    :param n: The number of updates the statistics are normalized by.
+    :return: A tuple (m1, m2).
+    """
+    diff = np.diff(values)
+    valid = diff[~np.isnan(diff)]
+    q = np.sum(valid) / n
+    m1 = np.sum((valid - q) ** 2) / n
+    m2 = m1 / (np.sum(np.abs(valid)) / n + 1e-6)
+    return m1, m2
+
+
+def _loop_heading(lat, lon):
+    """
+    Loop version of _numpy_heading, compiled by numba.
+    """
+    out = np.empty(max(len(lat) - 1, 0))
+    for i in range(len(out)):
+        out[i] = math.atan2(lat[i] - lat[i + 1], lon[i] - lon[i + 1])
+    return out
+
+
+def _loop_average_curvature(lat, lon):
+    """
+    Loop version of _numpy_average_curvature, compiled by numba.
+    """
+    total = 0.0
+    count = 0
+    for i in range(len(lat) - 2):
+        a = math.sqrt((lat[i] - lat[i + 1]) ** 2 + (lon[i] - lon[i + 1]) ** 2)
+        b = math.sqrt((lat[i] - lat[i + 2]) ** 2 + (lon[i] - lon[i + 2]) ** 2)
+        c = math.sqrt((lat[i + 1] - lat[i + 2]) ** 2 + (lon[i + 1] - lon[i + 2]) ** 2)
+        ratio = (a ** 2 - b ** 2 - c ** 2) / (2 * b * c + 1e-6)
+        if -1.0 <= ratio <= 1.0:
+            total += math.acos(ratio)
+            count += 1
+    return total / count if count > 0 else math.nan
+
+
+def _loop_diff_moments(values, n):
+    """
+    Loop version of _numpy_diff_moments, compiled by numba.
+    """
+    total = 0.0
+    abs_total = 0.0
+    for i in range(1, len(values)):
+        d = values[i] - values[i - 1]
+        if not math.isnan(d):
+            total += d
+            abs_total += abs(d)
+    q = total / n
+    squares = 0.0
+    for i in range(1, len(values)):
+        d = values[i] - values[i - 1]
+        if not math.isnan(d):
+            squares += (d - q) ** 2
+    m1 = squares / n
+    return m1, m1 / (abs_total / n + 1e-6)
+
+
+# the available backends, each mapping kernel names to implementations
+BACKENDS = {
+    'numpy': {
+        'heading': _numpy_heading,
+        'average_curvature': _numpy_average_curvature,
+        'diff_moments': _numpy_diff_moments,
+    },
+}
+# the kernels only touch arrays and floats, so they release the GIL and don't stall other threads while they run
+if numba is not None:
+    BACKENDS['numba'] = {
+        'heading': numba.njit(cache=True, nogil=True)(_loop_heading),
+        'average_curvature': numba.njit(cache=True, nogil=True)(_loop_average_curvature),
+        'diff_moments': numba.njit(cache=True, nogil=True)(_loop_diff_moments),
+    }
+
+# the backend in use: the JIT-compiled kernels when available, the NumPy kernels otherwise
+BACKEND = 'numba' if 'numba' in BACKENDS else 'numpy'
+heading = BACKENDS[BACKEND]['heading']
+average_curvature = BACKENDS[BACKEND]['average_curvature']
+diff_moments = BACKENDS[BACKEND]['diff_moments']
+
+# golden values every backend must reproduce (to GOLDEN_TOLERANCE), taken from the original pandas implementation: a
+# short zig-zag track with a repeated position and a missing range value
+GOLDEN_LAT = np.array([40.0, 40.0001, 40.0003, 40.0003, 40.0002, 40.0005, 40.0004])
+GOLDEN_LON = np.array([-90.0, -90.0002, -90.0001, -90.0001, -90.0004, -90.0006, -90.0005])
+GOLDEN_RANGE = np.array([1200.0, 1210.5, 1219.0, np.nan, 1241.25, 1250.0, 1262.5])
+GOLDEN_HEADING = [-0.46364760900080615, -2.0344439358099136, 0.0, 0.32175055441085304, -0.9827937232363975,
+                  2.356194490192345]
+GOLDEN_AVERAGE_CURVATURE = 1.6570550676763047
+GOLDEN_DIFF_MOMENTS = (12.098214285714286, 2.1040369011612845)
+GOLDEN_TOLERANCE = 1e-12
+
+
+def check_golden_values(backend=BACKEND):
+    """
+    Checks a backend's kernels against the golden values.
+    :param backend: The name of the backend to check (see BACKENDS).
+    :return: None (an AssertionError is raised if a kernel doesn't reproduce its golden value).
+    """
+    kernels = BACKENDS[backend]
+    checks = [
+        ('heading', kernels['heading'](GOLDEN_LAT, GOLDEN_LON), GOLDEN_HEADING),
+        ('average_curvature', kernels['average_curvature'](GOLDEN_LAT, GOLDEN_LON), GOLDEN_AVERAGE_CURVATURE),
+        ('diff_moments', kernels['diff_moments'](GOLDEN_RANGE, len(GOLDEN_RANGE)), GOLDEN_DIFF_MOMENTS),
+    ]
+    for name, result, expected in checks:
+        assert np.allclose(result, expected, rtol=GOLDEN_TOLERANCE, atol=0), \
+            f"{backend} {name} kernel returned {result}, expected {expected}"
+
+
+def describe_backend(streaming=True):
+    """
+    Checks the active backend against the golden values and describes the live feature path and the backend.
+    :param streaming: True if live tracks use the streaming accumulator (which doesn't call the kernels), False if they
+    recompute their features over a history window (which does).
+    :return: A one-line description, for logging at startup.
+    """
+    check_golden_values(BACKEND)
+    if BACKEND == 'numba':
+        backend = f"numba {numba.__version__} (JIT)"
+    else:
+        backend = "numpy (numba not installed)"
+    if streaming:
+        return f"live features: streaming accumulator (feature kernels unused; {backend} available)"
+    return f"live features: history window, feature kernels: {backend}"
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import time
+
+from radar_track import FEATURE_COMPUTATIONS, FEATURE_NAMES, PLOT_FIELDS, accumulate, finalize, new_state
+
+
+def used_features(forest, cascade=None):
+    """
+    Finds the features a flattened model actually splits on (a feature it never splits on can't change a prediction).
+    :param forest: The FlatForest.
+    :param cascade: The model's Cascade, if it has one (its first stage's splits count too).
+    :return: The names of the features used, in FEATURE_NAMES order.
+    """
+    used = set()
+    for model in [forest] + ([cascade.first_stage] if cascade is not None else []):
+        names = model.feature_names or FEATURE_NAMES[:model.n_features]
+        used.update(name for name, points in zip(names, model.split_points) if len(points) > 0)
+    return [name for name in FEATURE_NAMES if name in used]
+
+
+def build_manifest(forest, cascade=None, importances=None):
+    """
+    Builds the feature manifest saved with a model: the features the live path has to compute for it, and (if known)
+    each feature's importance.
+    :param forest: The model's FlatForest.
+    :param cascade: The model's Cascade, if it has one.
+    :param importances: A dictionary mapping the model's features to their importance, or None.
+    :return: A JSON-serializable dictionary.
+    """
+    return {'features': used_features(forest, cascade),
+            'importances': {name: float(value) for name, value in (importances or {}).items()}}
+
+
+def model_importances(model):
+    """
+    Reads a fitted scikit-learn model's feature importances.
+    :param model: The fitted model.
+    :return: A dictionary mapping each of the model's features to its importance, or None if the model doesn't have
+    feature importances.
+    """
+    if not hasattr(model, 'feature_importances_'):
+        return None
+    names = list(getattr(model, 'feature_names_in_', FEATURE_NAMES))
+    return dict(zip(names, model.feature_importances_.tolist()))
+
+
+def measure_costs(data, names=FEATURE_NAMES, max_updates=20000, repeats=5):
+    """
+    Measures what each feature costs the live (streaming) path per update: the time finalize takes to compute that
+    feature from an accumulator state, less the time it takes to compute none (live tracks maintain every computation
+    whatever the model uses, so finalizing is what a dropped feature saves).
+    :param data: A DataFrame of track updates (with a UUID column and the PLOT_FIELDS columns), in chronological order.
+    :param names: The features to measure.
+    :param max_updates: At most this many updates of data are timed.
+    :param repeats: Each feature is timed this many times (the fastest time is kept).
+    :return: A dictionary mapping each feature to its cost in microseconds per update (features that share a
+    computation, like the m1 and m2 of a signal, are each charged for all of it).
+    """
+    tracks = [group[PLOT_FIELDS].to_numpy(dtype=np.float64).tolist() for _, group in data.groupby("UUID", sort=False)]
+    updates, budget = [], max_updates
+    for track in tracks:
+        updates.append(track[:budget])
+        budget -= len(updates[-1])
+        if budget <= 0:
+            break
+
+    # the accumulator state after each update, which the live path finalizes once per update it classifies
+    states = []
+    for track in updates:
+        state = new_state()
+        for speed, az, el, range_, lat, lon, _, rcs in track:
+            accumulate(state, speed, az, el, range_, lat, lon, rcs)
+            states.append(list(state))
+
+    def time_features(feature_names):
+        start = time.perf_counter()
+        for state in states:
+            finalize(state, feature_names)
+        return time.perf_counter() - start
+
+    # every feature is timed once per round, alongside no feature at all, and the fastest round of each is kept (which
+    # filters out most of the timing noise)
+    best = {feature_names: np.inf for feature_names in [(name,) for name in names] + [()]}
+    for _ in range(repeats):
+        for feature_names in best:
+            best[feature_names] = min(best[feature_names], time_features(feature_names))
+    return {name: max(0.0, 1e6 * (best[(name,)] - best[()]) / max(len(states), 1)) for name in names}
+
+
+def feature_report(importances, used, costs=None, dropped=()):
+    """
+    Tabulates each feature's importance next to its live compute cost.
+    :param importances: A dictionary mapping features to their importance (features the model wasn't trained on are
+    missing).
+    :param used: The features the model splits on.
+    :param costs: A dictionary mapping features to their cost in microseconds per update (see measure_costs), or None.
+    :param dropped: The features dropped from the model.
+    :return: A DataFrame with one row per feature, sorted by decreasing importance.
+    """
+    rows = []
+    for name in FEATURE_NAMES:
+        row = {'feature': name, 'importance': importances.get(name, np.nan), 'used': name in used,
+               'dropped': name in dropped, 'computations': ' '.join(FEATURE_COMPUTATIONS[name])}
+        if costs is not None:
+            row['us_per_update'] = costs.get(name, np.nan)
+        rows.append(row)
+    return pd.DataFrame(rows).sort_values('importance', ascending=False, na_position='last').reset_index(drop=True)
+
+
+def select_features(importances, min_importance):
+    """
+    Picks the features whose importance is at least a given threshold.
+    :param importances: A dictionary mapping features to their importance.
+    :param min_importance: The smallest importance a kept feature may have.
+    :return: A tuple (kept features, dropped features), both in FEATURE_NAMES order.
+    """
+    kept = [name for name in FEATURE_NAMES if name in importances and importances[name] >= min_importance]
+    dropped = [name for name in FEATURE_NAMES if name in importances and importances[name] < min_importance]
+    return kept, dropped
@@ -0,0 +1,360 @@
+import functools
+import numpy as np
+
+# numba is optional: when it's installed the forest is walked by a JIT-compiled loop, otherwise by vectorized NumPy
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _round_down_float32(values):
+    """
+    Rounds float64 values down to the nearest float32 values.
+    :param values: A float64 array.
+    :return: A float32 array holding, for each value, the largest float32 that is less than or equal to it.
+    """
+    rounded = values.astype(np.float32)
+    too_large = rounded.astype(np.float64) > values
+    rounded[too_large] = np.nextafter(rounded[too_large], np.float32(-np.inf))
+    return rounded
+
+
+def _numpy_walk(X, roots, feature, threshold, left, right, max_depth):
+    """
+    Walks every row of X down every tree of a flattened forest, one tree level at a time.
+    :param X: The (n_rows, n_features) float32 input.
+    :param roots: The index of each tree's root node.
+    :param feature: The feature tested by each node.
+    :param threshold: The threshold of each node (rows go left when their feature is <= the threshold).
+    :param left: The left child of each node (leaves point to themselves).
+    :param right: The right child of each node (leaves point to themselves).
+    :param max_depth: The depth of the deepest tree.
+    :return: An (n_rows, n_trees) array with the leaf each row reaches in each tree.
+    """
+    nodes = np.repeat(roots[np.newaxis, :], len(X), axis=0)
+    rows = np.arange(len(X))[:, np.newaxis]
+    for _ in range(max_depth):
+        go_left = X[rows, feature[nodes]] <= threshold[nodes]
+        nodes = np.where(go_left, left[nodes], right[nodes])
+    return nodes
+
+
+def _loop_walk(X, roots, feature, threshold, left, right, max_depth):
+    """
+    Loop version of _numpy_walk, compiled by numba.
+    """
+    leaves = np.empty((X.shape[0], roots.shape[0]), dtype=np.int64)
+    for i in range(X.shape[0]):
+        for t in range(roots.shape[0]):
+            node = roots[t]
+            while left[node] != node:
+                if X[i, feature[node]] <= threshold[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            leaves[i, t] = node
+    return leaves
+
+
+def _numpy_proba(X, roots, feature, threshold, left, right, proba, max_depth):
+    """
+    Calculates the sum of the trees' class probabilities for every row of X.
+    :param X: The (n_rows, n_features) float32 input.
+    :param roots: The index of each tree's root node.
+    :param feature: The feature tested by each node.
+    :param threshold: The threshold of each node.
+    :param left: The left child of each node (leaves point to themselves).
+    :param right: The right child of each node (leaves point to themselves).
+    :param proba: The class probabilities of each leaf.
+    :param max_depth: The depth of the deepest tree.
+    :return: An (n_rows, n_classes) array with the sum over the trees of each row's class probabilities.
+    """
+    leaves = _numpy_walk(X, roots, feature, threshold, left, right, max_depth)
+
+    # the trees are summed one at a time in order, like scikit-learn does, so the sums round identically
+    total = np.zeros((len(X), proba.shape[1]))
+    for t in range(len(roots)):
+        total += proba[leaves[:, t]]
+    return total
+
+
+def _loop_proba(X, roots, feature, threshold, left, right, proba, max_depth):
+    """
+    Loop version of _numpy_proba, compiled by numba (each row's trees are summed in the same order).
+    """
+    # trees are the outer loop, so each tree's nodes stay in cache while every row walks it
+    total = np.zeros((X.shape[0], proba.shape[1]))
+    for t in range(roots.shape[0]):
+        for i in range(X.shape[0]):
+            node = roots[t]
+            while left[node] != node:
+                if X[i, feature[node]] <= threshold[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            for k in range(proba.shape[1]):
+                total[i, k] += proba[node, k]
+    return total
+
+
+def _numpy_early_exit(X, roots, feature, threshold, left, right, proba, max_depth, cutoff, margin):
+    """
+    Sums the trees' class probabilities for every row of X like _numpy_proba, but stops summing a row once the
+    remaining trees can no longer move its mean positive-class (class 1) probability across the cut-off.
+    :param X: The (n_rows, n_features) float32 input.
+    :param roots: The index of each tree's root node.
+    :param feature: The feature tested by each node.
+    :param threshold: The threshold of each node.
+    :param left: The left child of each node (leaves point to themselves).
+    :param right: The right child of each node (leaves point to themselves).
+    :param proba: The (n_nodes, 2) class probabilities of each leaf.
+    :param max_depth: The depth of the deepest tree.
+    :param cutoff: The positive class is predicted when its mean probability over all trees exceeds the cut-off.
+    :param margin: How far below the cut-off a row's highest reachable mean must be before it's decided negative
+    (covers the rounding of the remaining sums).
+    :return: A tuple ((n_rows, 2) sums of the class probabilities over the trees evaluated, number of trees evaluated
+    for each row).
+    """
+    n_trees = len(roots)
+    total = np.zeros((len(X), proba.shape[1]))
+    evaluated = np.zeros(len(X), dtype=np.int64)
+    active = np.arange(len(X))
+    for t in range(n_trees):
+        nodes = np.full(len(active), roots[t])
+        for _ in range(max_depth):
+            go_left = X[active, feature[nodes]] <= threshold[nodes]
+            nodes = np.where(go_left, left[nodes], right[nodes])
+        total[active] += proba[nodes]
+        evaluated[active] += 1
+
+        remaining = n_trees - t - 1
+        positive = total[active, 1]
+        decided = (positive / n_trees > cutoff) | ((positive + remaining) / n_trees <= cutoff - margin)
+        active = active[~decided]
+        if len(active) == 0:
+            break
+    return total, evaluated
+
+
+def _loop_early_exit(X, roots, feature, threshold, left, right, proba, max_depth, cutoff, margin):
+    """
+    Loop version of _numpy_early_exit, compiled by numba.
+    """
+    n_trees = roots.shape[0]
+    total = np.zeros((X.shape[0], proba.shape[1]))
+    evaluated = np.zeros(X.shape[0], dtype=np.int64)
+    for i in range(X.shape[0]):
+        for t in range(n_trees):
+            node = roots[t]
+            while left[node] != node:
+                if X[i, feature[node]] <= threshold[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            for k in range(proba.shape[1]):
+                total[i, k] += proba[node, k]
+            evaluated[i] = t + 1
+
+            remaining = n_trees - t - 1
+            if total[i, 1] / n_trees > cutoff or (total[i, 1] + remaining) / n_trees <= cutoff - margin:
+                break
+    return total, evaluated
+
+
+# the kernels in use: the JIT-compiled loops when available, the vectorized NumPy versions otherwise; the loops only
+# touch arrays, so they release the GIL, and the listen pipeline's event loop keeps receiving while a batch is
+# classified in the classify stage's thread
+BACKEND = 'numba' if numba is not None else 'numpy'
+if numba is not None:
+    walk = numba.njit(cache=True, nogil=True)(_loop_walk)
+    sum_proba = numba.njit(cache=True, nogil=True)(_loop_proba)
+    early_exit_proba = numba.njit(cache=True, nogil=True)(_loop_early_exit)
+else:
+    walk = _numpy_walk
+    sum_proba = _numpy_proba
+    early_exit_proba = _numpy_early_exit
+
+# the rounding error of a sum of at most a few thousand probabilities is far below this, so a row whose highest
+# reachable mean is this far below the cut-off can't end up above it
+EARLY_EXIT_MARGIN = 1e-9
+
+
+class FlatForest:
+    """
+    A random forest flattened into contiguous node arrays, evaluated without going through scikit-learn. The nodes of
+    all trees share one set of arrays (a tree's nodes are offset by the number of nodes of the trees before it), node
+    indices and features are int32 and thresholds float32 (to keep more of the forest in cache), and each leaf holds
+    its tree's class probabilities.
+
+    Predictions are bit-for-bit identical to RandomForestClassifier.predict and predict_proba: scikit-learn converts
+    the input to float32 and compares it against float64 thresholds, so rounding each threshold down to float32 sends
+    every row down the same branches, and the leaf probabilities are normalized and summed in the same order as
+    scikit-learn does. (Leaf probabilities stay float64, since rounding them would change the confidences.)
+
+    Attributes:
+        classes: The class labels.
+        n_features: The number of features the forest was trained on.
+        feature_names: The names of those features (None if the forest was trained without names).
+        roots: The index of each tree's root node.
+        feature: The feature tested by each node (0 for leaves).
+        threshold: The float32 threshold of each node.
+        left: The left child of each node (leaves point to themselves).
+        right: The right child of each node (leaves point to themselves).
+        proba: The (n_nodes, n_classes) class probabilities of each leaf (zero for internal nodes).
+        max_depth: The depth of the deepest tree.
+        split_points: For each feature, the sorted distinct thresholds the forest compares it against (computed lazily).
+    """
+    def __init__(self, classes, n_features, feature_names, roots, feature, threshold, left, right, proba, max_depth):
+        self.classes = classes
+        self.n_features = n_features
+        self.feature_names = feature_names
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.proba = proba
+        self.max_depth = max_depth
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        """
+        Flattens a fitted scikit-learn RandomForestClassifier (single-output).
+        :param forest: The fitted forest.
+        :return: The flattened forest.
+        """
+        n_classes = len(forest.classes_)
+        roots, features, thresholds, lefts, rights, probas = [], [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            ids = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            # the leaf probabilities are normalized exactly like DecisionTreeClassifier.predict_proba does
+            proba = tree.value[:, 0, :n_classes].copy()
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            proba /= normalizer
+            proba[~is_leaf] = 0.0
+
+            roots.append(offset)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(_round_down_float32(tree.threshold))
+            lefts.append(np.where(is_leaf, ids, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, ids, tree.children_right) + offset)
+            probas.append(proba)
+            offset += tree.node_count
+
+        return cls(classes=np.asarray(forest.classes_),
+                   n_features=forest.n_features_in_,
+                   feature_names=list(getattr(forest, 'feature_names_in_', [])) or None,
+                   roots=np.array(roots, dtype=np.int64),
+                   feature=np.concatenate(features).astype(np.int32),
+                   threshold=np.concatenate(thresholds),
+                   left=np.concatenate(lefts).astype(np.int32),
+                   right=np.concatenate(rights).astype(np.int32),
+                   proba=np.ascontiguousarray(np.concatenate(probas)),
+                   max_depth=max(estimator.tree_.max_depth for estimator in forest.estimators_))
+
+    def __len__(self):
+        return len(self.roots)
+
+    @property
+    def node_count(self):
+        return len(self.feature)
+
+    @functools.cached_property
+    def split_points(self):
+        """
+        For each feature, the sorted distinct thresholds the forest compares it against. Computed on first use (it reads
+        every node, which would page in the whole of a memory-mapped forest at load time).
+        """
+        # two inputs that fall between the same pair of split points on every feature take the same branches in every
+        # tree, so they get identical predictions
+        internal = self.left != np.arange(len(self.left))
+        return [np.unique(self.threshold[internal & (self.feature == f)]) for f in range(self.n_features)]
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes held by the node arrays.
+        """
+        arrays = [self.roots, self.feature, self.threshold, self.left, self.right, self.proba]
+        return sum(array.nbytes for array in arrays)
+
+    def threshold_crossings(self, A, B):
+        """
+        Counts how many of the forest's split points lie between each pair of rows of A and B. Rows with no split
+        points between them get bit-for-bit identical predictions.
+        :param A: An (n_rows, n_features) input.
+        :param B: Another (n_rows, n_features) input.
+        :return: An array with the number of split points crossed between each pair of rows (over all features).
+        """
+        A = np.asarray(A, dtype=np.float32).reshape(-1, self.n_features)
+        B = np.asarray(B, dtype=np.float32).reshape(-1, self.n_features)
+        crossings = np.zeros(len(A), dtype=np.int64)
+        for f, points in enumerate(self.split_points):
+            # a value goes right at exactly the split points below it, so the count below it identifies its interval
+            crossings += np.abs(np.searchsorted(points, A[:, f]) - np.searchsorted(points, B[:, f]))
+        return crossings
+
+    def apply(self, X):
+        """
+        Finds the leaf each row reaches in each tree.
+        :param X: The (n_rows, n_features) input (a DataFrame or an array, converted to float32 like scikit-learn).
+        :return: An (n_rows, n_trees) array of (flattened) leaf indices.
+        """
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32).reshape(-1, self.n_features))
+        return walk(X, self.roots, self.feature, self.threshold, self.left, self.right, self.max_depth)
+
+    def predict_proba(self, X):
+        """
+        Calculates the class probabilities of each row (the mean of the trees' probabilities).
+        :param X: The (n_rows, n_features) input.
+        :return: An (n_rows, n_classes) array of probabilities.
+        """
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32).reshape(-1, self.n_features))
+        proba = sum_proba(X, self.roots, self.feature, self.threshold, self.left, self.right, self.proba,
+                          self.max_depth)
+        proba /= len(self.roots)
+        return proba
+
+    def predict(self, X, cutoff=None):
+        """
+        Classifies each row and returns the classification's confidence, in one pass over the forest.
+        :param X: The (n_rows, n_features) input.
+        :param cutoff: If None, each row gets its most probable class (like scikit-learn); otherwise (binary forests
+        only) rows get the second class when its probability exceeds the cut-off, and the first class otherwise.
+        :return: A tuple (predicted class of each row, confidence of each prediction (the probability of the predicted
+        class)).
+        """
+        proba = self.predict_proba(X)
+        if cutoff is None:
+            return self.classes.take(np.argmax(proba, axis=1)), proba.max(axis=1)
+        chosen = (proba[:, 1] > cutoff).astype(np.int64)
+        return self.classes.take(chosen), proba[np.arange(len(proba)), chosen]
+
+    def predict_early_exit(self, X, cutoff):
+        """
+        Classifies each row like predict(X, cutoff), but evaluates each row's trees in order and stops as soon as the
+        remaining trees can no longer move the row's mean second-class probability across the cut-off. The predicted
+        classes are exactly those of predict(X, cutoff).
+        :param X: The (n_rows, n_features) input.
+        :param cutoff: The second class is predicted when its probability (over all trees) exceeds the cut-off.
+        :return: A tuple (predicted class of each row, confidence of each prediction, number of trees evaluated for
+        each row). The confidence of a row that stopped early is the mean probability of its class over the trees
+        evaluated; rows that evaluated every tree get exactly the confidence predict returns.
+        """
+        if len(self.classes) != 2:
+            raise ValueError(f"early exit needs a binary forest, this forest has {len(self.classes)} classes")
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32).reshape(-1, self.n_features))
+        total, evaluated = early_exit_proba(X, self.roots, self.feature, self.threshold, self.left, self.right,
+                                            self.proba, self.max_depth, float(cutoff), EARLY_EXIT_MARGIN)
+
+        # a row that exceeded the cut-off part-way can only have gone higher (the remaining probabilities are
+        # non-negative and sums of them round monotonically), and a row that stopped below it could not have reached it
+        chosen = (total[:, 1] / len(self.roots) > cutoff).astype(np.int64)
+        total /= evaluated[:, np.newaxis]
+        return self.classes.take(chosen), total[np.arange(len(total)), chosen], evaluated
@@ -0,0 +1,36 @@
+import argparse
+import glob
+import os
+import time
+
+import columnar_store
+from utilities import constants as c
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Import Data',
+        description='Converts CSV captures once into columnar captures (only the needed columns, typed, partitioned by Combat ID), which train.py and test.py load much faster.')
+
+    parser.add_argument('-i', '--inputFiles', type=str, default=[], nargs='+', help="Converts all files listed")
+    parser.add_argument('-d', '--inputDirectories', type=str, default=[], nargs='+', help="Converts all files in these directories")
+    parser.add_argument('-o', '--outputDirectory', type=str, default=c.COLUMNAR_DIR, help="Directory the columnar captures are written to (one subdirectory per file)")
+    parser.add_argument('-k', '--chunkSize', type=int, default=c.INGEST_CHUNK_ROWS, help="Number of CSV rows read at a time")
+
+    args = parser.parse_args()
+
+    files = set(args.inputFiles)
+    for dir in args.inputDirectories:
+        files |= set(glob.glob(dir + '/*' + '.csv', recursive=True))
+    if len(files) == 0:
+        parser.error("no input files given (see --inputFiles and --inputDirectories)")
+
+    os.makedirs(args.outputDirectory, exist_ok=True)
+    for file in sorted(files):
+        start = time.perf_counter()
+        capture = columnar_store.convert_csv(file, args.outputDirectory, args.chunkSize)
+        meta = columnar_store.read_meta(capture)
+        size = sum(os.path.getsize(path) for path in glob.glob(capture + '/**', recursive=True) if os.path.isfile(path))
+        print(f"Converted {file} ({os.path.getsize(file)} bytes, {meta['rows']} rows, {meta['tracks']} tracks) to "
+              f"{capture} ({size} bytes) in {time.perf_counter() - start:.1f} s; updates per Combat ID: "
+              f"{meta['partitions']}")
@@ -0,0 +1,236 @@
+import columnar_store
+import numpy as np
+import pandas as pd
+
+from batch_features import segment_features
+from dataset import INPUT_COLUMNS, LABELS
+from radar_track import FEATURE_NAMES, PLOT_FIELDS
+from utilities import constants as c
+
+
+class OpenTrack:
+    """
+    The updates of a track that haven't been assigned to a finished segment yet.
+
+    Attributes:
+        values: The pending updates (arrays of PLOT_FIELDS rows, in chronological order).
+        labels: The label of each pending update.
+        n: The number of pending updates.
+        segment: The index of the track's next segment.
+        last_row: The input row of the track's latest update.
+    """
+    def __init__(self, segment=0):
+        self.values = []
+        self.labels = []
+        self.n = 0
+        self.segment = segment
+        self.last_row = 0
+
+    def take(self, n_rows):
+        """
+        Removes the oldest pending updates.
+        :param n_rows: The number of updates to remove.
+        :return: A tuple (values, labels) of the removed updates.
+        """
+        values = np.concatenate(self.values)
+        labels = np.concatenate(self.labels)
+        self.values, self.labels = [values[n_rows:]], [labels[n_rows:]]
+        self.n -= n_rows
+        return values[:n_rows], labels[:n_rows]
+
+
+class ChunkedIngest:
+    """
+    Turns CSV files of track updates into the feature vectors of their tracks without loading the files into memory:
+    the files are read in chunks, each track's pending updates are carried over from one chunk to the next, and a
+    track's segments are emitted as soon as they're finished. Tracks are split into segments exactly like train.py
+    splits them (segments of track_length updates, the last one taking the remaining updates), so a track only ever
+    holds fewer than 2 * track_length pending updates and memory is bounded by the number of open tracks.
+
+    Segments of split tracks are named "<UUID>-<segment index>"; tracks that aren't split keep their UUID.
+
+    Attributes:
+        track_length: The length tracks are split into.
+        chunk_size: The number of rows read at a time.
+        batch_rows: Finished segments are held until they have this many updates, then their features are computed in
+        one batch.
+        idle_rows: A track is closed once this many rows were read without an update to it (0 or None keeps every track
+        open until the end of the input; otherwise a track that pauses for longer is split differently than in memory).
+        open: A dictionary mapping the UUID of each open track to its OpenTrack.
+        segments: A dictionary mapping the UUID of each closed track to its number of segments (a closed track that
+        gets another update continues its numbering).
+        finished: The finished segments waiting for their features, as (name, UUID, values, label) tuples.
+        finished_rows: The number of updates of the finished segments.
+        rows_read: The number of input rows read.
+        rows_labelled: The number of input rows with a training label.
+        pending_rows: The number of pending updates over every open track.
+        peak_open: The largest number of open tracks so far.
+        peak_pending_rows: The largest number of pending updates so far.
+    """
+    def __init__(self, track_length, chunk_size=c.INGEST_CHUNK_ROWS, batch_rows=c.INGEST_BATCH_ROWS,
+                 idle_rows=c.INGEST_IDLE_ROWS):
+        self.track_length = track_length
+        self.chunk_size = chunk_size
+        self.batch_rows = batch_rows
+        self.idle_rows = idle_rows
+        self.open = dict()
+        self.segments = dict()
+        self.finished = []
+        self.finished_rows = 0
+        self.rows_read = 0
+        self.rows_labelled = 0
+        self.pending_rows = 0
+        self.peak_open = 0
+        self.peak_pending_rows = 0
+
+    def read(self, files, num_rows=None):
+        """
+        Reads the input files in order, yielding the feature vectors of finished tracks as they're computed.
+        :param files: The CSV files (or columnar captures, read a range of rows at a time from their memory-mapped
+        columns) to read.
+        :param num_rows: If not None, only the first num_rows labelled updates (over all files) are used.
+        :return: A generator of DataFrames with one row per finished segment: the UUID (segment name), the
+        FEATURE_NAMES columns, the Label and the Track (the UUID of the segment's track); segments with a NaN feature
+        are dropped.
+        """
+        for file in files:
+            if columnar_store.is_capture(file):
+                rows = columnar_store.read_meta(file)['rows']
+                chunks = (columnar_store.read_capture(file, PLOT_FIELDS, list(LABELS), (lower, lower + self.chunk_size))
+                          for lower in range(0, rows, self.chunk_size))
+            else:
+                chunks = pd.read_csv(file, usecols=lambda column: column in INPUT_COLUMNS, chunksize=self.chunk_size)
+            for chunk in chunks:
+                yield from self.feed(chunk, None if num_rows is None else num_rows - self.rows_labelled)
+                if num_rows is not None and self.rows_labelled >= num_rows:
+                    break
+            if num_rows is not None and self.rows_labelled >= num_rows:
+                break
+        yield from self.close()
+
+    def feed(self, chunk, limit=None):
+        """
+        Adds a chunk of updates to the open tracks, finishing the segments that can no longer change.
+        :param chunk: A DataFrame of track updates (with the INPUT_COLUMNS columns).
+        :param limit: If not None, at most this many of the chunk's labelled updates are used.
+        :return: A generator of DataFrames of feature vectors (see read).
+        """
+        # updates without a UUID (which groupby drops) or without a training label are dropped, but still count as input
+        # rows
+        labels = chunk['Combat ID'].map(LABELS)
+        kept = (chunk['UUID'].notna() & labels.notna()).to_numpy()
+        if limit is not None:
+            kept &= np.cumsum(kept) <= limit
+        positions = self.rows_read + np.flatnonzero(kept)
+        self.rows_read += len(chunk)
+        self.rows_labelled += int(np.count_nonzero(kept))
+        chunk = chunk[kept]
+        values = chunk[PLOT_FIELDS].to_numpy(dtype=np.float64)
+        labels = labels[kept].to_numpy(dtype=np.int64)
+
+        # group the chunk's updates by track (stable, so each track keeps its chronological order)
+        codes, uuids = pd.factorize(chunk['UUID'])
+        order = np.argsort(codes, kind='stable')
+        bounds = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0, True])
+
+        length = self.track_length
+        for code, (lower, upper) in enumerate(zip(bounds[:-1], bounds[1:])):
+            uuid = uuids[code]
+            track = self.open.get(uuid)
+            if track is None:
+                track = self.open[uuid] = OpenTrack(self.segments.pop(uuid, 0))
+            group = order[lower:upper]
+            track.values.append(values[group])
+            track.labels.append(labels[group])
+            track.n += len(group)
+            track.last_row = positions[group[-1]]
+            self.pending_rows += len(group)
+
+            # a segment keeps exactly track_length updates once another full segment follows it (otherwise it takes
+            # the track's remaining updates), so it's finished once the track has two segments' worth of updates
+            while track.n >= 2 * length:
+                self._finish(uuid, track, length, last=False)
+
+        if self.idle_rows:
+            for uuid in [uuid for uuid, track in self.open.items() if self.rows_read - track.last_row > self.idle_rows]:
+                self._close(uuid)
+
+        self.peak_open = max(self.peak_open, len(self.open))
+        self.peak_pending_rows = max(self.peak_pending_rows, self.pending_rows)
+        if self.finished_rows >= self.batch_rows:
+            yield self._emit()
+
+    def close(self):
+        """
+        Closes every open track (the end of the input finishes their last segments).
+        :return: A generator of DataFrames of feature vectors (see read).
+        """
+        for uuid in list(self.open):
+            self._close(uuid)
+        if len(self.finished) > 0:
+            yield self._emit()
+
+    def _close(self, uuid):
+        """
+        Finishes the last segment of an open track and closes it.
+        :param uuid: The UUID of the track.
+        :return: None
+        """
+        track = self.open.pop(uuid)
+        if track.n > 0:
+            self._finish(uuid, track, track.n, last=True)
+        self.segments[uuid] = track.segment
+
+    def _finish(self, uuid, track, n_rows, last):
+        """
+        Moves a track's oldest pending updates into a finished segment.
+        :param uuid: The UUID of the track.
+        :param track: Its OpenTrack.
+        :param n_rows: The number of updates in the segment.
+        :param last: True if this is the track's last segment.
+        :return: None
+        """
+        values, labels = track.take(n_rows)
+        self.pending_rows -= n_rows
+        name = uuid if last and track.segment == 0 and n_rows <= self.track_length else f"{uuid}-{track.segment}"
+        track.segment += 1
+
+        # a segment with a drone update is a drone
+        self.finished.append((name, uuid, values, int(labels.max())))
+        self.finished_rows += n_rows
+
+    def _emit(self):
+        """
+        Computes the features of the finished segments.
+        :return: A DataFrame of feature vectors (see read).
+        """
+        names, uuids, values, labels = zip(*self.finished)
+        lengths = np.array([len(segment) for segment in values])
+        starts = np.r_[0, np.cumsum(lengths)[:-1]]
+        features = pd.DataFrame(segment_features(np.concatenate(values), starts), columns=FEATURE_NAMES)
+        features.insert(0, 'UUID', names)
+        features['Label'] = np.array(labels, dtype=np.int64)
+        features['Track'] = uuids
+        self.finished = []
+        self.finished_rows = 0
+        return features.dropna(how='any')
+
+
+def read_feature_table(files, track_length, num_rows=None, chunk_size=c.INGEST_CHUNK_ROWS,
+                       idle_rows=c.INGEST_IDLE_ROWS):
+    """
+    Computes the feature table of a set of input files in chunks (see ChunkedIngest).
+    :param files: The CSV files to read, in order.
+    :param track_length: The length tracks are split into.
+    :param num_rows: If not None, only the first num_rows labelled updates (over all files) are used.
+    :param chunk_size: The number of rows read at a time.
+    :param idle_rows: A track is closed once this many rows were read without an update to it (0 or None keeps every
+    track open until the end of the input).
+    :return: A tuple (DataFrame with one row per track: the UUID, the FEATURE_NAMES columns, the Label and the Track,
+    the ChunkedIngest used, for its counters).
+    """
+    ingest = ChunkedIngest(track_length, chunk_size=chunk_size, idle_rows=idle_rows)
+    parts = list(ingest.read(files, num_rows))
+    if len(parts) == 0:
+        return pd.DataFrame(columns=['UUID'] + FEATURE_NAMES + ['Label', 'Track']), ingest
+    return pd.concat(parts, ignore_index=True), ingest
@@ -1,10 +1,14 @@
 import argparse
+import feature_kernels
 import model
+import model_reloader
 import os.path
 import pandas as pd
+import signal
 
 from utilities import constants as c
 from utilities import demo
+from utilities.input import pipeline
 from utilities.input import receiver
 
 
@@ -45,6 +49,22 @@ def validate_args(args, parser):
         if not (args.host and args.port):
             parser.error("listen mode requires both host and port")
 
+        # batches must hold at least one measurement, and can't wait a negative time
+        if args.batchSize < 1 or args.batchTimeout < 0:
+            parser.error("batch size must be at least 1 and batch timeout can't be negative")
+
+        # the pipeline's queues must hold at least one batch
+        if args.queueSize < 1:
+            parser.error("queue size must be at least 1")
+
+        # the overload backlog must leave room for at least one full batch
+        if args.overloadBacklog < args.batchSize:
+            parser.error("overload backlog must be at least the batch size")
+
+        # the receive buffer size can't be negative
+        if args.receiveBuffer < 0:
+            parser.error("receive buffer size can't be negative")
+
     # checks for inference (csv) mode
     elif args.mode == "inference":
         # both input and output files must be specified
@@ -55,6 +75,10 @@ def validate_args(args, parser):
         if not (file_exists(args.input) and file_exists(args.output)):
             parser.error("input or output file does not exist or is not accessible")
 
+    # the early-exit cut-off is a probability
+    if args.earlyExit is not None and not 0 <= args.earlyExit < 1:
+        parser.error("early exit cut-off must be at least 0 and less than 1")
+
 
 def execute_args(args):
     """
@@ -62,18 +86,38 @@ def execute_args(args):
     :param args: The parsed command line arguments.
     :return: None (program flow redirects to the desired function for the duration of the program's execution).
     """
+    # report the live feature path and whether it runs the feature kernels (the backend is checked against the golden
+    # values either way)
+    print(feature_kernels.describe_backend(c.STREAMING_FEATURES))
+
     # define the classifier model (path specified in constants.py)
-    classifier = model.Model(path=c.MODEL_PATH)
+    classifier = model.Model(path=c.MODEL_PATH, cutoff=args.earlyExit)
+
+    # while listening, a changed model file (or SIGHUP) loads the new model in the background and swaps it in between
+    # batches, keeping every live track
+    if args.mode in ("demo", "listen"):
+        reloader = model_reloader.ModelReloader(classifier, c.MODEL_PATH, poll_interval=args.reloadInterval)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, reloader.trigger)
+        reloader.start()
 
     # if the operation mode is demo, begin running the demo
     if args.mode == "demo":
         d = demo.NetworkDemo(classifier)
-        listener = receiver.Receiver(classifier, args.host, args.port, demo=d)
+        listener = receiver.Receiver(classifier, args.host, args.port, demo=d, receive_buffer=args.receiveBuffer)
         listener.begin_listening()
 
-    # if the operation mode is listen, begin listening for messages
+    # if the operation mode is listen, begin listening for messages (through the pipeline, unless synchronous)
     elif args.mode == "listen":
-        listener = receiver.Receiver(classifier, args.host, args.port)
+        if args.synchronous:
+            listener = receiver.Receiver(classifier, args.host, args.port, batch_size=args.batchSize,
+                                         batch_timeout=args.batchTimeout / 1000, receive_buffer=args.receiveBuffer,
+                                         overload_policy=args.overloadPolicy, overload_backlog=args.overloadBacklog)
+        else:
+            listener = pipeline.AsyncReceiver(classifier, args.host, args.port, batch_size=args.batchSize,
+                                              batch_timeout=args.batchTimeout / 1000,
+                                              receive_buffer=args.receiveBuffer, overload_policy=args.overloadPolicy,
+                                              overload_backlog=args.overloadBacklog, queue_size=args.queueSize)
         listener.begin_listening()
 
     # if the operation mode is inference, pass the input data through the classifier
@@ -114,6 +158,79 @@ def main(argv=None):
                         help="network port (required for 'listen' and 'demo' modes)"
                         )
 
+    # micro-batch size argument, only used in LISTEN mode
+    parser.add_argument("-k", "--batchSize",
+                        type=int,
+                        default=c.BATCH_SIZE,
+                        help="number of measurements classified together in 'listen' mode (1 disables batching)"
+                        )
+
+    # micro-batch deadline argument, only used in LISTEN mode
+    parser.add_argument("-t", "--batchTimeout",
+                        type=float,
+                        default=c.BATCH_TIMEOUT_MS,
+                        help="milliseconds a measurement may wait for its batch to fill in 'listen' mode"
+                        )
+
+    # socket receive buffer argument, only used in LISTEN and DEMO modes
+    parser.add_argument("-b", "--receiveBuffer",
+                        type=int,
+                        default=c.RECEIVE_BUFFER_BYTES,
+                        help="bytes of the socket's kernel receive buffer in 'listen' and 'demo' modes (0 keeps the "
+                             "system default)"
+                        )
+
+    # overload policy argument, only used in LISTEN mode
+    parser.add_argument("-op", "--overloadPolicy",
+                        choices=receiver.OVERLOAD_POLICIES,
+                        default=c.OVERLOAD_POLICY,
+                        help="what to drop in 'listen' mode when more than --overloadBacklog measurements are waiting: "
+                             "all but the latest measurement of each track (coalesce), the oldest measurements (shed), "
+                             "or nothing (none)"
+                        )
+
+    # overload backlog argument, only used in LISTEN mode
+    parser.add_argument("-ob", "--overloadBacklog",
+                        type=int,
+                        default=c.OVERLOAD_BACKLOG,
+                        help="number of measurements waiting to be classified beyond which the overload policy applies "
+                             "in 'listen' mode"
+                        )
+
+    # synchronous receive loop argument, only used in LISTEN mode
+    parser.add_argument("-s", "--synchronous",
+                        action="store_true",
+                        default=not c.LISTEN_PIPELINE,
+                        help="receive, classify and output in one loop in 'listen' mode instead of the asyncio "
+                             "pipeline"
+                        )
+
+    # pipeline queue size argument, only used in LISTEN mode
+    parser.add_argument("-q", "--queueSize",
+                        type=int,
+                        default=c.PIPELINE_QUEUE_SIZE,
+                        help="number of batches each queue of the 'listen' mode pipeline holds before the stage "
+                             "feeding it waits (with the 'none' overload policy, the pipeline then stops reading the "
+                             "socket)"
+                        )
+
+    # model reload interval argument, only used in LISTEN and DEMO modes
+    parser.add_argument("-r", "--reloadInterval",
+                        type=float,
+                        default=c.MODEL_POLL_INTERVAL,
+                        help="seconds between checks of the model file for changes in 'listen' and 'demo' modes "
+                             "(0 only reloads on SIGHUP)"
+                        )
+
+    # early-exit cut-off argument, used in all modes
+    parser.add_argument("-e", "--earlyExit",
+                        type=float,
+                        default=c.EARLY_EXIT_CUTOFF,
+                        help="classify tracks as drones when the drone probability exceeds this cut-off, evaluating "
+                             "each track's trees only until that's decided (by default tracks get their most "
+                             "probable class from every tree)"
+                        )
+
     # input csv file argument, only required for INFERENCE mode
     parser.add_argument("-i", "--input",
                         type=str,
@@ -1,60 +1,25 @@
+import batch_features
+import cascade
 import dictionary
-import multiprocessing as mp
+import feature_manifest
+import flat_forest
+import model_artifact
+import model_selection
 import numpy as np
 import output_udp_to_proto
 import pandas as pd
 import pickle
 import preprocess as pre
-import tqdm
+import threading
+import time
 
-from pandas import DataFrame
-from radar_track import RADARTrack
+from radar_track import FEATURE_NAMES
 from sklearn import metrics, tree
 from sklearn.base import clone
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report
-from sklearn.model_selection import train_test_split
-
-
-def calculate_feature(group):
-    """
-    Calculates the features vectors for a given radar track.
-    :param group: The radar track to calculate feature vectors for.
-    :return: The feature vectors of the given radar track.
-    """
-    # separate the input DataFrame into name (the track's UUID) and group (the actual data).
-    name, group = group
-
-    # extract the important values from group
-    vals = {
-        "Speed": [group.iloc[0]["Speed"]],
-        "AZ": [group.iloc[0]["AZ"]],
-        "EL": [group.iloc[0]["EL"]],
-        "Range": [group.iloc[0]["Range"]],
-        "Position (lat)": [group.iloc[0]["Position (lat)"]],
-        "Position (lon)": [group.iloc[0]["Position (lon)"]],
-        "Position (alt MSL)": [group.iloc[0]["Position (alt MSL)"]],
-        "Radar Cross Section": [group.iloc[0]["Radar Cross Section"]],
-    }
-    length = len(group)
-
-    # initialize a RADARTrack instance using the important values from above
-    track = RADARTrack(uuid=name, init_vals=vals)
-
-    # use the RADARTrack instance to calculate the object's feature vectors
-    track.calculate_new_values(group.iloc[1:length])
-
-    # get the feature vectors from the RADARTrack instance
-    features = track.get_feature_vector()
-
-    # append the ground-truth label
-    features["Label"] = group.iloc[0]["Label"]
-
-    # convert the returned feature vectors to a DataFrame
-    features = {k: [v] for k, v in features.items()}  # pandas needs everything to have an index
-    features = DataFrame.from_dict(features, orient='columns')
-
-    return features
+from sklearn.model_selection import GroupShuffleSplit, train_test_split
+from utilities import constants as c
 
 
 class Model:
@@ -64,19 +29,49 @@ class Model:
     and evaluate the classification model.
 
     Attributes:
-        model: The classification model used to make predictions.
+        model: The classification model used to make predictions (None when the model was loaded from an artifact, which
+        only holds the flattened forest).
+        forest: The model flattened into a FlatForest, used for inference (None until a model is loaded or trained).
+        header: The header of the artifact the model was loaded from (None if it wasn't loaded from an artifact).
+        feature_names: The features the model takes, in the order it takes them (a subset of FEATURE_NAMES).
+        columns: The columns of those features in a FEATURE_NAMES feature matrix.
+        live_features: The features the live tracks compute: the model's feature manifest, or (for models saved without
+        one) the features it splits on.
+        path: The path the model was loaded from (None if it wasn't loaded from a file).
+        staged: A replacement model loaded in the background, waiting to be swapped in before the next batch (None if
+        there is none).
+        batches: The number of batches classified by make_inference so far.
         records: A "dictionary" of radar track records over time.
     """
-    def __init__(self, path=None):
+    def __init__(self, path=None, cache=c.PREDICTION_CACHE, cutoff=c.EARLY_EXIT_CUTOFF):
         """
         Initializer for Model class, initializes the classification model and record of previous radar updates.
-        :param path: The path to load a pickled model from (if None, a new model will be initialized).
+        :param path: The path to load a model artifact or pickled model from (if None, a new model will be
+        initialized).
+        :param cache: True to reuse each live track's last classification until it goes stale, False to re-classify
+        every track on every update.
+        :param cutoff: If None, tracks get their most probable class; otherwise tracks are classified as drones when
+        the drone probability exceeds the cut-off, and each track's trees are evaluated only until that's decided.
         """
-        # if path is None, initialize a new model, otherwise load the model from path
-        self.model = RandomForestClassifier(class_weight='balanced') if path is None else self.load_model(path)
-
+        # if path is None, initialize a new model, otherwise load the model from path (load_model sets the model)
+        self.model = RandomForestClassifier(class_weight='balanced')
+        self.forest = None
+        self.cascade = None
+        self.header = None
+        self.path = None
+        self.staged = None
+        self.swap_lock = threading.Lock()
+        self.batches = 0
+        self.cutoff = cutoff
+        self.rows_classified = 0
+        self.trees_evaluated = 0
+        self.rows_cascaded = 0
+        self.rows_escalated = 0
         # initialize the dictionary (record of previous radar updates)
-        self.records = dictionary.Dictionary()
+        self.records = dictionary.Dictionary(cache=cache)
+        self.bind_features()
+        if path is not None:
+            self.load_model(path)
 
     def save_model(self, filename):
         """
@@ -86,66 +81,247 @@ class Model:
         """
         pickle.dump(self.model, open(filename, 'wb'))
 
+    def export_model(self, filename, metadata=None):
+        """
+        Saves the flattened classification model to a model artifact (see model_artifact.py).
+        :param filename: The path to save the artifact to.
+        :param metadata: A JSON-serializable dictionary of training metadata to store in the artifact's header.
+        :return: None
+        """
+        importances = feature_manifest.model_importances(self.model) if self.model is not None else None
+        model_artifact.save_artifact(self.forest, filename, metadata,
+                                     self.cascade.to_dict() if self.cascade is not None else None,
+                                     feature_manifest.build_manifest(self.forest, self.cascade, importances))
+
+    @staticmethod
+    def read_model(filename):
+        """
+        Reads a classification model from a given file, either a model artifact (memory-mapped, near-instant) or a
+        pickled model, and checks that it was trained on features among FEATURE_NAMES (a ValueError is raised
+        otherwise).
+        :param filename: The path to read the model from.
+        :return: A tuple (scikit-learn model (None for artifacts), flattened model, artifact header (None for pickles)).
+        """
+        if model_artifact.is_artifact(filename):
+            forest, header = model_artifact.load_artifact(filename, FEATURE_NAMES)
+            return None, forest, header
+
+        model = pickle.load(open(filename, 'rb'))
+        forest = flat_forest.FlatForest.from_sklearn(model) if isinstance(model, RandomForestClassifier) else None
+        feature_names = list(getattr(model, 'feature_names_in_', [])) or None
+        model_artifact.validate_schema({'feature_names': feature_names}, FEATURE_NAMES)
+        return model, forest, None
+
     def load_model(self, filename):
         """
-        Loads a classification model from a given file.
+        Loads a classification model from a given file, either a model artifact (memory-mapped, near-instant) or a
+        pickled model. The model must have been trained on features among FEATURE_NAMES.
         :param filename: The path to load the model from.
         :return: The loaded model (if loaded successfully) or None (if the file could not be loaded).
         """
         # try to load the model from its file
         try:
-            self.model = pickle.load(open(filename, 'rb'))
-            return self.model
+            self.model, self.forest, self.header = self.read_model(filename)
+            self.cascade = cascade.Cascade.from_header(self.header)
+            self.path = filename
+            self.bind_features()
+            return self.forest if self.model is None else self.model
 
         # if the file can't be found, print a message and return
         except FileNotFoundError:
             print(f"no model found at {filename}")
+            self.model = None
             return None
 
+    def stage_model(self, filename, model, forest, header, load_started, batches_at_load):
+        """
+        Stages a replacement model (read in the background), to be swapped in before the next batch.
+        :param filename: The path the replacement was read from.
+        :param model: The replacement's scikit-learn model (None for artifacts).
+        :param forest: The replacement's flattened model.
+        :param header: The replacement's artifact header (None for pickles).
+        :param load_started: The time (on the time.perf_counter clock) the replacement started loading at.
+        :param batches_at_load: The value of the batches attribute when the replacement started loading.
+        :return: None
+        """
+        with self.swap_lock:
+            self.staged = (filename, model, forest, header, load_started, batches_at_load, time.perf_counter())
+
+    def swap_staged_model(self):
+        """
+        Swaps in the staged replacement model, if there is one. The dictionary (and so every live track's history) is
+        kept; only the cached predictions, which came from the old model, are dropped.
+        :return: True if a model was swapped in, False otherwise.
+        """
+        if self.staged is None:
+            return False
+
+        start = time.perf_counter()
+        with self.swap_lock:
+            filename, model, forest, header, load_started, batches_at_load, staged_at = self.staged
+            self.staged = None
+            self.model, self.forest, self.header, self.path = model, forest, header, filename
+            self.cascade = cascade.Cascade.from_header(header)
+        self.bind_features()
+        self.records.invalidate_predictions()
+        end = time.perf_counter()
+
+        print(f"swapped in the model from {filename} in {1000 * (end - start):.2f} ms (loaded in "
+              f"{1000 * (staged_at - load_started):.1f} ms, waited {1000 * (start - staged_at):.1f} ms for the batch "
+              f"to finish; {self.batches - batches_at_load} batches were classified by the old model meanwhile)")
+        return True
+
+    def close(self):
+        """
+        Stops the background eviction thread of the model's dictionary (for short-lived models, e.g. in train.py).
+        :return: None
+        """
+        self.records.close()
+
     def clear_model(self):
         """
         Re-initializes the model attribute as a new Random Forest Classifier.
         :return: None (re-initializes the model attribute instead).
         """
         self.model = RandomForestClassifier()
+        self.forest = None
+        self.cascade = None
+        self.bind_features()
 
-    def train_model(self, data):
+    def compile_model(self):
         """
-        Trains a new Random Forest Classifier, given a training dataset as input.
-        :param data: The dataset to train (and evaluate using a 70-30 split) the model on.
-        :return: None (the trained model is saved to the model class attribute).
+        Flattens the (fitted) model into the FlatForest used for inference (only random forests can be flattened; other
+        models are left to scikit-learn).
+        :return: None (the flattened model is saved to the forest class attribute).
+        """
+        if isinstance(self.model, RandomForestClassifier):
+            self.forest = flat_forest.FlatForest.from_sklearn(self.model)
+        else:
+            self.forest = None
+        self.bind_features()
+
+    def bind_features(self):
+        """
+        Works out which features the current model takes and which ones the live tracks have to compute for it, and
+        tells the dictionary.
+        :return: None
+        """
+        if self.forest is not None:
+            names = self.forest.feature_names
+        else:
+            names = list(getattr(self.model, 'feature_names_in_', []))
+        self.feature_names = list(names or FEATURE_NAMES)
+        self.columns = np.array([FEATURE_NAMES.index(name) for name in self.feature_names], dtype=np.int64)
+
+        # the manifest saved with the model lists the features it needs; for models saved without one, the features the
+        # forest splits on are needed (and every feature the model takes, for models that can't be flattened)
+        manifest = (self.header or {}).get('manifest')
+        if manifest is not None:
+            live = manifest['features']
+        elif self.forest is not None:
+            live = feature_manifest.used_features(self.forest, self.cascade)
+        else:
+            live = self.feature_names
+        self.live_features = [name for name in FEATURE_NAMES if name in live]
+        self.records.set_live_features(self.live_features)
+
+    def feature_table(self, data, workers=1):
+        """
+        Computes the feature vector of every track of a labelled dataset of radar tracks.
+        :param data: The dataset (one row per track update, with UUID and Label columns).
+        :param workers: The number of processes used to generate the feature vectors.
+        :return: A DataFrame with one row per track (tracks with a NaN feature are dropped): the UUID, the
+        FEATURE_NAMES columns, the Label and (if data has one) the Track the track was split from.
         """
         # clean the input data (drop unnecessary columns)
         data = pre.clean_df(data)
 
-        # group the input data on UUID (i.e., separate out each of the tracks in the data)
+        # calculate the feature vectors for each track in the data (one vectorized pass over all tracks)
         print("Generating feature vectors...")
-        grouped = data.groupby("UUID")
+        features = batch_features.calculate_features(data, workers=workers)
+
+        # drop nan values from the data
+        features = features.dropna(how='any').reset_index(drop=True)
+        return features
+
+    def prepare_data(self, data, workers=1, feature_names=FEATURE_NAMES):
+        """
+        Turns a labelled dataset of radar tracks into a feature matrix and label vector.
+        :param data: The dataset (one row per track update, with UUID and Label columns).
+        :param workers: The number of processes used to generate the feature vectors.
+        :param feature_names: The features to keep (a subset of FEATURE_NAMES).
+        :return: A tuple (X, y) of the feature vectors (one row per track, one column per kept feature) and their
+        labels.
+        """
+        data = self.feature_table(data, workers)
 
-        # stores the feature vectors for each object in the data, as they're calculated
-        results = []
+        # Create an un-labeled dataset, X, and the corresponding label vector, y
+        X = data[list(feature_names)]
+        y = data["Label"]
+        return X, y
 
-        # calculate the feature vectors for each track in the data (parallelized for speed)
-        pool = mp.Pool(mp.cpu_count())
-        for result in tqdm.tqdm(pool.imap_unordered(calculate_feature, [[name, group] for name, group in grouped]),
-                                total=len(grouped)):
-            results.append(result)
+    def fit_model(self, X, y):
+        """
+        Fits the model attribute to a feature matrix and flattens it for inference.
+        :param X: The feature vectors.
+        :param y: Their labels.
+        :return: None
+        """
+        self.model.fit(X, y)
+        self.compile_model()
 
-        # turn the feature vector list back into a DataFrame
-        features = pd.concat(results)
+    def train_cascade(self, X, y):
+        """
+        Trains the first stage of a classifier cascade in front of the model, and calibrates its escalation threshold
+        against the model: both stages are fit on 80% of the data, and the threshold is calibrated on the other 20%.
+        :param X: The feature vectors.
+        :param y: Their labels.
+        :return: A dictionary with the full model's, the first stage's and the cascade's held-out accuracy, and the
+        fraction of held-out rows escalated (the cascade is saved to the cascade class attribute).
+        """
+        X_train, X_cal, y_train, y_cal = train_test_split(X, y, test_size=0.2, stratify=y)
 
-        # drop nan values from the data
-        data = features.reset_index()
-        data.dropna(how='any', inplace=True)
+        # the full model used for calibration is fit without the calibration rows, so its held-out accuracy is honest
+        full = clone(self.model)
+        full.fit(X_train, y_train)
+        first_stage = cascade.Cascade.fit_first_stage(X_train, y_train)
+        self.cascade, report = cascade.Cascade.calibrate(first_stage, model_selection.inference_function(full),
+                                                         X_cal, y_cal)
+        return report
 
-        # Create an un-labeled dataset, X, and the corresponding label vector, y
+    def train_model(self, data, workers=1, with_cascade=False, feature_names=FEATURE_NAMES):
+        """
+        Trains a new Random Forest Classifier, given a training dataset as input.
+        :param data: The dataset to train (and evaluate using a 70-30 split) the model on.
+        :param workers: The number of processes used to generate the feature vectors.
+        :param with_cascade: True to also train a cascade first stage in front of the model (see train_cascade).
+        :param feature_names: The features to train on (a subset of FEATURE_NAMES).
+        :return: The cascade's calibration report if a cascade was trained, otherwise None (the trained model is saved
+        to the model class attribute).
+        """
+        table = self.feature_table(data, workers)
+        return self.train_on_features(table[list(feature_names)], table["Label"], with_cascade, table.get("Track"))
+
+    def train_on_features(self, X, y, with_cascade=False, groups=None):
+        """
+        Trains a new Random Forest Classifier on precomputed feature vectors (see train_model).
+        :param X: The feature vectors (a DataFrame with one column per feature the model takes).
+        :param y: Their labels.
+        :param with_cascade: True to also train a cascade first stage in front of the model (see train_cascade).
+        :param groups: The track each row was split from, or None; the segments of a track are then either all trained
+        on or all held out.
+        :return: The cascade's calibration report if a cascade was trained, otherwise None (the trained model is saved
+        to the model class attribute).
+        """
         print("\n\nTraining Model...")
-        X = data.drop("Label", axis=1)
-        y = data["Label"]
-        X.drop("UUID", axis=1, inplace=True)
 
-        # Perform 70-30 split test on given data
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
+        # Perform 80-20 split test on given data (by track, if the tracks are known, so that segments of a held-out
+        # track can't leak into the training rows)
+        if groups is None:
+            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
+        else:
+            train, test = next(GroupShuffleSplit(n_splits=1, test_size=0.2).split(X, y, groups))
+            X_train, X_test, y_train, y_test = X.iloc[train], X.iloc[test], y.iloc[train], y.iloc[test]
 
         # clone the current model and re-fit the clone
         rf = clone(self.model)
@@ -179,47 +355,36 @@ class Model:
         print(classification_report(y_test, rf_pred, target_names=["Bird", "Drone"], digits=4))
 
         # re-train the model attribute with the full dataset
-        self.model.fit(X, y)
+        self.fit_model(X, y)
 
-    def test_model(self, data, output_path):
+        if with_cascade:
+            print("Training and calibrating the cascade's first stage...")
+            return self.train_cascade(X, y)
+        return None
+
+    def test_model(self, data, output_path, workers=1):
         """
         Tests a trained model on a given dataset and writes the results to a csv file.
         :param data: The data to test the trained model on.
         :param output_path: The path to the output csv file.
+        :param workers: The number of processes used to generate the feature vectors.
         :return: None
         """
-        # clean the input data (drop unnecessary columns)
-        data = pre.clean_df(data)
-
-        # group the input data on UUID (i.e., separate out each of the tracks in the data)
-        print("Generating feature vectors...")
-        grouped = data.groupby("UUID")
-
-        # stores the feature vectors for each object in the data, as they're calculated
-        results = []
-
-        # calculate the feature vectors for each track in the data (parallelized for speed)
-        pool = mp.Pool(mp.cpu_count())
-        for result in tqdm.tqdm(pool.imap_unordered(calculate_feature, [[name, group] for name, group in grouped]),
-                                total=len(grouped)):
-            results.append(result)
-
-        # turn the feature vector list back into a DataFrame
-        features = pd.concat(results)
-
-        # drop nan values from the data
-        data = features.reset_index()
-        data.dropna(how='any', inplace=True)
+        X, y = self.prepare_data(data, workers)
+        self.test_on_features(X, y, output_path)
 
-        # Create an un-labeled dataset, X, and the corresponding label vector, y
-        print("\n\nTraining Model...")
-        X = data.drop("Label", axis=1)
-        y = data["Label"]
-        X.drop("UUID", axis=1, inplace=True)
+    def test_on_features(self, X, y, output_path):
+        """
+        Tests a trained model on precomputed feature vectors and writes the results to a csv file (see test_model).
+        :param X: The feature vectors (a DataFrame with the FEATURE_NAMES columns).
+        :param y: Their labels.
+        :param output_path: The path to the output csv file.
+        :return: None
+        """
+        X = X.copy()
 
-        # generate predictions and confidence pairs with the fitted model using the testing dataset
-        rf_pred = self.model.predict(X)
-        rf_confidence_pair = self.model.predict_proba(X)
+        # generate predictions and confidences with the fitted model using the testing dataset
+        rf_pred, rf_confidence = self.predict(X.to_numpy())
 
         # calculate and display the accuracy of the predictions
         accuracy = metrics.accuracy_score(y, rf_pred)
@@ -229,9 +394,6 @@ class Model:
         accuracy = metrics.f1_score(y, rf_pred)
         print(f'f1 score = {100 * accuracy}')
 
-        # predict_proba() returns a confidence for each class; the conf. of the prediction is the maximum of the two
-        rf_confidence = [max(pair) for pair in rf_confidence_pair]
-
         # calculate and display the average confidence of the predictions
         avg_rf_confidence = np.mean(rf_confidence)
         print(f'\naverage confidence level: {avg_rf_confidence}')
@@ -248,6 +410,81 @@ class Model:
         X["Label"] = rf_pred
         X.to_csv(output_path, index=False)
 
+    def predict(self, features):
+        """
+        Classifies a batch of feature vectors, with the cascade's first stage first if there is one.
+        :param features: A (n, len(FEATURE_NAMES)) feature matrix.
+        :return: A tuple (predicted class of each row, confidence of each prediction).
+        """
+        # the model only takes its own features
+        features = features[:, self.columns]
+        if self.cascade is None:
+            return self.predict_full(features)
+
+        # only the rows the first stage isn't confident about go through the full model
+        predictions, confidence, escalated = self.cascade.predict(features, self.predict_full)
+        self.rows_cascaded += len(escalated)
+        self.rows_escalated += int(escalated.sum())
+        return predictions, confidence
+
+    def predict_full(self, features):
+        """
+        Classifies a batch of feature vectors with the full model.
+        :param features: A (n, len(feature_names)) feature matrix (the model's features only).
+        :return: A tuple (predicted class of each row, confidence of each prediction).
+        """
+        # with a cut-off, each row's trees are evaluated until the remaining ones can't change its class (the classes
+        # are exactly those of evaluating every tree)
+        if self.forest is not None and self.cutoff is not None:
+            predictions, confidence, evaluated = self.forest.predict_early_exit(features, self.cutoff)
+            self.rows_classified += len(evaluated)
+            self.trees_evaluated += int(evaluated.sum())
+            return predictions, confidence
+
+        # the flattened classifier returns the class and its confidence from one pass over the forest, bit-for-bit
+        # identical to predict and predict_proba
+        if self.forest is not None:
+            return self.forest.predict(features)
+        feature_df = pd.DataFrame(features, columns=self.feature_names)
+        proba = self.model.predict_proba(feature_df)
+        if self.cutoff is not None:
+            chosen = (proba[:, 1] > self.cutoff).astype(np.int64)
+            return self.model.classes_.take(chosen), proba[np.arange(len(proba)), chosen]
+        return self.model.predict(feature_df), proba.max(axis=1)
+
+    def threshold_crossings(self, A, B):
+        """
+        Counts the split points (of the forest and of the cascade's first stage) between each pair of rows of A and B;
+        rows with none between them get identical predictions (see FlatForest.threshold_crossings).
+        :param A: An (n_rows, len(FEATURE_NAMES)) input.
+        :param B: Another (n_rows, len(FEATURE_NAMES)) input.
+        :return: An array with the number of split points crossed between each pair of rows.
+        """
+        A = A[:, self.columns]
+        B = B[:, self.columns]
+        crossings = self.forest.threshold_crossings(A, B)
+        if self.cascade is not None:
+            crossings += self.cascade.threshold_crossings(A, B)
+        return crossings
+
+    def cascade_stats(self):
+        """
+        Reports how many of the rows classified through the cascade were escalated to the full model.
+        :return: A dictionary with the number of rows classified and escalated, and the fraction escalated.
+        """
+        return {'rows': self.rows_cascaded, 'escalated': self.rows_escalated,
+                'escalated_fraction': self.rows_escalated / self.rows_cascaded if self.rows_cascaded else 0.0}
+
+    def early_exit_stats(self):
+        """
+        Reports how many trees early-exit classification evaluated per classified row.
+        :return: A dictionary with the number of rows classified, the mean number of trees evaluated per row, and the
+        number of trees in the forest.
+        """
+        n_trees = len(self.forest) if self.forest is not None else 0
+        return {'rows': self.rows_classified, 'n_trees': n_trees,
+                'mean_trees': self.trees_evaluated / self.rows_classified if self.rows_classified else 0.0}
+
     def make_inference(self, input_df, output_path=None, demo=False):
         """
         Predicts whether the radar tracks in a DataFrame (input_df) represent a bird or a drone.
@@ -256,38 +493,61 @@ class Model:
         :param demo: True if running the demonstration, False otherwise.
         :return: If running the demonstration, a DataFrame with the predictions, otherwise None.
         """
+        input_df = self.classify_batch(input_df)
+
+        # if running demonstration, return the data so that results can be displayed
+        if demo:
+            return input_df
+
+        # otherwise, output the augmented dataframe as a protobuff file
+        self.emit_predictions(input_df, output_path)
+
+    def classify_batch(self, input_df):
+        """
+        Folds a batch of radar track updates into their tracks and predicts whether each track is a bird or a drone
+        (the first half of make_inference).
+        :param input_df: The DataFrame containing the radar tracks to classify.
+        :return: input_df, with the Prediction and Confidence of each update's track added.
+        """
+        # swap in a replacement model loaded in the background (between batches, so a whole batch is classified by one
+        # model)
+        self.swap_staged_model()
+        self.batches += 1
+
         # "clean" the data by dropping unnecessary columns, etc...
         df = input_df.copy()
         df = pre.clean_df(df)
 
-        # add plots to dictionary
+        # add plots to dictionary (this only folds each update into its track; features are computed lazily below)
         curr_uuids = []
-        for idx, row in df.iterrows():
+        for row in df.to_dict('records'):
             uuid = row["UUID"]
             self.records.add_plot(uuid, row)
             curr_uuids.append(uuid)
 
-        # calculate feature vectors for the objects present
-        feature_df = self.records.get_features(curr_uuids)
+        # every row of a track is classified from the track's final state, so the features (and predictions) are only
+        # computed once per track in the batch and then broadcast back to the track's rows
+        codes, unique_uuids = pd.factorize(pd.Series(curr_uuids, dtype=object))
 
-        # set the column names for the returned feature df
-        feature_df.set_index('UUID', inplace=True)
-
-        # make predictions with classifier
-        predictions = self.model.predict(feature_df)
-        conf_levels = self.model.predict_proba(feature_df)
-        max_conf_levels = conf_levels.max(axis=1)
+        # make predictions with classifier, only for the tracks whose cached prediction is stale; a track's features
+        # have moved once they cross one of the forest's split points (otherwise the prediction can't have changed)
+        distance = self.threshold_crossings if self.forest is not None else None
+        predictions, max_conf_levels = self.records.classify(list(unique_uuids), self.predict, distance)
+        predictions = predictions[codes]
+        max_conf_levels = max_conf_levels[codes]
 
         # add the prediction to input data
         input_df["Prediction"] = predictions
         input_df["Confidence"] = max_conf_levels
+        return input_df
 
-        # if running demonstration, return the data so that results can be displayed
-        if demo:
-            return input_df
-
-        # otherwise, output the augmented dataframe as a protobuff file
+    def emit_predictions(self, input_df, output_path=None):
+        """
+        Prints a classified batch and sends it as a protobuf message (the second half of make_inference).
+        :param input_df: The DataFrame returned by classify_batch.
+        :param output_path: The path to save the resulting DataFrame (which includes predictions) to.
+        :return: None
+        """
         # currently disabled to avoid errors in working branches
-        else:
-            print(f"{input_df}\n")
-            output_udp_to_proto.dataframe_to_protomessage(input_df, output_path)
+        print(f"{input_df}\n")
+        output_udp_to_proto.dataframe_to_protomessage(input_df, output_path)
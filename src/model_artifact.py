@@ -0,0 +1,141 @@
+import json
+import numpy as np
+import os
+import struct
+
+from flat_forest import FlatForest
+
+# every artifact starts with MAGIC, then the format version and the length of the JSON header (both little-endian
+# uint32), then the header itself and the node arrays; the arrays start at the first ALIGNMENT-byte boundary after the
+# header, and each array's offset (in the header) is relative to that and also aligned
+MAGIC = b"RDFOREST"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+EXTENSION = ".forest"
+
+# the FlatForest node arrays stored in an artifact, and the dtype each is stored as
+ARRAYS = {
+    'roots': '<i8',
+    'feature': '<i4',
+    'threshold': '<f4',
+    'left': '<i4',
+    'right': '<i4',
+    'proba': '<f8',
+}
+
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _aligned(offset):
+    """
+    Rounds an offset up to the next multiple of ALIGNMENT.
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def is_artifact(path):
+    """
+    Checks whether a file is a model artifact (rather than, e.g., a pickled model).
+    :param path: The path of the file.
+    :return: True if the file starts with the artifact magic bytes, False otherwise.
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_artifact(forest, path, metadata=None, cascade=None, manifest=None):
+    """
+    Writes a flattened forest to a model artifact.
+    :param forest: The FlatForest to save.
+    :param path: The path of the artifact to write.
+    :param metadata: A JSON-serializable dictionary of training metadata to store in the header.
+    :param cascade: A JSON-serializable dictionary describing the first stage of a classifier cascade (see
+    Cascade.to_dict) to store in the header, or None.
+    :param manifest: The model's feature manifest (see feature_manifest.build_manifest) to store in the header, or None.
+    :return: None
+    """
+    arrays = {name: np.ascontiguousarray(getattr(forest, name), dtype=dtype) for name, dtype in ARRAYS.items()}
+    header = {
+        'format_version': FORMAT_VERSION,
+        'feature_names': forest.feature_names,
+        'n_features': int(forest.n_features),
+        'classes': forest.classes.tolist(),
+        'n_trees': len(forest),
+        'max_depth': int(forest.max_depth),
+        'metadata': metadata or {},
+        'cascade': cascade,
+        'manifest': manifest,
+        'arrays': {},
+    }
+
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': ARRAYS[name], 'shape': list(array.shape), 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+    encoded = json.dumps(header).encode('utf-8')
+    data_start = _aligned(_PREAMBLE.size + len(encoded))
+
+    # the artifact is written next to its destination and then renamed over it, so a running process never sees a
+    # partly written artifact, and models memory-mapped from the old file keep their (unlinked) data
+    temporary = path + ".tmp"
+    with open(temporary, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(encoded)))
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.write(b"\0" * (data_start + header['arrays'][name]['offset'] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(temporary, path)
+
+
+def read_header(path):
+    """
+    Reads the JSON header of a model artifact.
+    :param path: The path of the artifact.
+    :return: A tuple (header as a dictionary, offset of the artifact's data section).
+    """
+    with open(path, 'rb') as f:
+        magic, version, length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a model artifact")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has artifact format version {version}, expected {FORMAT_VERSION}")
+        return json.loads(f.read(length).decode('utf-8')), _aligned(_PREAMBLE.size + length)
+
+
+def validate_schema(header, feature_names):
+    """
+    Checks that an artifact's model was trained on features that are all among the given ones (the model may use a
+    subset of them, e.g. after low-importance features were dropped).
+    :param header: The artifact's header.
+    :param feature_names: The names of the features that can be calculated.
+    :return: None (a ValueError is raised if the model needs a feature that isn't calculated).
+    """
+    if header['feature_names'] is None:
+        raise ValueError(f"the model wasn't trained on named features, but the features {list(feature_names)} are "
+                         f"calculated")
+    missing = [name for name in header['feature_names'] if name not in feature_names]
+    if missing:
+        raise ValueError(f"the model was trained on the features {header['feature_names']}, but {missing} aren't "
+                         f"among the calculated features {list(feature_names)}")
+
+
+def load_artifact(path, feature_names=None):
+    """
+    Loads a model artifact. The node arrays are memory-mapped rather than read, so loading takes about as long as
+    reading the header.
+    :param path: The path of the artifact.
+    :param feature_names: If not None, the features that can be calculated, which the model's features must be among
+    (see validate_schema).
+    :return: A tuple (FlatForest, header).
+    """
+    header, data_start = read_header(path)
+    if feature_names is not None:
+        validate_schema(header, feature_names)
+
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {name: np.ndarray(tuple(layout['shape']), dtype=np.dtype(layout['dtype']), buffer=buffer,
+                               offset=data_start + layout['offset'])
+              for name, layout in header['arrays'].items()}
+    forest = FlatForest(classes=np.array(header['classes']), n_features=header['n_features'],
+                        feature_names=header['feature_names'], max_depth=header['max_depth'], **arrays)
+    return forest, header
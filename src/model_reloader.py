@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from utilities import constants as c
+
+
+class ModelReloader:
+    """
+    This class reloads a Model's classification model in the background whenever its file changes (or when it's
+    triggered, e.g. by SIGHUP). A replacement is read, checked against the feature schema and warmed up on a background
+    thread while the old model keeps classifying; it is then staged, and the Model swaps it in before its next batch
+    (see Model.swap_staged_model). If the replacement can't be loaded, the old model is kept.
+
+    Attributes:
+        classifier: The Model whose classification model is reloaded.
+        path: The path of the model file to watch.
+        poll_interval: How often (in seconds) the file is checked for changes (0 only reloads when triggered).
+        signature: The (inode, size, modification time) of the file when it was last loaded.
+        reloads: The number of replacements staged so far.
+        failures: The number of replacements that failed to load.
+    """
+    def __init__(self, classifier, path, poll_interval=c.MODEL_POLL_INTERVAL):
+        """
+        Initializes the reloader (call start to begin watching).
+        :param classifier: The Model whose classification model is reloaded.
+        :param path: The path of the model file to watch.
+        :param poll_interval: How often (in seconds) the file is checked for changes (0 only reloads when triggered).
+        """
+        self.classifier = classifier
+        self.path = path
+        self.poll_interval = poll_interval
+        self.signature = self._signature()
+        self.reloads = 0
+        self.failures = 0
+        self.triggered = threading.Event()
+        self.thread = threading.Thread(target=self._watch_forever, daemon=True)
+
+    def _signature(self):
+        """
+        Returns the (inode, size, modification time) of the model file, or None if it doesn't exist.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def start(self):
+        """
+        Starts the background thread that watches the model file.
+        :return: None
+        """
+        self.thread.start()
+
+    def trigger(self, *_):
+        """
+        Requests a reload (safe to call from a signal handler, which is why it accepts and ignores the handler's
+        arguments).
+        :return: None
+        """
+        self.triggered.set()
+
+    def reload(self):
+        """
+        Reads, validates and warms up the model file, and stages it to be swapped in before the classifier's next
+        batch.
+        :return: True if a replacement was staged, False if it couldn't be loaded.
+        """
+        start = time.perf_counter()
+        batches = self.classifier.batches
+        signature = self._signature()
+        try:
+            model, forest, header = self.classifier.read_model(self.path)
+
+            # one prediction pages in the node arrays (and compiles the kernels for them if needed), so the first batch
+            # after the swap isn't slowed down (models that can't be flattened are left to scikit-learn)
+            if forest is not None:
+                forest.predict(np.zeros((1, forest.n_features)))
+        except Exception as e:
+            # the failed file isn't retried until it changes again (e.g. once a partial write completes)
+            self.signature = signature
+            self.failures += 1
+            print(f"couldn't reload the model from {self.path}, keeping the current model: {e}")
+            return False
+
+        self.signature = signature
+        self.reloads += 1
+        self.classifier.stage_model(self.path, model, forest, header, start, batches)
+        print(f"loaded the model from {self.path} in {1000 * (time.perf_counter() - start):.1f} ms, swapping it in "
+              f"before the next batch")
+        return True
+
+    def _watch_forever(self):
+        """
+        Body of the background thread; reloads the model whenever it's triggered or the model file changes.
+        """
+        while True:
+            triggered = self.triggered.wait(self.poll_interval or None)
+            self.triggered.clear()
+            signature = self._signature()
+            if triggered or (signature is not None and signature != self.signature):
+                self.reload()
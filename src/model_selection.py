@@ -0,0 +1,229 @@
+import itertools
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+import time
+
+from flat_forest import FlatForest
+from sklearn import metrics
+from sklearn.base import clone
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.model_selection import GroupKFold, GroupShuffleSplit, train_test_split
+from utilities import constants as c
+
+
+def candidate_models(include_boosting=False):
+    """
+    Lists the candidate models of a capacity sweep: random forests over a grid of tree counts, depths and leaf sizes,
+    and optionally gradient-boosted trees over a grid of iteration counts and depths.
+    :param include_boosting: True to also sweep HistGradientBoostingClassifier.
+    :return: A list of (name, unfitted estimator) tuples.
+    """
+    candidates = []
+    for n_trees, depth, leaf in itertools.product(c.SWEEP_TREES, c.SWEEP_DEPTHS, c.SWEEP_LEAF_SIZES):
+        name = f"rf trees={n_trees} depth={depth} leaf={leaf}"
+        candidates.append((name, RandomForestClassifier(n_estimators=n_trees, max_depth=depth, min_samples_leaf=leaf,
+                                                        class_weight='balanced')))
+    if include_boosting:
+        for iterations, depth in itertools.product(c.SWEEP_BOOSTING_ITERATIONS, c.SWEEP_DEPTHS):
+            name = f"hgb iterations={iterations} depth={depth}"
+            candidates.append((name, HistGradientBoostingClassifier(max_iter=iterations, max_depth=depth,
+                                                                    class_weight='balanced')))
+    return candidates
+
+
+def inference_function(estimator):
+    """
+    Returns the function that classifies feature matrices with a fitted estimator the way inference would: through a
+    FlatForest for random forests, through scikit-learn otherwise.
+    :param estimator: The fitted estimator.
+    :return: A function taking a feature matrix and returning a tuple (predictions, confidences).
+    """
+    if isinstance(estimator, RandomForestClassifier):
+        return FlatForest.from_sklearn(estimator).predict
+    return lambda X: (estimator.predict(X), estimator.predict_proba(X).max(axis=1))
+
+
+def measure_latency(predict, X, batch_size, repeats):
+    """
+    Measures the latency of classifying single rows and batches of rows.
+    :param predict: A function taking a feature matrix and returning a tuple (predictions, confidences).
+    :param X: The feature matrix the rows and batches are sampled from.
+    :param batch_size: The number of rows in a batch.
+    :param repeats: The number of single rows and of batches timed.
+    :return: A dictionary with the p50 and p99 latency (in microseconds) of a single row and of a batch.
+    """
+    rng = np.random.default_rng(0)
+    predict(X[:1])  # warm-up (and JIT compilation)
+
+    latencies = {'single': [], 'batch': []}
+    for _ in range(repeats):
+        for kind, size in (('single', 1), ('batch', batch_size)):
+            rows = X[rng.integers(0, len(X), size)]
+            start = time.perf_counter()
+            predict(rows)
+            latencies[kind].append(1e6 * (time.perf_counter() - start))
+
+    return {f'{kind}_{q}_us': float(np.percentile(values, int(q[1:])))
+            for kind, values in latencies.items() for q in ('p50', 'p99')}
+
+
+def sweep(X, y, groups=None, include_boosting=False, batch_size=c.BATCH_SIZE, repeats=c.SWEEP_LATENCY_REPEATS,
+          test_size=0.2):
+    """
+    Trains every candidate model on a training split, and measures its F1 score on the held-out split and its
+    inference latency.
+    :param X: The feature matrix (a DataFrame with the FEATURE_NAMES columns).
+    :param y: The labels.
+    :param groups: The track each row was split from (rows of the same track are all trained on or all held out), or
+    None to split the rows at random.
+    :param include_boosting: True to also sweep HistGradientBoostingClassifier.
+    :param batch_size: The number of rows in a batch, for the batch latency.
+    :param repeats: The number of single rows and of batches timed per candidate.
+    :param test_size: The fraction of the data held out to score the candidates.
+    :return: A tuple (DataFrame with one row of results per candidate, dictionary mapping each candidate's name to its
+    unfitted estimator).
+    """
+    # hold out whole tracks when they're known, so that segments of a held-out track can't leak into the training rows
+    if groups is None:
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, stratify=y, random_state=0)
+    else:
+        train, test = next(GroupShuffleSplit(n_splits=1, test_size=test_size, random_state=0).split(X, y, groups))
+        X_train, X_test, y_train, y_test = X.iloc[train], X.iloc[test], y.iloc[train], y.iloc[test]
+    X_latency = X_test.to_numpy()
+
+    results, estimators = [], {}
+    for name, estimator in candidate_models(include_boosting):
+        print(f"Training {name}...")
+        fitted = clone(estimator)
+        start = time.perf_counter()
+        fitted.fit(X_train, y_train)
+        train_seconds = time.perf_counter() - start
+
+        predict = inference_function(fitted)
+        predictions = predict(X_test.to_numpy())[0]
+        result = {'model': name, 'f1': metrics.f1_score(y_test, predictions),
+                  'accuracy': metrics.accuracy_score(y_test, predictions), 'train_s': train_seconds}
+        result.update(measure_latency(predict, X_latency, batch_size, repeats))
+        results.append(result)
+        estimators[name] = estimator
+    return pd.DataFrame(results), estimators
+
+
+def pareto_frontier(results, cost='single_p99_us'):
+    """
+    Marks the candidates on the Pareto frontier of F1 score against latency: the candidates that no other candidate
+    beats on both (at least as good on each, strictly better on one).
+    :param results: The results of sweep.
+    :param cost: The latency column used as the cost.
+    :return: A copy of results sorted by cost, with a boolean 'pareto' column.
+    """
+    results = results.sort_values([cost, 'f1'], ascending=[True, False]).reset_index(drop=True)
+    best_f1 = -np.inf
+    pareto = []
+    for f1 in results['f1']:
+        # sorted by cost, a candidate is on the frontier if it beats the F1 of every cheaper candidate
+        pareto.append(bool(f1 > best_f1))
+        best_f1 = max(best_f1, f1)
+    results['pareto'] = pareto
+    return results
+
+
+def select_model(results, f1_target, cost='single_p99_us'):
+    """
+    Picks the cheapest candidate that meets an F1 target (or the candidate with the best F1 if none does).
+    :param results: The results of sweep.
+    :param f1_target: The F1 score the model must reach.
+    :param cost: The latency column used as the cost.
+    :return: A tuple (name of the chosen candidate, True if it meets the target).
+    """
+    eligible = results[results['f1'] >= f1_target]
+    if len(eligible) == 0:
+        return results.loc[results['f1'].idxmax(), 'model'], False
+    return eligible.loc[eligible[cost].idxmin(), 'model'], True
+
+
+# the feature matrix, labels and folds of a cross-validation, set once in each worker process (see _init_fold_worker)
+_fold_data = None
+
+
+def _init_fold_worker(X, y, folds):
+    """
+    Pool initializer: stores the cross-validation data in the worker, so that each task only carries a candidate and a
+    fold index instead of a copy of the data.
+    """
+    global _fold_data
+    _fold_data = (X, y, folds)
+
+
+def _fit_fold(task):
+    """
+    Fits one candidate on the training rows of one fold and scores it on the fold's held-out rows.
+    :param task: A tuple (candidate index, candidate name, unfitted estimator, fold index).
+    :return: A dictionary with the candidate, the fold, the held-out F1 score and accuracy, the fit time and the
+    prediction time per row.
+    """
+    index, name, estimator, fold = task
+    X, y, folds = _fold_data
+    train, test = folds[fold]
+
+    fitted = clone(estimator)
+    start = time.perf_counter()
+    fitted.fit(X[train], y[train])
+    fit_seconds = time.perf_counter() - start
+
+    # predictions go through the inference path (a FlatForest for random forests), warmed up first so that a JIT
+    # compilation isn't timed
+    predict = inference_function(fitted)
+    predict(X[test[:1]])
+    start = time.perf_counter()
+    predictions = predict(X[test])[0]
+    predict_seconds = time.perf_counter() - start
+
+    return {'index': index, 'model': name, 'fold': fold, 'f1': metrics.f1_score(y[test], predictions),
+            'accuracy': metrics.accuracy_score(y[test], predictions), 'fit_s': fit_seconds,
+            'predict_us_per_row': 1e6 * predict_seconds / max(len(test), 1)}
+
+
+def grouped_search(X, y, groups, candidates, n_folds=5, workers=1):
+    """
+    Cross-validates every candidate with folds grouped by track, so that the segments of one track are never split
+    between training and held-out rows. The candidate x fold fits run across a pool of worker processes; each worker
+    holds one copy of the data, and the tasks only name a candidate and a fold.
+    :param X: The feature matrix.
+    :param y: The labels.
+    :param groups: The track each row was split from (rows of the same track are always in the same fold).
+    :param candidates: A list of (name, unfitted estimator) tuples (see candidate_models).
+    :param n_folds: The number of folds.
+    :param workers: The number of worker processes (1 fits everything in this process).
+    :return: A tuple (DataFrame with one row per candidate, ranked by mean F1 score: the mean and standard deviation of
+    its held-out F1 score, its mean accuracy, mean fit time and mean prediction time per row; DataFrame with one row per
+    fit).
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    folds = list(GroupKFold(n_splits=n_folds).split(X, y, groups))
+    tasks = [(index, name, estimator, fold) for index, (name, estimator) in enumerate(candidates)
+             for fold in range(n_folds)]
+
+    pool = mp.Pool(workers, initializer=_init_fold_worker, initargs=(X, y, folds)) if workers > 1 else None
+    if pool is None:
+        _init_fold_worker(X, y, folds)
+    fits = []
+    try:
+        for fit in pool.imap_unordered(_fit_fold, tasks) if pool is not None else map(_fit_fold, tasks):
+            print(f"{fit['model']} fold {fit['fold'] + 1}/{n_folds}: f1 = {fit['f1']:.4f}")
+            fits.append(fit)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _init_fold_worker(None, None, None)
+
+    fits = pd.DataFrame(fits).sort_values(['index', 'fold']).reset_index(drop=True)
+    ranked = fits.groupby(['index', 'model'], sort=False).agg(
+        f1=('f1', 'mean'), f1_std=('f1', 'std'), accuracy=('accuracy', 'mean'), fit_s=('fit_s', 'mean'),
+        predict_us_per_row=('predict_us_per_row', 'mean')).reset_index()
+    ranked = ranked.sort_values(['f1', 'predict_us_per_row'], ascending=[False, True]).reset_index(drop=True)
+    ranked.insert(0, 'rank', np.arange(1, len(ranked) + 1))
+    return ranked.drop(columns='index'), fits.drop(columns='index')
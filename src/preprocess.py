@@ -1,18 +1,34 @@
+import columnar_store
 import os
 import pandas as pd
 
 from utilities import constants as c
 
 
-def read_df(file_path):
+def read_df(file_path, columns=None, combat_ids=None, nrows=None):
     """
-    Reads a csv file into a Pandas DataFrame.
-    :param file_path: The path to the csv file to be read.
+    Reads a csv file (or a columnar capture written by import_data.py) into a Pandas DataFrame.
+    :param file_path: The path to the csv file or columnar capture to be read.
+    :param columns: If not None, only these columns are read.
+    :param combat_ids: If not None, only the updates with one of these Combat IDs are read (columnar captures only skip
+    the other Combat IDs' partitions, csv files are filtered after reading).
+    :param nrows: If not None, only the first nrows rows of the file are read (for a columnar capture, the first nrows
+    rows of the csv file it was converted from, sliced from its memory-mapped columns).
     :return: A Pandas DataFrame if file_path exists, otherwise None.
     """
+    # columnar captures hold the UUID and Combat ID of every update, and their PLOT_FIELDS columns
+    if columnar_store.is_capture(file_path):
+        fields = [name for name in columns if name not in ('UUID', 'Combat ID')] if columns is not None else None
+        rows = (0, nrows) if nrows is not None else None
+        if fields is None:
+            return columnar_store.read_capture(file_path, combat_ids=combat_ids, rows=rows)
+        return columnar_store.read_capture(file_path, fields, combat_ids, rows)
+
     # check if there is a file at file_path
     if os.path.isfile(file_path):
-        df = pd.read_csv(file_path)
+        df = pd.read_csv(file_path, usecols=columns, low_memory=False, nrows=nrows)
+        if combat_ids is not None:
+            df = df[df['Combat ID'].isin(combat_ids)]
         return df
 
     # if there is no file, raise an error
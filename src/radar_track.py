@@ -1,109 +1,301 @@
+import functools
+import math
 import numpy as np
-import time
 import pandas as pd
 
+from feature_kernels import average_curvature, diff_moments, heading
 
-class RADARTrack:
-    def __init__(self, uuid, init_vals):
-        self.n = 1
-        self.last_update = time.time()
-        self.updates = pd.DataFrame(init_vals)
-        self.uuid = uuid
-        self.feature_vector = {
-            'UUID': uuid,
-            'avg_speed': init_vals['Speed'][0],
-            'std_speed': 0,
-            'std_heading': 0,
-            'mav_factor': 0,
-            'avg_curvature': 0,
-            'avg_rcs': init_vals['Radar Cross Section'][0],
-            "m1_range": 0,
-            "m1_az": 0,
-            "m1_el": 0,
-            "m1_speed": 0,
-            "m1_heading": 0,
-            "m2_range": 0,
-            "m2_az": 0,
-            "m2_el": 0,
-            "m2_speed": 0,
-            "m2_heading": 0,
-        }
 
-    def __len__(self):
-        return self.n
-
-    def add_update(self, value_updates):
-        self.updates = pd.concat([self.updates, pd.DataFrame(value_updates)], ignore_index=True)
-        self.n += len(value_updates)
-        self.last_update = time.time()
-        
-    def past_stale_time(self):
-        dif = time.time() - self.last_update
-        return dif > 90
-
-    def get_feature_vector(self):
-        return self.feature_vector
-
-    def calculate_average_curvature(self, df):
-        # Calculate the differences for Position (lat), Position (lon), and Position (alt MSL)
-        lat_diff = df["Position (lat)"].diff(-1)
-        lon_diff = df["Position (lon)"].diff(-1)
-    
-        # Calculate difference between first time step and second 
-        a = np.sqrt(lat_diff ** 2 + lon_diff ** 2)
-
-        # Calculate difference between first time step and third 
-        lat_diff_2 = df["Position (lat)"].diff(-2)
-        lon_diff_2 = df["Position (lon)"].diff(-2)
-       
-        b = np.sqrt(lat_diff_2 ** 2 + lon_diff_2 ** 2)
-    
-        # Calculate difference between second time step and third 
-        lat_diff_1_2 = lat_diff.shift(-1).dropna()
-        lon_diff_1_2 = lon_diff.shift(-1).dropna()
-        c = np.sqrt(lat_diff_1_2 ** 2 + lon_diff_1_2 ** 2)
-        
-        # Calculate curvature
-        with np.errstate(invalid="ignore"):
-            numerator = a ** 2 - b ** 2 - c ** 2
-            denominator = 2 * b * c + 1e-6
-            # Arccos is throwing errors when it seems like it shouldn't
-            curvature = np.arccos(numerator / denominator)
-    
-        # Calculate the average curvature
-        average_curvature = curvature.mean()
-    
-        return average_curvature
-        
-    def calculate_m1(self, df, field):
-        diff = df[field].diff(1)
-        q = np.sum(diff) / len(df)
-        m1 = np.sum((diff - q)**2)/len(df)
-        return m1
-        
-    def calculate_m2(self, df,field):
-        diff = df[field].diff(1)
-        q = np.sum(diff) / len(df)
-        m1 = np.sum((diff - q)**2) / len(df)
-        c = np.sum(np.abs(diff)) / len(df)
-        c += 1e-6
-        m2 = m1/c
-        return m2
-    
-    def calculate_new_values(self, value_updates):
-        self.add_update(value_updates)
-
-        self.feature_vector['avg_speed'] = np.mean(self.updates['Speed'])
-        self.feature_vector['std_speed'] = np.std(self.updates['Speed'], ddof=1) # ddof=1 is to make std an unbiased estimator of the population
-        heading = np.arctan2((self.updates["Position (lat)"].diff(-1)), 
-                             (self.updates["Position (lon)"].diff(-1)))
-        self.feature_vector['std_heading'] = np.std(heading, ddof=1)
-        self.feature_vector['avg_curvature'] = self.calculate_average_curvature(self.updates)
-        self.feature_vector['avg_rcs'] = np.mean(self.updates['Radar Cross Section'])
-        self.feature_vector['mav_factor'] = self.feature_vector['avg_speed']/(self.feature_vector['std_heading'] + 1e-6)
-
-        sm_df = self.updates[['Speed', 'Range', 'AZ', 'EL']]
-        sm_df = sm_df.assign(Heading=heading)
-        for name,field in [('speed','Speed'), ('range','Range'), ('az','AZ'), ('el','EL'), ('heading','Heading')]:
-            self.feature_vector['m1_' + name] = self.calculate_m1(sm_df, field)
-            self.feature_vector['m2_' + name] = self.calculate_m2(sm_df, field)
+# the per-plot fields stored for every track update (see Dictionary.add_plot)
+PLOT_FIELDS = ["Speed", "AZ", "EL", "Range", "Position (lat)", "Position (lon)", "Position (alt MSL)",
+               "Radar Cross Section"]
+
+# the features computed for every track, in the order the classifier expects them
+FEATURE_NAMES = ['avg_speed', 'std_speed', 'std_heading', 'mav_factor', 'avg_curvature', 'avg_rcs',
+                 'm1_range', 'm1_az', 'm1_el', 'm1_speed', 'm1_heading',
+                 'm2_range', 'm2_az', 'm2_el', 'm2_speed', 'm2_heading']
+
+# the version of the feature calculations; bump it whenever a feature's definition changes, so that feature matrices
+# cached by earlier versions (see feature_cache.py) are no longer used
+FEATURE_VERSION = 1
+
+# the intermediate computations each feature needs; live tracks maintain all of them, and only finalize the features
+# the loaded model uses (see computations)
+FEATURE_COMPUTATIONS = {
+    'avg_speed': ('speed',),
+    'std_speed': ('speed',),
+    'std_heading': ('heading',),
+    'mav_factor': ('speed', 'heading'),
+    'avg_curvature': ('curvature',),
+    'avg_rcs': ('rcs',),
+    'm1_range': ('range_diffs',),
+    'm1_az': ('az_diffs',),
+    'm1_el': ('el_diffs',),
+    'm1_speed': ('speed_diffs',),
+    'm1_heading': ('heading_diffs',),
+    'm2_range': ('range_diffs',),
+    'm2_az': ('az_diffs',),
+    'm2_el': ('el_diffs',),
+    'm2_speed': ('speed_diffs',),
+    'm2_heading': ('heading_diffs',),
+}
+
+# the columns of a track's history buffer: the time the update was received, followed by the plot fields
+HISTORY_COLUMNS = ["Time"] + PLOT_FIELDS
+
+# streaming features match the full recompute to within this relative tolerance (the only differences come from
+# Welford updates and summation order, so in practice they agree to ~1e-12)
+STREAMING_TOLERANCE = 1e-9
+
+# layout of the streaming accumulator's state vector; each Welford block is (count, mean, sum of squared deviations)
+# and each diff block is (last value, count, mean, sum of squared deviations, sum of absolute values) of the
+# first differences of a signal
+STATE_N = 0
+STATE_SPEED = 1
+STATE_RCS = 4
+STATE_HEADING = 7
+STATE_CURVATURE = 10    # (count, sum) of the valid curvature angles
+STATE_POSITION = 12     # (lat, lon) of the previous two updates, most recent first
+STATE_DIFFS = {'range': 16, 'az': 21, 'el': 26, 'speed': 31, 'heading': 36}
+STATE_SIZE = 41
+
+
+def computations(feature_names):
+    """
+    Finds the intermediate computations needed to calculate a set of features.
+    :param feature_names: The names of the features.
+    :return: A frozenset of computation names (see FEATURE_COMPUTATIONS).
+    """
+    return _computations(tuple(feature_names))
+
+
+@functools.lru_cache(maxsize=None)
+def _computations(feature_names):
+    """
+    Memoized body of computations (feature sets are few, and the plan is looked up on every feature evaluation).
+    """
+    return frozenset(computation for name in feature_names for computation in FEATURE_COMPUTATIONS[name])
+
+
+def new_state():
+    """
+    Creates an empty streaming accumulator state vector.
+    :return: A list of STATE_SIZE floats describing a track with no updates.
+    """
+    state = [0.0] * STATE_SIZE
+
+    # previous positions and previous diff values start out missing, so the first differences are skipped
+    for i in range(STATE_POSITION, STATE_POSITION + 4):
+        state[i] = math.nan
+    for i in STATE_DIFFS.values():
+        state[i] = math.nan
+    return state
+
+
+def _welford(state, i, x):
+    """
+    Folds a single value into the Welford (count, mean, M2) block starting at state[i]; NaNs are skipped, the same
+    way pandas skips them.
+    """
+    if x == x:
+        count = state[i] + 1
+        delta = x - state[i + 1]
+        mean = state[i + 1] + delta / count
+        state[i] = count
+        state[i + 1] = mean
+        state[i + 2] += delta * (x - mean)
+
+
+def _diff(state, i, x):
+    """
+    Folds the first difference between x and the previous value of the signal into the diff block starting at
+    state[i]; differences involving a NaN are skipped, like pandas' Series.diff followed by a skipna sum.
+    """
+    d = x - state[i]
+    state[i] = x
+    if d == d:
+        _welford(state, i + 1, d)
+        state[i + 4] += abs(d)
+
+
+def accumulate(state, speed, az, el, range_, lat, lon, rcs):
+    """
+    Folds one track update into a streaming accumulator state vector at constant cost.
+    :param state: The state vector (as returned by new_state) to update in place.
+    :param speed: The speed of the update.
+    :param az: The azimuth of the update.
+    :param el: The elevation of the update.
+    :param range_: The range of the update.
+    :param lat: The latitude of the update.
+    :param lon: The longitude of the update.
+    :param rcs: The radar cross section of the update.
+    :return: None (state is updated in place).
+    """
+    n = state[STATE_N] + 1
+    state[STATE_N] = n
+    _welford(state, STATE_SPEED, speed)
+    _welford(state, STATE_RCS, rcs)
+
+    lat_1, lon_1, lat_2, lon_2 = state[STATE_POSITION:STATE_POSITION + 4]
+    if n >= 2:
+        # the heading between the previous position and this one (matches arctan2 of the diff(-1) series)
+        lat_diff = lat_1 - lat
+        lon_diff = lon_1 - lon
+        heading = math.atan2(lat_diff, lon_diff)
+        _welford(state, STATE_HEADING, heading)
+        _diff(state, STATE_DIFFS['heading'], heading)
+
+        # the curvature of the triangle formed by the last three positions (see calculate_average_curvature)
+        if n >= 3:
+            a = math.sqrt((lat_2 - lat_1) * (lat_2 - lat_1) + (lon_2 - lon_1) * (lon_2 - lon_1))
+            b = math.sqrt((lat_2 - lat) * (lat_2 - lat) + (lon_2 - lon) * (lon_2 - lon))
+            c = math.sqrt(lat_diff * lat_diff + lon_diff * lon_diff)
+            ratio = (a * a - b * b - c * c) / (2 * b * c + 1e-6)
+
+            # np.arccos returns NaN outside of [-1, 1] and those angles are skipped by the mean
+            if -1.0 <= ratio <= 1.0:
+                state[STATE_CURVATURE] += 1
+                state[STATE_CURVATURE + 1] += math.acos(ratio)
+
+    state[STATE_POSITION:STATE_POSITION + 4] = [lat, lon, lat_1, lon_1]
+
+    _diff(state, STATE_DIFFS['speed'], speed)
+    _diff(state, STATE_DIFFS['range'], range_)
+    _diff(state, STATE_DIFFS['az'], az)
+    _diff(state, STATE_DIFFS['el'], el)
+
+
+def finalize(state, names=FEATURE_NAMES):
+    """
+    Turns a streaming accumulator state vector into a feature vector.
+    :param state: The state vector to compute the features of.
+    :param names: The features to compute (their computations must have been maintained by accumulate).
+    :return: A dictionary mapping each of names (and any other feature that shares their computations) to its value.
+    """
+    n = state[STATE_N]
+    plan = computations(names)
+    features = dict()
+
+    if 'speed' in plan:
+        speed_count, speed_mean, speed_m2 = state[STATE_SPEED:STATE_SPEED + 3]
+        features['avg_speed'] = speed_mean if speed_count > 0 else math.nan
+        features['std_speed'] = math.sqrt(speed_m2 / (speed_count - 1)) if speed_count > 1 else math.nan
+
+    if 'heading' in plan:
+        heading_count, _, heading_m2 = state[STATE_HEADING:STATE_HEADING + 3]
+        features['std_heading'] = math.sqrt(heading_m2 / (heading_count - 1)) if heading_count > 1 else math.nan
+        if 'speed' in plan:
+            features['mav_factor'] = features['avg_speed'] / (features['std_heading'] + 1e-6)
+
+    if 'curvature' in plan:
+        curvature_count, curvature_sum = state[STATE_CURVATURE:STATE_CURVATURE + 2]
+        features['avg_curvature'] = curvature_sum / curvature_count if curvature_count > 0 else math.nan
+
+    if 'rcs' in plan:
+        rcs_count, rcs_mean, _ = state[STATE_RCS:STATE_RCS + 3]
+        features['avg_rcs'] = rcs_mean if rcs_count > 0 else math.nan
+
+    # m1 is sum((d - q)^2) / n with q = sum(d) / n, which is rebuilt from the Welford mean and M2 of the diffs
+    for name, i in STATE_DIFFS.items():
+        if name + '_diffs' in plan:
+            _, k, mean, m2, abs_sum = state[i:i + 5]
+            q = k * mean / n
+            m1 = (m2 + k * (mean - q) * (mean - q)) / n
+            features['m1_' + name] = m1
+            features['m2_' + name] = m1 / (abs_sum / n + 1e-6)
+
+    return features
+
+
+def _nanmean(values):
+    """
+    Mean of the non-NaN values of an array (NaN if there are none), like pandas' Series.mean.
+    """
+    valid = values[~np.isnan(values)]
+    return valid.mean() if len(valid) > 0 else math.nan
+
+
+def _nanstd(values):
+    """
+    Unbiased standard deviation of the non-NaN values of an array (NaN if there are fewer than two), like pandas'
+    Series.std.
+    """
+    valid = values[~np.isnan(values)]
+    return valid.std(ddof=1) if len(valid) > 1 else math.nan
+
+
+def window_features(values, names=FEATURE_NAMES):
+    """
+    Calculates the feature vector of a window of track updates.
+    :param values: A 2D array with one row per update (in chronological order) and one column per PLOT_FIELDS entry.
+    :param names: The features to compute.
+    :return: A dictionary mapping each of names (and any other feature that shares their computations) to its value.
+    """
+    n = len(values)
+    plan = computations(names)
+    speed, az, el, range_, lat, lon, _, rcs = values.T
+    headings = heading(lat, lon) if 'heading' in plan or 'heading_diffs' in plan else None
+
+    features = dict()
+    if 'speed' in plan:
+        features['avg_speed'] = _nanmean(speed)
+        features['std_speed'] = _nanstd(speed)
+    if 'heading' in plan:
+        features['std_heading'] = _nanstd(headings)
+        if 'speed' in plan:
+            features['mav_factor'] = features['avg_speed'] / (features['std_heading'] + 1e-6)
+    if 'curvature' in plan:
+        features['avg_curvature'] = average_curvature(lat, lon)
+    if 'rcs' in plan:
+        features['avg_rcs'] = _nanmean(rcs)
+    for name, signal in [('range', range_), ('az', az), ('el', el), ('speed', speed), ('heading', headings)]:
+        if name + '_diffs' in plan:
+            features['m1_' + name], features['m2_' + name] = diff_moments(signal, n)
+    return features
+
+
+def ring_window(buffer, head, count, window_seconds=None):
+    """
+    Reads the updates inside the history window out of a ring buffer.
+    :param buffer: The (capacity, len(HISTORY_COLUMNS)) ring buffer.
+    :param head: The row the next update will be written to.
+    :param count: The number of valid rows in the buffer.
+    :param window_seconds: If not None, only updates from the last window_seconds seconds (relative to the latest
+    update) are returned.
+    :return: A 2D array (a copy) with one row per update, in chronological order.
+    """
+    rows = np.take(buffer, range(head - count, head), axis=0, mode='wrap')
+    if window_seconds is not None and len(rows) > 0:
+        rows = rows[rows[:, 0] >= rows[-1, 0] - window_seconds]
+    return rows
+
+
+def evaluate_window_sizes(data, sizes):
+    """
+    Helps pick the history capacity by comparing, for each candidate size, the memory it costs per track against
+    how far the windowed features drift from the features of the full track history.
+    :param data: A DataFrame of track updates (with a UUID column and the PLOT_FIELDS columns), in chronological order.
+    :param sizes: The candidate capacities (number of updates) to evaluate.
+    :return: A DataFrame with one row per size: the bytes per track, and the median and 90th percentile relative error
+    of the features over all tracks (plus the median per feature).
+    """
+    errors = {size: [] for size in sizes}
+    for _, group in data.groupby("UUID", sort=False):
+        values = group[PLOT_FIELDS].to_numpy(dtype=np.float64)
+        full = np.array([window_features(values)[name] for name in FEATURE_NAMES])
+        for size in sizes:
+            windowed = np.array([window_features(values[-size:])[name] for name in FEATURE_NAMES])
+            errors[size].append(np.abs(windowed - full) / (np.abs(full) + 1e-12))
+
+    report = []
+    for size in sizes:
+        error = np.array(errors[size])
+        row = {
+            'window': size,
+            'bytes_per_track': size * len(HISTORY_COLUMNS) * np.dtype(np.float64).itemsize,
+            'median_rel_error': np.nanmedian(error),
+            'p90_rel_error': np.nanpercentile(error, 90),
+        }
+        row.update({name: np.nanmedian(error[:, i]) for i, name in enumerate(FEATURE_NAMES)})
+        report.append(row)
+    return pd.DataFrame(report)
@@ -1,11 +1,13 @@
 import argparse
 import glob
 import datetime;
-import os
-import uuid
 
-import pandas as pd
+import columnar_store
+import dataset
+import feature_cache
+import ingest
 from model import Model
+from radar_track import FEATURE_NAMES
 
 from utilities import constants as c
 
@@ -14,12 +16,17 @@ if __name__ == '__main__':
         prog='Test Model',
         description='Tests a model on the provided data')
 
-    parser.add_argument('-m', '--modelFile', type=str, default='../models/feb25_fv.sav', help="Model filename")
+    parser.add_argument('-m', '--modelFile', type=str, default=c.MODEL_PATH, help="Model filename (a model artifact or a pickled model)")
     parser.add_argument('-s', '--resultsFile', type=str, default='test.csv', help="Results filename")
-    parser.add_argument('-t', '--testingFiles', type=str, default=[], nargs='+', help="Tests on all files listed")
-    parser.add_argument('-d', '--testingDirectories', type=str, default=['../data/test'], nargs='+', help="Tests on all files in these directories")
+    parser.add_argument('-t', '--testingFiles', type=str, default=[], nargs='+', help="Tests on all files (CSV files or columnar captures) listed")
+    parser.add_argument('-d', '--testingDirectories', type=str, default=['../data/test'], nargs='+', help="Tests on all files (CSV files and columnar captures) in these directories")
     parser.add_argument('-l', '--trackLength', type=int, default=20, help="Maximum length before track splitting")
     parser.add_argument('-n', '--numRows', type=int, default=None, help="Limits the number of rows taken from the input during the test")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="Number of processes used to generate feature vectors (and of input files read at the same time)")
+    parser.add_argument('-k', '--chunkSize', type=int, default=None, help="Reads the input files this many rows at a time instead of loading them into memory (for inputs larger than RAM)")
+    parser.add_argument('-i', '--idleRows', type=int, default=c.INGEST_IDLE_ROWS, help="With --chunkSize, closes a track once this many rows were read without an update to it, which bounds memory; a track that pauses for longer is split differently than without --chunkSize (0 keeps every track open until the end of the input)")
+    parser.add_argument('-c', '--cacheDir', type=str, default=c.FEATURE_CACHE_DIR, help="Directory the computed feature vectors are cached in")
+    parser.add_argument('-N', '--noCache', action='store_true', help="Recomputes the feature vectors without reading or writing the feature cache")
 
     args = parser.parse_args()
 
@@ -28,10 +35,14 @@ if __name__ == '__main__':
 
     for dir in args.testingDirectories:
         files |= set(glob.glob(dir + '/*' + '.csv', recursive=True))
+        files |= set(columnar_store.list_captures(dir))
 
     for file in args.testingFiles:
         files.add(file)
 
+    # the files are always loaded in the same order, so the same files give the same data (and feature cache key)
+    files = sorted(files)
+
     print("Loading Files:")
     print("----------------------------------------")
     print(files)
@@ -39,58 +50,36 @@ if __name__ == '__main__':
 
     mod = Model()
 
-    data = []
-    for file in files:
-        data.append(pd.read_csv(file, low_memory=False))
-
-    if(len(data) > 0):
-        testing = pd.concat(data)
-
-    if(args.numRows):
-        testing = testing[:args.numRows]
-
-    num_unique_uuids = testing['UUID'].nunique()
-    print("Number of unique UUIDs:", num_unique_uuids)
-
-
-    print("Splitting tracks into length " + str(args.trackLength))
-    grouped = testing.groupby("UUID")
-
-    dataframes = []
-    for group_name, group_df in grouped:
-        if len(group_df) > args.trackLength:
-            count = 0
-            
-            l = len(group_df)
-            for idx, row in group_df.iterrows():
-                if count % args.trackLength == 0 and l-count>=args.trackLength:
-                    new_id = str(uuid.uuid4())
-
-                group_df.at[idx, "UUID"] = new_id
-                count += 1
-        dataframes.append(group_df)
-
-    testing = pd.concat(dataframes)
-
-    grouped = testing.groupby("Combat ID")
-
-    dataframes = {}
-    for name, group in grouped:
-        dataframes[name] = group.reset_index(drop=True)
-
-    labeled_data = pd.DataFrame()
-
-    if("HOSTILE" in grouped.groups):
-        dataframes["HOSTILE"]["Label"] = 1
-        labeled_data = pd.concat([labeled_data, dataframes["HOSTILE"]], ignore_index=True)
-        print("HOSTILE updates: ", len(dataframes["HOSTILE"]))
-    if("UNKNOWN_THREAT" in grouped.groups):
-        dataframes["UNKNOWN_THREAT"]["Label"] = 0
-        labeled_data = pd.concat([labeled_data, dataframes["UNKNOWN_THREAT"]], ignore_index=True)
-        print("UNKNOWN_THREAT updates: ", len(dataframes["UNKNOWN_THREAT"]))
-
-    print("")
+    # the feature vectors computed from the same files (split into the same track length) by an earlier run are reused
+    key = feature_cache.cache_key(files, args.trackLength, args.numRows,
+                                  (args.idleRows or None) if args.chunkSize else None)
+    cached = None if args.noCache else feature_cache.load(key, args.cacheDir)
+
+    if cached is not None:
+        table = cached[0]
+        print(f"Loaded the feature vectors of {len(table)} tracks from the feature cache ({key[:12]})")
+        print("")
+    elif args.chunkSize:
+        # stream the files in chunks, keeping only the open tracks' pending updates in memory
+        print(f"Reading the files {args.chunkSize} rows at a time and splitting tracks into length {args.trackLength}")
+        table, ingestion = ingest.read_feature_table(files, args.trackLength, args.numRows, args.chunkSize,
+                                                     args.idleRows)
+        print(f"Computed the feature vectors of {len(table)} tracks from {ingestion.rows_read} rows "
+              f"(at most {ingestion.peak_open} open tracks and {ingestion.peak_pending_rows} pending updates at once)")
+        print("")
+        if not args.noCache:
+            feature_cache.save(key, table, {'files': files, 'num_rows': ingestion.rows_labelled,
+                                            'num_tracks': len(table)}, args.cacheDir)
+    else:
+        labeled_data, num_unique_uuids = dataset.load_labeled_data(files, args.trackLength, args.numRows,
+                                                                   args.workers)
+
+        table = mod.feature_table(labeled_data, workers=args.workers)
+        if not args.noCache:
+            feature_cache.save(key, table, {'files': files, 'num_rows': len(labeled_data),
+                                            'num_tracks': num_unique_uuids}, args.cacheDir)
 
     if(mod.load_model(args.modelFile)):
-        mod.test_model(labeled_data, args.resultsFile)
-        print("\nSaved results to " + args.resultsFile)
\ No newline at end of file
+        mod.test_on_features(table[FEATURE_NAMES], table["Label"], args.resultsFile)
+        print("\nSaved results to " + args.resultsFile)
+    mod.close()
@@ -0,0 +1,84 @@
+import math
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel that tracks when keys (track UUIDs) expire. Every touch moves a key to the bucket of its new
+    deadline in O(1), and expiring walks only the buckets whose time has passed, so the cost of an expiry pass is
+    proportional to the number of expired keys (plus the number of elapsed ticks), not to the number of live keys.
+    Keys expire between timeout and timeout + resolution seconds after their last touch.
+
+    Attributes:
+        timeout: The number of seconds after its last touch that a key expires.
+        resolution: The length of one tick of the wheel, in seconds.
+        buckets: One set of keys per tick; a key lives in the bucket of its deadline tick.
+        deadlines: A dictionary mapping each key to its deadline tick.
+        cursor: The last tick that has been expired.
+    """
+    def __init__(self, timeout, resolution=1.0, now=0.0):
+        """
+        Initializes an empty wheel.
+        :param timeout: The number of seconds after its last touch that a key expires.
+        :param resolution: The length of one tick of the wheel, in seconds.
+        :param now: The current time (on the same clock as later calls to touch and expire).
+        """
+        self.timeout = timeout
+        self.resolution = resolution
+
+        # the wheel only needs to span one timeout; the extra buckets keep a fresh deadline from wrapping onto the
+        # bucket that is about to expire
+        self.buckets = [set() for _ in range(int(math.ceil(timeout / resolution)) + 2)]
+        self.deadlines = dict()
+        self.cursor = int(now // resolution)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def touch(self, key, now):
+        """
+        Pushes a key's deadline back to timeout seconds after now (adding the key if it isn't in the wheel yet).
+        :param key: The key to touch.
+        :param now: The current time.
+        :return: None
+        """
+        tick = int(math.ceil((now + self.timeout) / self.resolution))
+        old_tick = self.deadlines.get(key)
+        if old_tick == tick:
+            return
+        if old_tick is not None:
+            self.buckets[old_tick % len(self.buckets)].discard(key)
+        self.buckets[tick % len(self.buckets)].add(key)
+        self.deadlines[key] = tick
+
+    def discard(self, key):
+        """
+        Removes a key from the wheel (if present).
+        :param key: The key to remove.
+        :return: None
+        """
+        tick = self.deadlines.pop(key, None)
+        if tick is not None:
+            self.buckets[tick % len(self.buckets)].discard(key)
+
+    def expire(self, now):
+        """
+        Removes and returns every key whose deadline has passed.
+        :param now: The current time.
+        :return: A list of the expired keys.
+        """
+        current = int(now // self.resolution)
+        expired = []
+
+        # walk the buckets of every tick since the last pass (at most one full turn of the wheel); if passes fall
+        # behind by more than a timeout, a bucket can also hold later deadlines, so each deadline is checked
+        first = max(self.cursor + 1, current - len(self.buckets) + 1)
+        for tick in range(first, current + 1):
+            bucket = self.buckets[tick % len(self.buckets)]
+            if bucket:
+                due = [key for key in bucket if self.deadlines[key] <= current]
+                for key in due:
+                    bucket.discard(key)
+                    del self.deadlines[key]
+                expired.extend(due)
+        self.cursor = max(self.cursor, current)
+        return expired
@@ -0,0 +1,280 @@
+import numpy as np
+
+from radar_track import (FEATURE_NAMES, HISTORY_COLUMNS, STATE_SIZE, accumulate, finalize, new_state, ring_window,
+                         window_features)
+from utilities import constants as c
+
+
+class TrackStore:
+    """
+    Struct-of-arrays storage for the live tracks. Every track owns one row (slot) of a set of preallocated NumPy arrays
+    instead of a per-track Python object, a UUID-to-slot index maps tracks to their slots, and the slots of removed
+    tracks are reused through a free list. The feature vectors of all tracks live in one contiguous matrix, so the
+    features of a batch of tracks are a single row gather. Features are evaluated lazily: updates only fold into the
+    accumulator (or history) and mark the track dirty, and a dirty track's features are recomputed once, when they're
+    next gathered. Only the live features (the ones the loaded model uses) are computed, and the other columns of the
+    feature matrix are left as they are; the accumulator still maintains every intermediate computation, so that the
+    features a model swapped in later needs cover the whole track and not just the updates since the swap. Each track
+    also caches its last classification (see stale_predictions), so that stable tracks aren't re-classified on every
+    update.
+
+    Attributes:
+        capacity: The number of allocated slots (doubled whenever all slots are in use).
+        streaming: True to maintain features with the streaming accumulator, False to recompute them over each
+        track's history window.
+        index: A dictionary mapping each track's UUID to its slot.
+        uuids: The UUID held by each slot (None for free slots).
+        free: The free slots, used as a stack.
+        n: The number of updates received by each slot's track.
+        last_update: The time of the latest update of each slot's track.
+        features: The (capacity, len(FEATURE_NAMES)) feature matrix.
+        live_features: The names of the features that are computed.
+        live_columns: The columns of the feature matrix those features are stored in.
+        dirty: True for each slot whose features are out of date.
+        evaluations: The number of feature vectors computed so far.
+        classified: True for each slot whose track has a cached classification.
+        prediction: The cached predicted class of each slot's track.
+        confidence: The confidence of each cached prediction.
+        classified_features: The (capacity, len(FEATURE_NAMES)) feature vectors the cached predictions were made from.
+        classified_n: The number of updates each track had when it was last classified.
+        classified_at: The time each track was last classified at.
+        state: The (capacity, STATE_SIZE) streaming accumulator states (streaming mode only).
+        history: The (capacity, history_capacity, len(HISTORY_COLUMNS)) ring buffers (window mode only).
+        head: The ring buffer row each slot's next update is written to (window mode only).
+        count: The number of valid ring buffer rows of each slot (window mode only).
+    """
+    def __init__(self, capacity=c.TRACK_STORE_CAPACITY, streaming=c.STREAMING_FEATURES,
+                 history_capacity=c.HISTORY_CAPACITY, window_seconds=c.HISTORY_SECONDS):
+        """
+        Initializes an empty store.
+        :param capacity: The number of slots to preallocate.
+        :param streaming: True to maintain features with the streaming accumulator, False to recompute them over each
+        track's history window.
+        :param history_capacity: The number of updates kept per track in window mode.
+        :param window_seconds: If not None, the history window is further limited to the last window_seconds seconds.
+        """
+        self.capacity = 0
+        self.streaming = streaming
+        self.history_capacity = history_capacity
+        self.window_seconds = window_seconds
+        self.index = dict()
+        self.free = []
+        self.uuids = np.empty(0, dtype=object)
+        self.n = np.zeros(0, dtype=np.int64)
+        self.last_update = np.zeros(0, dtype=np.float64)
+        self.features = np.zeros((0, len(FEATURE_NAMES)), dtype=np.float64)
+        self.set_live_features(FEATURE_NAMES)
+        self.dirty = np.zeros(0, dtype=bool)
+        self.evaluations = 0
+        self.classified = np.zeros(0, dtype=bool)
+        self.prediction = np.zeros(0, dtype=np.int64)
+        self.confidence = np.zeros(0, dtype=np.float64)
+        self.classified_features = np.zeros((0, len(FEATURE_NAMES)), dtype=np.float64)
+        self.classified_n = np.zeros(0, dtype=np.int64)
+        self.classified_at = np.zeros(0, dtype=np.float64)
+        if streaming:
+            self.state = np.zeros((0, STATE_SIZE), dtype=np.float64)
+        else:
+            self.history = np.zeros((0, history_capacity, len(HISTORY_COLUMNS)), dtype=np.float64)
+            self.head = np.zeros(0, dtype=np.int64)
+            self.count = np.zeros(0, dtype=np.int64)
+        self._grow(capacity)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, uuid):
+        return uuid in self.index
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes held by the store's arrays.
+        """
+        arrays = [self.n, self.last_update, self.features, self.dirty, self.classified, self.prediction,
+                  self.confidence, self.classified_features, self.classified_n, self.classified_at]
+        arrays += [self.state] if self.streaming else [self.history, self.head, self.count]
+        return sum(array.nbytes for array in arrays)
+
+    def _grow(self, capacity):
+        """
+        Enlarges every array of the store to the given number of slots and adds the new slots to the free list.
+        :param capacity: The new number of slots.
+        :return: None
+        """
+        extra = capacity - self.capacity
+        self.uuids = np.concatenate([self.uuids, np.empty(extra, dtype=object)])
+        self.n = np.concatenate([self.n, np.zeros(extra, dtype=np.int64)])
+        self.last_update = np.concatenate([self.last_update, np.zeros(extra)])
+        self.features = np.concatenate([self.features, np.zeros((extra, len(FEATURE_NAMES)))])
+        self.dirty = np.concatenate([self.dirty, np.zeros(extra, dtype=bool)])
+        self.classified = np.concatenate([self.classified, np.zeros(extra, dtype=bool)])
+        self.prediction = np.concatenate([self.prediction, np.zeros(extra, dtype=np.int64)])
+        self.confidence = np.concatenate([self.confidence, np.zeros(extra)])
+        self.classified_features = np.concatenate([self.classified_features, np.zeros((extra, len(FEATURE_NAMES)))])
+        self.classified_n = np.concatenate([self.classified_n, np.zeros(extra, dtype=np.int64)])
+        self.classified_at = np.concatenate([self.classified_at, np.zeros(extra)])
+        if self.streaming:
+            self.state = np.concatenate([self.state, np.zeros((extra, STATE_SIZE))])
+        else:
+            self.history = np.concatenate([self.history,
+                                           np.zeros((extra, self.history_capacity, len(HISTORY_COLUMNS)))])
+            self.head = np.concatenate([self.head, np.zeros(extra, dtype=np.int64)])
+            self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+
+        # push the new slots so that the lowest one is handed out first
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def set_live_features(self, names):
+        """
+        Sets the features that are computed from now on, and marks every track's features as out of date (the new
+        features cover each track's whole history, since the accumulator maintains every computation).
+        :param names: The names of the features (a subset of FEATURE_NAMES).
+        :return: None
+        """
+        self.live_features = [name for name in FEATURE_NAMES if name in names]
+        self.live_columns = np.array([FEATURE_NAMES.index(name) for name in self.live_features], dtype=np.int64)
+        if len(self.index) > 0:
+            self.dirty[list(self.index.values())] = True
+
+    def add(self, uuid, values, timestamp):
+        """
+        Adds an update to a track, creating the track if its UUID hasn't been seen yet, and marks its features as out
+        of date.
+        :param uuid: The UUID of the track.
+        :param values: The update's values, in PLOT_FIELDS order.
+        :param timestamp: The time the update was received at.
+        :return: The slot of the track.
+        """
+        slot = self.index.get(uuid)
+
+        # new tracks take a free slot and start with the feature vector of a single update (its speed and RCS)
+        if slot is None:
+            if len(self.free) == 0:
+                self._grow(max(2 * self.capacity, 1))
+            slot = self.free.pop()
+            self.index[uuid] = slot
+            self.uuids[slot] = uuid
+            self.n[slot] = 0
+            self.features[slot] = 0
+            self.features[slot, FEATURE_NAMES.index('avg_speed')] = values[0]
+            self.features[slot, FEATURE_NAMES.index('avg_rcs')] = values[7]
+            if self.streaming:
+                self.state[slot] = new_state()
+            else:
+                self.head[slot] = 0
+                self.count[slot] = 0
+            self.dirty[slot] = False
+            self.classified[slot] = False
+        else:
+            self.dirty[slot] = True
+
+        self.n[slot] += 1
+        self.last_update[slot] = timestamp
+
+        if self.streaming:
+            # the accumulator works on plain floats, which are much faster than NumPy scalars; every computation is
+            # maintained whatever the live features are, since the sums of the updates already folded in can't be
+            # rebuilt later (and a diff block's sums mixed with the track's total count would give wrong m1 and m2)
+            state = self.state[slot].tolist()
+            accumulate(state, *values[:6], values[7])
+            self.state[slot] = state
+        else:
+            head = self.head[slot]
+            self.history[slot, head, 0] = timestamp
+            self.history[slot, head, 1:] = values
+            self.head[slot] = (head + 1) % self.history_capacity
+            self.count[slot] = min(self.count[slot] + 1, self.history_capacity)
+
+        return slot
+
+    def refresh(self, slots):
+        """
+        Recomputes the features of every dirty slot among the given slots (each one only once).
+        :param slots: The slots whose features are about to be read.
+        :return: None
+        """
+        for slot in np.unique(slots[self.dirty[slots]]).tolist():
+            if self.streaming:
+                features = finalize(self.state[slot].tolist(), self.live_features)
+            else:
+                window = ring_window(self.history[slot], self.head[slot], self.count[slot], self.window_seconds)
+                features = window_features(window[:, 1:], self.live_features)
+            self.features[slot, self.live_columns] = [features[name] for name in self.live_features]
+            self.dirty[slot] = False
+            self.evaluations += 1
+
+    def remove(self, uuid):
+        """
+        Removes a track from the store and returns its slot to the free list.
+        :param uuid: The UUID of the track to remove.
+        :return: None
+        """
+        slot = self.index.pop(uuid)
+        self.uuids[slot] = None
+        self.free.append(slot)
+
+    def slots(self, uuids):
+        """
+        Looks up the slots of a sequence of tracks.
+        :param uuids: The UUIDs of the tracks.
+        :return: An integer array with the slot of each track.
+        """
+        return np.fromiter((self.index[uuid] for uuid in uuids), dtype=np.int64, count=len(uuids))
+
+    def feature_matrix(self, uuids):
+        """
+        Gathers the feature vectors of a sequence of tracks, bringing any out of date ones up to date first.
+        :param uuids: The UUIDs of the tracks.
+        :return: A (len(uuids), len(FEATURE_NAMES)) array, one row per track.
+        """
+        slots = self.slots(uuids)
+        self.refresh(slots)
+        return self.features[slots]
+
+    def stale_predictions(self, slots, features, now, distance, max_distance=c.CACHE_DISTANCE,
+                          max_age=c.CACHE_MAX_AGE):
+        """
+        Finds the tracks whose cached classification can't be reused. A track must be re-classified if it has never
+        been classified, if its features moved more than max_distance away from the ones it was classified from, if its
+        number of updates crossed a power of two, or if its classification is more than max_age seconds old.
+        :param slots: The slots of the tracks.
+        :param features: The tracks' current feature vectors (one row per slot).
+        :param now: The current time.
+        :param distance: A function returning the distance between each pair of rows of two feature matrices.
+        :param max_distance: The distance the features may move before the cached classification is invalid.
+        :param max_age: The number of seconds after which a cached classification is no longer used.
+        :return: A boolean array, True for each track that must be re-classified.
+        """
+        # update counts are bucketed by powers of two, so young tracks (whose features still change quickly) are
+        # re-classified more often than old ones
+        buckets_crossed = np.floor(np.log2(self.n[slots])) != np.floor(np.log2(np.maximum(self.classified_n[slots], 1)))
+
+        expired = now - self.classified_at[slots] > max_age
+        stale = ~self.classified[slots] | buckets_crossed | expired
+
+        # the distance is the expensive check, so it's only computed for the tracks that could still reuse their
+        # classification (young tracks cross a bucket on most updates, so most of them never get here)
+        candidates = np.flatnonzero(~stale)
+        if len(candidates):
+            moved = distance(features[candidates], self.classified_features[slots[candidates]]) > max_distance
+            stale[candidates] = moved
+        return stale
+
+    def cache_predictions(self, slots, features, predictions, confidence, now):
+        """
+        Caches the classification of a set of tracks.
+        :param slots: The slots of the tracks.
+        :param features: The feature vectors the tracks were classified from (one row per slot).
+        :param predictions: The predicted class of each track.
+        :param confidence: The confidence of each prediction.
+        :param now: The current time.
+        :return: None
+        """
+        self.classified[slots] = True
+        self.prediction[slots] = predictions
+        self.confidence[slots] = confidence
+        self.classified_features[slots] = features
+        self.classified_n[slots] = self.n[slots]
+        self.classified_at[slots] = now
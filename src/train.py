@@ -2,10 +2,20 @@ import argparse
 import glob
 import datetime;
 import os
-import uuid
 
 import pandas as pd
+import columnar_store
+import dataset
+import feature_cache
+import ingest
+import feature_manifest
+import model_artifact
+import model_selection
+import preprocess as pre
+import sklearn
 from model import Model
+from radar_track import FEATURE_NAMES
+from sklearn.base import clone
 
 from utilities import constants as c
 
@@ -16,10 +26,23 @@ if __name__ == '__main__':
         description='Trains a model on the provided data, then saves it to a given filename.')
 
     parser.add_argument('-s', '--saveFile', type=str, default='../models/' + datetime.datetime.now().strftime("%B %d, %Y, %H-%m-%S"), help="Savefile name")
-    parser.add_argument('-t', '--trainingFiles', type=str, default=[], nargs='+', help="Trains on all files listed")
-    parser.add_argument('-d', '--trainingDirectories', type=str, default=['../data/train'], nargs='+', help="Trains on all files in these directories")
+    parser.add_argument('-t', '--trainingFiles', type=str, default=[], nargs='+', help="Trains on all files (CSV files or columnar captures) listed")
+    parser.add_argument('-d', '--trainingDirectories', type=str, default=['../data/train'], nargs='+', help="Trains on all files (CSV files and columnar captures) in these directories")
     parser.add_argument('-l', '--trackLength', type=int, default=20, help="Maximum length before track splitting")
     parser.add_argument('-n', '--numRows', type=int, default=None, help="Limits the number of rows taken from the input during the test")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="Number of processes used to generate feature vectors (and of input files read at the same time)")
+    parser.add_argument('-C', '--cascade', action='store_true', help="Also trains a shallow first-stage tree that classifies confident rows without the full model")
+    parser.add_argument('-D', '--dropImportance', type=float, default=None, help="Drops the features whose importance is below this and retrains on the rest")
+    parser.add_argument('-F', '--featureReport', action='store_true', help="Prints each feature's importance next to its live compute cost")
+    parser.add_argument('-S', '--sweep', action='store_true', help="Sweeps model capacities and saves the cheapest model that meets the F1 target")
+    parser.add_argument('-f', '--f1Target', type=float, default=0.9, help="F1 score the swept model must reach (with --sweep)")
+    parser.add_argument('-V', '--crossValidate', type=int, default=None, help="Cross-validates the sweep's model capacities over this many folds grouped by track (on --workers processes) and saves the model with the best mean F1 score")
+    parser.add_argument('-b', '--includeBoosting', action='store_true', help="Also sweeps gradient-boosted trees (with --sweep or --crossValidate)")
+    parser.add_argument('-k', '--chunkSize', type=int, default=None, help="Reads the input files this many rows at a time instead of loading them into memory (for inputs larger than RAM)")
+    parser.add_argument('-i', '--idleRows', type=int, default=c.INGEST_IDLE_ROWS, help="With --chunkSize, closes a track once this many rows were read without an update to it, which bounds memory; a track that pauses for longer is split differently than without --chunkSize (0 keeps every track open until the end of the input)")
+    parser.add_argument('-c', '--cacheDir', type=str, default=c.FEATURE_CACHE_DIR, help="Directory the computed feature vectors are cached in")
+    parser.add_argument('-N', '--noCache', action='store_true', help="Recomputes the feature vectors without reading or writing the feature cache")
+    parser.add_argument('-r', '--report', type=str, default=None, help="CSV file to write the sweep or cross-validation results to (with --sweep or --crossValidate)")
 
     args = parser.parse_args()
 
@@ -28,10 +51,14 @@ if __name__ == '__main__':
 
     for dir in args.trainingDirectories:
         files |= set(glob.glob(dir + '/*' + '.csv', recursive=True))
+        files |= set(columnar_store.list_captures(dir))
 
     for file in args.trainingFiles:
         files.add(file)
 
+    # the files are always loaded in the same order, so the same files give the same data (and feature cache key)
+    files = sorted(files)
+
     print("Loading Files:")
     print("----------------------------------------")
     print(files)
@@ -39,62 +66,149 @@ if __name__ == '__main__':
 
     mod = Model()
 
-    data = []
-    for file in files:
-        data.append(pd.read_csv(file, low_memory=False))
-
-    if(len(data) > 0):
-        training = pd.concat(data)
-
-    if(args.numRows):
-        training = training[:args.numRows]
-
-    num_unique_uuids = training['UUID'].nunique()
-    print("Number of unique UUIDs:", num_unique_uuids)
-
-
-    print("Splitting tracks into length " + str(args.trackLength))
-    grouped = training.groupby("UUID")
-
-    dataframes = []
-    for group_name, group_df in grouped:
-        if len(group_df) > args.trackLength:
-            count = 0
-            
-            l = len(group_df)
-            for idx, row in group_df.iterrows():
-                if count % args.trackLength == 0 and l-count>=args.trackLength:
-                    new_id = str(uuid.uuid4())
-
-                group_df.at[idx, "UUID"] = new_id
-                count += 1
-        dataframes.append(group_df)
-
-    training = pd.concat(dataframes)
-
-    num_unique_uuids = training['UUID'].nunique()
-    print("Number of unique UUIDs after track-splitting:", num_unique_uuids)
-
-    grouped = training.groupby("Combat ID")
-
-    dataframes = {}
-    for name, group in grouped:
-        dataframes[name] = group.reset_index(drop=True)
-
-    labeled_data = pd.DataFrame()
-
-    if("HOSTILE" in grouped.groups):
-        dataframes["HOSTILE"]["Label"] = 1
-        labeled_data = pd.concat([labeled_data, dataframes["HOSTILE"]], ignore_index=True)
-        print("HOSTILE updates: ", len(grouped.groups["HOSTILE"]))
-    if("UNKNOWN_THREAT" in grouped.groups):
-        dataframes["UNKNOWN_THREAT"]["Label"] = 0
-        labeled_data = pd.concat([labeled_data, dataframes["UNKNOWN_THREAT"]], ignore_index=True)
-        print("UNKNOWN_THREAT updates: ", len(grouped.groups["UNKNOWN_THREAT"]))
-
-    print("")
-
-    mod.train_model(labeled_data)
+    # the feature vectors computed from the same files (split into the same track length) by an earlier run are reused
+    key = feature_cache.cache_key(files, args.trackLength, args.numRows,
+                                  (args.idleRows or None) if args.chunkSize else None)
+    cached = None if args.noCache else feature_cache.load(key, args.cacheDir)
+    labeled_data = None
+
+    if cached is not None:
+        table, cache_metadata = cached
+        num_rows, num_unique_uuids = cache_metadata['num_rows'], cache_metadata['num_tracks']
+        print(f"Loaded the feature vectors of {len(table)} tracks from the feature cache ({key[:12]})")
+        print("")
+    elif args.chunkSize:
+        # stream the files in chunks, keeping only the open tracks' pending updates in memory
+        print(f"Reading the files {args.chunkSize} rows at a time and splitting tracks into length {args.trackLength}")
+        table, ingestion = ingest.read_feature_table(files, args.trackLength, args.numRows, args.chunkSize,
+                                                     args.idleRows)
+        num_rows, num_unique_uuids = ingestion.rows_labelled, len(table)
+        print(f"Computed the feature vectors of {len(table)} tracks from {ingestion.rows_read} rows "
+              f"(at most {ingestion.peak_open} open tracks and {ingestion.peak_pending_rows} pending updates at once)")
+        print("")
+        if not args.noCache:
+            feature_cache.save(key, table, {'files': files, 'num_rows': num_rows, 'num_tracks': num_unique_uuids},
+                               args.cacheDir)
+    else:
+        labeled_data, num_unique_uuids = dataset.load_labeled_data(files, args.trackLength, args.numRows,
+                                                                   args.workers)
+
+        table = mod.feature_table(labeled_data, workers=args.workers)
+        num_rows = len(labeled_data)
+        if not args.noCache:
+            feature_cache.save(key, table, {'files': files, 'num_rows': num_rows, 'num_tracks': num_unique_uuids},
+                               args.cacheDir)
+
+    X, y, groups = table[FEATURE_NAMES], table["Label"], table["Track"]
+
+    if args.crossValidate:
+        # cross-validate every candidate capacity with folds grouped by track (the features are computed only once),
+        # and keep the one with the best mean F1 score, re-trained on all of the data
+        candidates = model_selection.candidate_models(args.includeBoosting)
+        print(f"Cross-validating {len(candidates)} models over {args.crossValidate} folds grouped by track "
+              f"({groups.nunique()} tracks)...")
+        results, fits = model_selection.grouped_search(X, y, groups, candidates, args.crossValidate, args.workers)
+
+        with pd.option_context('display.max_rows', None, 'display.width', 200, 'display.float_format', '{:.4f}'.format):
+            print("\nCross-validation (ranked by mean F1 score):")
+            print(results.to_string(index=False))
+        if args.report:
+            results.to_csv(args.report, index=False)
+            print("Saved the cross-validation results to " + args.report)
+
+        candidates = dict(candidates)
+        chosen = results.loc[0, 'model']
+        print(f"\nThe model with the best mean F1 score is: {chosen}")
+        mod.model = clone(candidates[chosen])
+        mod.fit_model(X, y)
+        cascade_report = mod.train_cascade(X, y) if args.cascade and args.dropImportance is None else None
+    elif args.sweep:
+        # train every candidate capacity on a split of the data, and report its F1 score against its inference latency
+        results, candidates = model_selection.sweep(X, y, groups, include_boosting=args.includeBoosting)
+        results = model_selection.pareto_frontier(results)
+
+        with pd.option_context('display.max_rows', None, 'display.width', 200, 'display.float_format', '{:.3f}'.format):
+            print("\nModel sweep (sorted by single-row p99 latency, * = Pareto frontier):")
+            print(results.assign(pareto=results['pareto'].map({True: '*', False: ''})).to_string(index=False))
+        if args.report:
+            results.to_csv(args.report, index=False)
+            print("Saved the sweep results to " + args.report)
+
+        # keep the cheapest candidate that meets the F1 target, re-trained on all of the data
+        chosen, met = model_selection.select_model(results, args.f1Target)
+        if met:
+            print(f"\nThe cheapest model with an F1 score of at least {args.f1Target} is: {chosen}")
+        else:
+            print(f"\nNo model reached an F1 score of {args.f1Target}, keeping the most accurate: {chosen}")
+        mod.model = clone(candidates[chosen])
+        mod.fit_model(X, y)
+        cascade_report = mod.train_cascade(X, y) if args.cascade and args.dropImportance is None else None
+    else:
+        cascade_report = mod.train_on_features(X, y, with_cascade=args.cascade and args.dropImportance is None,
+                                               groups=groups)
+
+    # drop the features the model barely uses and retrain without them (the live tracks then don't compute them)
+    dropped = []
+    if args.dropImportance is not None:
+        importances = feature_manifest.model_importances(mod.model)
+        if importances is None:
+            parser.error("--dropImportance needs a model with feature importances (a random forest)")
+        kept, dropped = feature_manifest.select_features(importances, args.dropImportance)
+        full_importances = importances
+        print(f"\nDropping {len(dropped)} features with an importance below {args.dropImportance}: {dropped}")
+        print("Retraining on " + str(kept))
+        if args.sweep or args.crossValidate:
+            mod.model = clone(candidates[chosen])
+            mod.fit_model(X[kept], y)
+            cascade_report = mod.train_cascade(X[kept], y) if args.cascade else None
+        else:
+            mod.model = clone(mod.model)
+            cascade_report = mod.train_on_features(X[kept], y, with_cascade=args.cascade, groups=groups)
+
+    if args.featureReport:
+        # the importances are those of the model trained on every feature, so the dropped features have one too
+        importances = full_importances if dropped else feature_manifest.model_importances(mod.model) or {}
+        used = feature_manifest.used_features(mod.forest, mod.cascade) if mod.forest is not None else mod.feature_names
+        # the costs are timed on the raw updates, which aren't kept when the feature vectors come from the cache or from
+        # chunked ingestion (the first rows of the first input are then read again, whether it's a CSV file or a
+        # columnar capture)
+        if labeled_data is not None:
+            sample = labeled_data
+        else:
+            sample = pre.read_df(files[0], dataset.INPUT_COLUMNS, nrows=20000)
+        costs = feature_manifest.measure_costs(sample)
+        with pd.option_context('display.width', 200, 'display.float_format', '{:.4f}'.format):
+            print("\nFeatures (importance with every feature, use by the final model, live compute cost per update)")
+            print(feature_manifest.feature_report(importances, used, costs, dropped).to_string(index=False))
+
+    if cascade_report is not None:
+        print("\nCascade (on held-out data)")
+        print(f"full model accuracy: {100 * cascade_report['full_accuracy']:.2f}%")
+        if cascade_report['first_stage_accuracy'] is not None:
+            print(f"first stage accuracy on the rows it keeps: {100 * cascade_report['first_stage_accuracy']:.2f}%")
+        print(f"cascade accuracy: {100 * cascade_report['cascade_accuracy']:.2f}%")
+        print(f"rows escalated to the full model: {100 * cascade_report['escalated']:.1f}% "
+              f"(first stage confidence below {cascade_report['threshold']:.4f})")
     mod.save_model(args.saveFile)
 
-    print("\nSaved model to " + args.saveFile)
\ No newline at end of file
+    print("\nSaved model to " + args.saveFile)
+
+    # models that can't be flattened (gradient-boosted trees) are only saved as pickles (without a cascade)
+    if mod.forest is None:
+        mod.close()
+        raise SystemExit(0)
+
+    # also save the model as a memory-mappable artifact (which is what inference loads), with the training metadata
+    artifact_file = os.path.splitext(args.saveFile)[0] + model_artifact.EXTENSION
+    metadata = {
+        'trained': datetime.datetime.now().isoformat(timespec='seconds'),
+        'training_files': files,
+        'track_length': args.trackLength,
+        'num_rows': num_rows,
+        'num_tracks': num_unique_uuids,
+        'sklearn_version': sklearn.__version__,
+    }
+    mod.export_model(artifact_file, metadata)
+
+    print("Saved model artifact to " + artifact_file)
+    mod.close()
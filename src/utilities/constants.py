@@ -11,4 +11,115 @@ DROP_COLUMNS = ['Name', 'Create Time', 'User Edit Time', 'Type', 'Associated UUI
                 'Deleted', 'Deleted Time', 'AIS MMSI', 'AIS IMO', 'AIS Call Sign', 'AIS Ship Type',
                 'AIS Destination', 'AIS ETA', 'Fused', 'Fused Tracks']
 
-MODEL_PATH = '../models/apr17_full.sav'
+# the model used for inference: a memory-mapped model artifact (see model_artifact.py; convert_model.py converts a
+# pickled .sav model into one)
+MODEL_PATH = '../models/apr17_full.forest'
+
+# train.py and test.py cache the feature matrices they compute in FEATURE_CACHE_DIR (keyed on their input files, track
+# length and feature and dataset versions, see feature_cache.py), keeping the FEATURE_CACHE_ENTRIES most recently
+# written ones
+FEATURE_CACHE_DIR = '../data/cache'
+FEATURE_CACHE_ENTRIES = 8
+
+# the version of the way input rows become labelled track segments; bump it whenever the semantics of
+# dataset.split_tracks, dataset.label_tracks, dataset.read_inputs or ingest.ChunkedIngest change (which updates are
+# kept, how they're labelled or how tracks are split), so that feature matrices cached by earlier versions are no
+# longer used
+DATASET_VERSION = 1
+
+# train.py and test.py --chunkSize read their input files INGEST_CHUNK_ROWS rows at a time and compute the features of
+# finished tracks in batches of at least INGEST_BATCH_ROWS updates; a track is closed once INGEST_IDLE_ROWS rows were
+# read without an update to it, which bounds memory by the tracks updated in the latest INGEST_IDLE_ROWS +
+# INGEST_CHUNK_ROWS rows. A track that pauses for longer than that has its last segment finished early and its later
+# updates start a new segment, so its split (and features) can differ from the in-memory split; with 0, tracks stay
+# open until the end of the input, which always gives the in-memory split but no longer bounds memory
+INGEST_CHUNK_ROWS = 100000
+INGEST_BATCH_ROWS = 100000
+INGEST_IDLE_ROWS = 200000
+
+# benchmark.py compares its results to the baseline in BENCHMARK_BASELINE (regenerate it on the reference machine with
+# benchmark.py -s whenever a change is meant to move the numbers)
+BENCHMARK_BASELINE = '../benchmarks/baseline.json'
+
+# import_data.py converts CSV captures into columnar captures (one .npy file per needed column, partitioned by Combat
+# ID) under COLUMNAR_DIR; train.py and test.py read them much faster than the CSV files
+COLUMNAR_DIR = '../data/columnar'
+
+# maintain live track features with constant-cost running sums instead of recomputing them over the whole history
+STREAMING_FEATURES = True
+
+# the history window used when features are recomputed (STREAMING_FEATURES = False); each track keeps at most
+# HISTORY_CAPACITY updates (72 bytes each) and, if HISTORY_SECONDS is not None, only the updates from that many
+# seconds before its latest one
+HISTORY_CAPACITY = 128
+HISTORY_SECONDS = None
+
+# the number of track slots the live track store preallocates (doubled whenever they're all in use)
+TRACK_STORE_CAPACITY = 1024
+
+# live tracks without an update for STALE_TRACK_TIMEOUT seconds are evicted; eviction runs every EXPIRY_RESOLUTION
+# seconds, so a track is evicted at most that much later than its timeout
+STALE_TRACK_TIMEOUT = 90
+EXPIRY_RESOLUTION = 1.0
+
+# in listen mode, measurements are classified in batches of up to BATCH_SIZE measurements, and a batch waits at most
+# BATCH_TIMEOUT_MS milliseconds for more measurements after its first one arrives (a size of 1 disables batching)
+BATCH_SIZE = 64
+BATCH_TIMEOUT_MS = 50
+
+# batch statistics are computed over the latest BATCH_STATS_HISTORY batches and printed every BATCH_STATS_INTERVAL
+# batches
+BATCH_STATS_HISTORY = 1000
+BATCH_STATS_INTERVAL = 100
+
+# in listen mode, each wakeup receives every waiting datagram (of at most MAX_DATAGRAM_BYTES bytes) back to back into
+# one preallocated buffer of DRAIN_BUFFER_BYTES bytes; RECEIVE_BUFFER_BYTES sizes the socket's kernel receive buffer
+# (SO_RCVBUF, capped by net.core.rmem_max on Linux; None keeps the system default), which holds the datagrams that
+# arrive while a batch is being classified
+MAX_DATAGRAM_BYTES = 1024
+DRAIN_BUFFER_BYTES = 1 << 18
+RECEIVE_BUFFER_BYTES = 1 << 22
+
+# once more than OVERLOAD_BACKLOG measurements are waiting to be classified, the receiver falls back on
+# OVERLOAD_POLICY: 'coalesce' keeps only the latest waiting measurement of each track, 'shed' drops the oldest waiting
+# measurements, and 'none' classifies every measurement however far behind it falls
+OVERLOAD_POLICY = 'coalesce'
+OVERLOAD_BACKLOG = 4096
+
+# listen mode runs as an asyncio pipeline (ingest, classify and output stages connected by queues of
+# PIPELINE_QUEUE_SIZE batches, see utilities/input/pipeline.py) unless LISTEN_PIPELINE = False, which runs the single
+# synchronous receive loop
+LISTEN_PIPELINE = True
+PIPELINE_QUEUE_SIZE = 8
+
+# live tracks reuse their last classification until their features cross more than CACHE_DISTANCE of the forest's
+# split points (with 0, a reused classification is exactly what re-classifying would return), the track's number of
+# updates crosses a power of two, or the classification is CACHE_MAX_AGE seconds old (PREDICTION_CACHE = False
+# re-classifies every track on every update). The cache is off by default: the flat forest classifies a scan in less
+# time than the cache's checks and bookkeeping take, so it only pays off with slower models (see benchmark.py -c)
+PREDICTION_CACHE = False
+CACHE_DISTANCE = 0
+CACHE_MAX_AGE = 5.0
+
+# in listen and demo modes the model file is checked for changes every MODEL_POLL_INTERVAL seconds (and on SIGHUP), and
+# a changed model is loaded in the background and swapped in between batches (0 only reloads on SIGHUP)
+MODEL_POLL_INTERVAL = 2.0
+
+# with EARLY_EXIT_CUTOFF = None, tracks get their most probable class; otherwise a track is classified as a drone when
+# its drone probability exceeds EARLY_EXIT_CUTOFF, and the forest's trees are evaluated in order only until the
+# remaining trees can't change that decision (the classes are exactly those of evaluating every tree)
+EARLY_EXIT_CUTOFF = None
+
+# the first stage of a classifier cascade (train.py --cascade) is a decision tree of depth CASCADE_DEPTH, and its
+# escalation threshold is the lowest one at which the cascade is at most CASCADE_TOLERANCE less accurate than the full
+# model on held-out data
+CASCADE_DEPTH = 4
+CASCADE_TOLERANCE = 0.005
+
+# the model capacities swept by train.py --sweep (a depth of None is unbounded); each candidate's latency is measured
+# over SWEEP_LATENCY_REPEATS single rows and SWEEP_LATENCY_REPEATS batches of BATCH_SIZE rows
+SWEEP_TREES = [10, 25, 50, 100]
+SWEEP_DEPTHS = [6, 12, None]
+SWEEP_LEAF_SIZES = [1, 5]
+SWEEP_BOOSTING_ITERATIONS = [50, 100]
+SWEEP_LATENCY_REPEATS = 200
@@ -0,0 +1,153 @@
+import collections
+import numpy as np
+import pandas as pd
+import time
+
+from .. import constants as c
+
+
+class MicroBatcher:
+    """
+    This class collects decoded radar measurements and classifies them in batches: a batch is classified as soon as it
+    holds size measurements or its oldest measurement has waited timeout seconds, whichever comes first. Larger
+    batches amortize the cost of each classification over more measurements, at the cost of latency.
+
+    Attributes:
+        classify: The function called with each batch (a DataFrame with one row per measurement).
+        size: The number of measurements that triggers a batch.
+        timeout: The number of seconds the oldest measurement of a batch may wait before the batch is triggered.
+        assemble: The function that turns the pending measurements into a batch (a DataFrame).
+        pending: The measurements of the batch being collected (dictionaries, or whatever assemble takes).
+        pending_count: The number of pending measurements.
+        first_arrival: The time the oldest pending measurement arrived at (None when nothing is pending).
+        batches: The number of batches classified so far.
+        messages: The number of measurements classified so far.
+        sizes: The sizes of the latest batches.
+        latencies: The latency of the latest batches (from the arrival of their oldest measurement until their
+        classification finished), in seconds.
+        classify_times: The time the latest batches spent being classified, in seconds.
+    """
+    def __init__(self, classify, size=c.BATCH_SIZE, timeout=c.BATCH_TIMEOUT_MS / 1000,
+                 history=c.BATCH_STATS_HISTORY, assemble=pd.DataFrame):
+        """
+        Initializes an empty batcher.
+        :param classify: The function called with each batch (a DataFrame with one row per measurement).
+        :param size: The number of measurements that triggers a batch (1 classifies every measurement on its own).
+        :param timeout: The number of seconds the oldest measurement of a batch may wait before the batch is triggered.
+        :param history: The number of latest batches the statistics are computed over.
+        :param assemble: The function that turns the list of pending measurements into a batch (by default, a list of
+        dictionaries with the fields of ctc_to_record).
+        """
+        self.classify = classify
+        self.size = size
+        self.timeout = timeout
+        self.assemble = assemble
+        self.pending = []
+        self.pending_count = 0
+        self.first_arrival = None
+        self.batches = 0
+        self.messages = 0
+        self.sizes = collections.deque(maxlen=history)
+        self.latencies = collections.deque(maxlen=history)
+        self.classify_times = collections.deque(maxlen=history)
+
+    def __len__(self):
+        return self.pending_count
+
+    def add(self, measurement, now=None):
+        """
+        Adds a measurement to the pending batch, and classifies the batch if it's full.
+        :param measurement: A dictionary with the measurement's fields (see ctc_to_record).
+        :param now: The time the measurement arrived at (on the time.perf_counter clock), defaults to the current time.
+        :return: None
+        """
+        self.add_many(measurement, 1, now)
+
+    def add_many(self, measurements, count, now=None):
+        """
+        Adds several measurements to the pending batch at once, and classifies the batch if it's full (so a batch can
+        exceed size by the measurements added last).
+        :param measurements: The measurements, as one item of the list passed to assemble (e.g., a structured array
+        of measurement messages, see receiver.assemble_measurements).
+        :param count: The number of measurements.
+        :param now: The time the measurements arrived at (on the time.perf_counter clock), defaults to the current time.
+        :return: None
+        """
+        if now is None:
+            now = time.perf_counter()
+        if self.first_arrival is None:
+            self.first_arrival = now
+        self.pending.append(measurements)
+        self.pending_count += count
+        if self.pending_count >= self.size:
+            self.flush()
+
+    def time_left(self, now=None):
+        """
+        Returns how long the pending batch can still wait before it must be classified.
+        :param now: The current time (on the time.perf_counter clock), defaults to the current time.
+        :return: The number of seconds left (0 if the deadline has passed), or None if nothing is pending.
+        """
+        if self.first_arrival is None:
+            return None
+        if now is None:
+            now = time.perf_counter()
+        return max(0.0, self.first_arrival + self.timeout - now)
+
+    def flush(self):
+        """
+        Classifies the pending batch (if any) and records its statistics.
+        :return: None
+        """
+        if not self.pending:
+            return
+
+        batch = self.assemble(self.pending)
+        first_arrival = self.first_arrival
+        self.pending = []
+        self.pending_count = 0
+        self.first_arrival = None
+
+        start = time.perf_counter()
+        self.classify(batch)
+        end = time.perf_counter()
+
+        self.batches += 1
+        self.messages += len(batch)
+        self.sizes.append(len(batch))
+        self.latencies.append(end - first_arrival)
+        self.classify_times.append(end - start)
+
+    def stats(self):
+        """
+        Summarizes the latest batches, to tune the size and timeout (throughput against latency).
+        :return: A dictionary with the number of batches and measurements classified so far, and the mean batch size,
+        the mean, 50th, 95th percentile and maximum batch latency (in milliseconds), and the mean classification time
+        per measurement (in microseconds) over the latest batches.
+        """
+        if not self.latencies:
+            return {'batches': 0, 'messages': 0}
+        latencies = 1000 * np.array(self.latencies)
+        return {
+            'batches': self.batches,
+            'messages': self.messages,
+            'mean_size': float(np.mean(self.sizes)),
+            'latency_ms_mean': float(latencies.mean()),
+            'latency_ms_p50': float(np.percentile(latencies, 50)),
+            'latency_ms_p95': float(np.percentile(latencies, 95)),
+            'latency_ms_max': float(latencies.max()),
+            'classify_us_per_message': 1e6 * sum(self.classify_times) / sum(self.sizes),
+        }
+
+    def format_stats(self):
+        """
+        Formats the statistics of the latest batches as a single line, for printing.
+        :return: The formatted statistics.
+        """
+        stats = self.stats()
+        if stats['batches'] == 0:
+            return "batches: none classified yet"
+        return (f"batches: {stats['batches']} ({stats['messages']} messages, mean size {stats['mean_size']:.1f}), "
+                f"latency ms mean {stats['latency_ms_mean']:.2f} / p50 {stats['latency_ms_p50']:.2f} / "
+                f"p95 {stats['latency_ms_p95']:.2f} / max {stats['latency_ms_max']:.2f}, "
+                f"classification {stats['classify_us_per_message']:.0f} us/message")
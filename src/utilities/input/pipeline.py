@@ -0,0 +1,404 @@
+import asyncio
+import collections
+import numpy as np
+import pandas as pd
+import socket
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from .receiver import Receiver
+from .. import constants as c
+
+
+class StageQueue:
+    """
+    A bounded queue between two stages of the listen pipeline, which records how deep it gets and how long items wait
+    in it (from being put until being taken out).
+
+    Attributes:
+        name: The name the statistics are printed under.
+        queue: The asyncio queue (of (time put, item) tuples).
+        puts: The number of items put so far.
+        full_puts: The number of items that found the queue full (and had to wait for room: backpressure).
+        peak_depth: The largest number of items the queue held.
+        waits: The time the latest items waited in the queue, in seconds.
+    """
+    def __init__(self, name, size=c.PIPELINE_QUEUE_SIZE, history=c.BATCH_STATS_HISTORY):
+        """
+        Initializes an empty queue.
+        :param name: The name the statistics are printed under.
+        :param size: The number of items the queue holds.
+        :param history: The number of latest items the wait statistics are computed over.
+        """
+        self.name = name
+        self.queue = asyncio.Queue(maxsize=size)
+        self.puts = 0
+        self.full_puts = 0
+        self.peak_depth = 0
+        self.waits = collections.deque(maxlen=history)
+
+    def __len__(self):
+        return self.queue.qsize()
+
+    def full(self):
+        return self.queue.full()
+
+    async def put(self, item):
+        """
+        Puts an item at the end of the queue, waiting for room if the queue is full.
+        :param item: The item.
+        :return: None
+        """
+        if self.queue.full():
+            self.full_puts += 1
+        await self.queue.put((time.perf_counter(), item))
+        self.puts += 1
+        self.peak_depth = max(self.peak_depth, self.queue.qsize())
+
+    async def get(self):
+        """
+        Takes the item at the front of the queue, waiting for one if the queue is empty.
+        :return: The item.
+        """
+        put_at, item = await self.queue.get()
+        self.waits.append(time.perf_counter() - put_at)
+        return item
+
+    def format_stats(self):
+        """
+        Formats the queue's statistics as a single line, for printing.
+        :return: The formatted statistics.
+        """
+        waits = 1000 * np.array(self.waits) if self.waits else np.zeros(1)
+        return (f"{self.name} queue: depth {len(self)}/{self.queue.maxsize} (peak {self.peak_depth}), full on "
+                f"{self.full_puts} of {self.puts} puts, wait ms mean {waits.mean():.2f} / p50 "
+                f"{np.percentile(waits, 50):.2f} / p95 {np.percentile(waits, 95):.2f} / max {waits.max():.2f}")
+
+
+class AsyncReceiver(Receiver):
+    """
+    Listen mode as an asyncio pipeline of three stages connected by bounded queues, so that a slow stage doesn't stall
+    receiving:
+        ingest: each time the socket is readable, the event loop receives every waiting datagram into the preallocated
+        buffer (see Receiver.drain), decodes them and collects the measurements into micro-batches (like Receiver does,
+        including track drops and the overload policy);
+        classify: classifies each batch (Model.classify_batch) in a single-thread executor, so the event loop keeps
+        receiving while the model runs; track drops are applied in the same executor, in order with the batches;
+        output: prints and sends each classified batch (Model.emit_predictions) in a thread of its own.
+    When the output queue is full, the classify stage waits. When the classify queue is full, the ingest stage's
+    batches wait in its outbox: with the 'none' overload policy the ingest stage then stops reading the socket until the
+    queue has room (datagrams wait in the kernel's receive buffer, and the kernel drops them once it's full), otherwise
+    it keeps reading and applies the overload policy to the waiting batches once more than overload_backlog
+    measurements are waiting to be classified.
+
+    Attributes:
+        classify_queue: The StageQueue from the ingest stage to the classify stage, of ('batch', DataFrame) and
+        ('drop', list of track numbers) items.
+        output_queue: The StageQueue from the classify stage to the output stage, of classified DataFrames.
+        outbox: The items the ingest stage produced that aren't in the classify queue yet.
+        outbox_ready: Set while the outbox holds items.
+        outbox_rows: The number of measurements in the outbox.
+        queued: The number of measurements that left the outbox but aren't classified yet.
+        loop: The event loop the pipeline runs on.
+        paused: True while the ingest stage has stopped reading the socket.
+        deadline: The event loop's handle of the pending batch's deadline, or None.
+        service_times: A dictionary mapping the classify and output stages to the time they spent on each of the
+        latest batches, in seconds.
+        errors: A dictionary mapping the classify and output stages to the number of batches that raised an exception.
+        emitted: The number of batches that went through the output stage.
+        emitted_rows: The number of measurements in those batches (fewer than were batched when the overload policy
+        dropped some).
+    """
+    def __init__(self, model, host, port, batch_size=c.BATCH_SIZE, batch_timeout=c.BATCH_TIMEOUT_MS / 1000,
+                 receive_buffer=c.RECEIVE_BUFFER_BYTES, overload_policy=c.OVERLOAD_POLICY,
+                 overload_backlog=c.OVERLOAD_BACKLOG, queue_size=c.PIPELINE_QUEUE_SIZE):
+        super().__init__(model, host, port, None, batch_size, batch_timeout, receive_buffer, overload_policy,
+                         overload_backlog)
+
+        # full batches go to the classify stage instead of being classified on the spot
+        self.batcher.classify = self.submit_batch
+        self.queue_size = queue_size
+        self.classify_queue = None
+        self.output_queue = None
+        self.outbox = collections.deque()
+        self.outbox_ready = None
+        self.outbox_rows = 0
+        self.queued = 0
+        self.loop = None
+        self.paused = False
+        self.deadline = None
+
+        self.service_times = {'classify': collections.deque(maxlen=c.BATCH_STATS_HISTORY),
+                              'output': collections.deque(maxlen=c.BATCH_STATS_HISTORY)}
+        self.errors = {'classify': 0, 'output': 0}
+        self.emitted = 0
+        self.emitted_rows = 0
+
+    def receive_messages(self):
+        """
+        Runs the pipeline (see run).
+        :return: None (control is never returned from this function unless the program is killed).
+        """
+        asyncio.run(self.run())
+
+    async def run(self):
+        """
+        Creates the UDP socket and the pipeline's queues, then runs the stages until the program is killed.
+        :return: None
+        """
+        self.loop = asyncio.get_running_loop()
+        self.classify_queue = StageQueue('classify', self.queue_size)
+        self.output_queue = StageQueue('output', self.queue_size)
+        self.outbox_ready = asyncio.Event()
+
+        # size the kernel's receive buffer, which holds the datagrams that arrive between two drains of the socket
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            if self.receive_buffer:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+            s.bind((self.host, self.port))
+            s.setblocking(False)
+            self.socket = s
+            self.loop.add_reader(s, self.ingest)
+            print(f"Listening on {self.host}:{self.port} (receive buffer: "
+                  f"{s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes, pipeline queues of {self.queue_size} "
+                  f"batches, overload policy: {self.overload_policy})")
+
+            # one thread per stage: the model isn't thread-safe, so every batch is classified by the same thread
+            with ThreadPoolExecutor(max_workers=1) as classify_pool, ThreadPoolExecutor(max_workers=1) as output_pool:
+                try:
+                    await asyncio.gather(self.feed(), self.classify_stage(classify_pool),
+                                         self.output_stage(output_pool))
+                finally:
+                    if not self.paused:
+                        self.loop.remove_reader(s)
+
+    def ingest(self):
+        """
+        The ingest stage, called by the event loop whenever the socket is readable: receives every waiting datagram
+        (see Receiver.drain), decodes and routes them (see Receiver.route), and arms the pending batch's deadline.
+        :return: None
+        """
+        count, _ = self.drain(self.socket)
+        if count == 0:
+            return
+        self.wakeups += 1
+        self.datagrams += count
+        self.largest_drain = max(self.largest_drain, count)
+        self.route(self.buffer, self.lengths[:count], time.perf_counter())
+        self.arm_deadline()
+
+    def arm_deadline(self):
+        """
+        Schedules the pending batch to be submitted once its oldest measurement has waited the batch timeout.
+        :return: None
+        """
+        wait = self.batcher.time_left()
+        if self.deadline is None and wait is not None:
+            self.deadline = self.loop.call_later(wait, self.deadline_passed)
+
+    def deadline_passed(self):
+        """
+        Submits the pending batch if its deadline has passed (a batch submitted since was full, and the deadline moves
+        to the next one).
+        :return: None
+        """
+        self.deadline = None
+        if self.batcher.time_left() == 0:
+            self.flush_batch()
+        self.arm_deadline()
+
+    def submit_batch(self, batch):
+        """
+        Sends a full (or timed out) batch to the classify stage (the MicroBatcher's classify function).
+        :param batch: A DataFrame with one row per measurement.
+        :return: None
+        """
+        self.outbox_rows += len(batch)
+        self.submit(('batch', batch))
+
+    def drop_tracks(self, uuids):
+        """
+        Submits the pending batch, then sends the dropped tracks to the classify stage (which removes them once the
+        batches before them are classified).
+        :param uuids: The track numbers of the dropped tracks.
+        :return: None
+        """
+        self.flush_batch()
+        self.submit(('drop', uuids))
+
+    def submit(self, item):
+        """
+        Hands an item to the feeder of the classify queue. With the 'none' overload policy, the ingest stage stops
+        reading the socket while the classify queue is full; otherwise the overload policy is applied to the outbox.
+        :param item: A ('batch', DataFrame) or ('drop', list of track numbers) tuple.
+        :return: None
+        """
+        self.outbox.append(item)
+        self.outbox_ready.set()
+
+        if self.overload_policy != 'none':
+            self.relieve_outbox()
+        elif self.classify_queue.full() and not self.paused:
+            self.loop.remove_reader(self.socket)
+            self.paused = True
+
+    def backlog(self):
+        """
+        Counts the measurements waiting to be classified: the ones in the pending batch, in the outbox and in the
+        classify queue.
+        :return: The number of measurements.
+        """
+        return len(self.batcher) + self.outbox_rows + self.queued
+
+    def relieve_outbox(self):
+        """
+        Applies the overload policy to the batches waiting in the outbox when the backlog (see backlog) is larger than
+        overload_backlog: 'coalesce' merges each run of consecutive batches into one batch holding only the latest
+        measurement of each track (the runs are split by track drops, which stay in order), and 'shed' drops the oldest
+        measurements of the outbox until the backlog fits. The batches already in the classify queue are left as they
+        are. The dropped measurements are counted in self.dropped.
+        :return: None
+        """
+        if self.backlog() <= self.overload_backlog:
+            return
+        self.overloads += 1
+
+        items, run = [], []
+        if self.overload_policy == 'coalesce':
+            for kind, payload in self.outbox:
+                if kind == 'batch':
+                    run.append(payload)
+                    continue
+                if run:
+                    items.append(('batch', _coalesce(run)))
+                    run = []
+                items.append((kind, payload))
+            if run:
+                items.append(('batch', _coalesce(run)))
+        else:
+            excess = self.backlog() - self.overload_backlog
+            for kind, payload in self.outbox:
+                if kind == 'batch' and excess > 0:
+                    shed = min(excess, len(payload))
+                    excess -= shed
+                    if shed == len(payload):
+                        continue
+                    payload = payload.iloc[shed:].reset_index(drop=True)
+                items.append((kind, payload))
+        self.outbox = collections.deque(items)
+
+        rows = sum(len(payload) for kind, payload in self.outbox if kind == 'batch')
+        self.dropped['coalesced' if self.overload_policy == 'coalesce' else 'shed'] += self.outbox_rows - rows
+        self.outbox_rows = rows
+
+    async def feed(self):
+        """
+        Moves the ingest stage's items into the classify queue, waiting for room when it's full, and resumes reading the
+        socket once the outbox is empty.
+        :return: None
+        """
+        while True:
+            await self.outbox_ready.wait()
+            while self.outbox:
+                item = self.outbox.popleft()
+                if item[0] == 'batch':
+                    self.outbox_rows -= len(item[1])
+                    self.queued += len(item[1])
+                await self.classify_queue.put(item)
+            self.outbox_ready.clear()
+            if self.paused:
+                self.paused = False
+                self.loop.add_reader(self.socket, self.ingest)
+
+    async def classify_stage(self, executor):
+        """
+        The classify stage: classifies each batch in the executor and passes it on to the output stage (waiting for
+        room in the output queue), and removes dropped tracks in order with the batches.
+        :param executor: The single-thread executor the model runs in.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            kind, payload = await self.classify_queue.get()
+            if kind == 'batch':
+                self.queued -= len(payload)
+            start = time.perf_counter()
+            try:
+                if kind == 'drop':
+                    self.tracks_dropped += await loop.run_in_executor(executor, self.model.records.drop_tracks, payload)
+                    continue
+                classified = await loop.run_in_executor(executor, self.model.classify_batch, payload)
+            except Exception as e:
+                self.errors['classify'] += 1
+                print(e)
+                continue
+            self.service_times['classify'].append(time.perf_counter() - start)
+            await self.output_queue.put(classified)
+
+    async def output_stage(self, executor):
+        """
+        The output stage: prints and sends each classified batch in the executor, and prints the statistics every
+        BATCH_STATS_INTERVAL batches.
+        :param executor: The single-thread executor the output runs in.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            classified = await self.output_queue.get()
+            start = time.perf_counter()
+            try:
+                await loop.run_in_executor(executor, self.model.emit_predictions, classified)
+            except Exception as e:
+                self.errors['output'] += 1
+                print(e)
+            self.service_times['output'].append(time.perf_counter() - start)
+            self.emitted += 1
+            self.emitted_rows += len(classified)
+            if self.emitted % c.BATCH_STATS_INTERVAL == 0:
+                self.print_pipeline_stats()
+
+    def report_stats(self):
+        """
+        Statistics are printed by the output stage (see print_pipeline_stats), once batches made it through.
+        :return: None
+        """
+
+    def format_stage_stats(self):
+        """
+        Formats the time each stage spends per batch as a single line, for printing.
+        :return: The formatted statistics.
+        """
+        batching = self.batcher.stats()
+        parts = []
+        if batching['batches'] > 0:
+            parts.append(f"batching ms p50 {batching['latency_ms_p50']:.2f} / p95 {batching['latency_ms_p95']:.2f} "
+                         f"(mean size {batching['mean_size']:.1f})")
+        for stage, times in self.service_times.items():
+            if times:
+                times = 1000 * np.array(times)
+                parts.append(f"{stage} ms p50 {np.percentile(times, 50):.2f} / p95 {np.percentile(times, 95):.2f} "
+                             f"({self.errors[stage]} errors)")
+        return "stages: " + ", ".join(parts)
+
+    def print_pipeline_stats(self):
+        """
+        Prints where the latency goes (the time batches spend being batched, waiting in each queue and in each stage)
+        and the model and receive statistics.
+        :return: None
+        """
+        print(f"pipeline: {self.emitted} batches out ({self.emitted_rows} of {self.batcher.messages} batched "
+              f"measurements), {self.backlog()} measurements waiting ({self.outbox_rows} in the ingest stage's outbox)")
+        print(self.format_stage_stats())
+        print(self.classify_queue.format_stats())
+        print(self.output_queue.format_stats())
+        self.print_model_stats()
+
+
+def _coalesce(batches):
+    """
+    Merges batches of measurements into one batch holding only the latest measurement of each track.
+    :param batches: The DataFrames of measurements (see receiver.measurements_to_pd), oldest first.
+    :return: A DataFrame with one row per track, in the order of each track's latest measurement.
+    """
+    merged = batches[0] if len(batches) == 1 else pd.concat(batches, ignore_index=True)
+    return merged.drop_duplicates('UUID', keep='last').reset_index(drop=True)
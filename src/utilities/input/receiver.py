@@ -1,9 +1,45 @@
-import math
+import numpy as np
+import os
 import socket
 import struct
+import time
 import pandas as pd
 
 from . import CtcInMsg_Defs
+from .batcher import MicroBatcher
+from .. import constants as c
+
+# the header of every message (CtcInDataHeader in CtcInMsg_Defs.h), laid out like the "=BBBBHIHH" struct format: packed,
+# in the native byte order
+HEADER_FIELDS = [('srcID', 'u1'), ('msgBlockSeries', 'u1'), ('msgType', 'u1'), ('srcType', 'u1'), ('msgLength', 'u2'),
+                 ('msgNumber', 'u4'), ('measurementTime_LSW', 'u2'), ('measurementTime_MSW', 'u2')]
+HEADER_DTYPE = np.dtype(HEADER_FIELDS)
+
+# whole messages of each type, so a buffer of messages can be viewed as an array of them: type 1 is
+# CtcInCommonMeasurement_3DPositionStruct ("=IIIhhhhHHHH", 42 bytes), type 2 is CtcInCommonTrackDropStruct ("=I", 18
+# bytes) and type 3 is CtcInCommonSensorStatusStruct ("=IIIBBIIiI", 44 bytes)
+MEASUREMENT_DTYPE = np.dtype(HEADER_FIELDS + [
+    ('trackNumber', 'u4'), ('range', 'u4'), ('azimuth', 'u4'), ('elevation', 'i2'), ('velocityNorth', 'i2'),
+    ('velocityEast', 'i2'), ('velocityUp', 'i2'), ('SNR', 'u2'), ('RCS', 'u2'), ('doppler', 'u2'),
+    ('trackDescriptorFlag', 'u2')])
+TRACK_DROP_DTYPE = np.dtype(HEADER_FIELDS + [('trackNumber', 'u4')])
+SENSOR_STATUS_DTYPE = np.dtype(HEADER_FIELDS + [
+    ('globalTimestampSeconds', 'u4'), ('globalTimestampNanoSeconds', 'u4'), ('synchronizationWord', 'u4'),
+    ('sensorStatus', 'u1'), ('warningFlag', 'u1'), ('sensorLat', 'u4'), ('sensorLon', 'u4'), ('sensorAlt', 'i4'),
+    ('antennaAz', 'u4')])
+MESSAGE_DTYPES = {1: MEASUREMENT_DTYPE, 2: TRACK_DROP_DTYPE, 3: SENSOR_STATUS_DTYPE}
+
+# no messages of any type (shared, so splitting a buffer doesn't allocate the types it doesn't hold)
+NO_MESSAGES = {msg_type: np.zeros(0, dtype=dtype) for msg_type, dtype in MESSAGE_DTYPES.items()}
+
+# the offset of the message type in every message
+MSG_TYPE_OFFSET = HEADER_DTYPE.fields['msgType'][1]
+
+# the overload policies of the receiver (see Receiver.relieve_overload)
+OVERLOAD_POLICIES = ('coalesce', 'shed', 'none')
+
+# the latitude, longitude and altitude measurements are located relative to
+REFERENCE_POINT = (40.0, -90.0, 200.0)
 
 
 def calculate_position(range_dist, azimuth, elevation, sensor_lat=0.0, sensor_lon=0.0, sensor_alt=0.0):
@@ -18,20 +54,21 @@ def calculate_position(range_dist, azimuth, elevation, sensor_lat=0.0, sensor_lo
     :param sensor_lon: The longitude of the sensor.
     :param sensor_alt: The altitude of the sensor.
     :return: The object's latitude, longitude, and altitude (as a tuple).
+    The distance and angles can also be arrays (of many objects), which gives arrays of positions.
     """
     # convert az and el from degrees to radians
-    azimuth_radians = math.radians(azimuth)
-    elevation_radians = math.radians(elevation)
+    azimuth_radians = np.radians(azimuth)
+    elevation_radians = np.radians(elevation)
 
     # calculate the horizontal range from sensor to target
-    horizontal_distance = range_dist * math.cos(elevation_radians)
+    horizontal_distance = range_dist * np.cos(elevation_radians)
 
     # use the horizontal range to calculate the change in latitude and longitude
-    lat_change = horizontal_distance * math.cos(azimuth_radians)
-    lon_change = horizontal_distance * math.sin(azimuth_radians)
+    lat_change = horizontal_distance * np.cos(azimuth_radians)
+    lon_change = horizontal_distance * np.sin(azimuth_radians)
 
     # calculate the vertical range from sensor to target (i.e., the change in altitude)
-    alt_change = range_dist * math.sin(elevation_radians)
+    alt_change = range_dist * np.sin(elevation_radians)
 
     # calculate the lat, lon, and alt of the object, assuming 111.32 km per 1 degree of latitude/longitude
     # https://stackoverflow.com/questions/639695/how-to-convert-latitude-or-longitude-to-meters
@@ -49,17 +86,18 @@ def calculate_speed(north, east, up):
     :param east: The eastward component of the object's velocity (negative indicates westward motion).
     :param up: The upward component of the object's velocity (negative indicates downward motion).
     :return: The speed of the object (in meters per second).
+    The components can also be arrays (of many objects), which gives an array of speeds.
     """
     # speed is just the magnitude of the velocity vector (made up of the three components).
-    return math.sqrt((north * north) + (east * east) + (up * up))
+    return np.sqrt((north * north) + (east * east) + (up * up))
 
 
-def ctc_to_pd(body):
+def ctc_to_record(body):
     """
-    Extracts, transforms, and combines into a DataFrame the relevant fields (range, azimuth, elevation, rcs, speed, and
-    location) from a CtcInCommonMeasurement_3DPositionStruct object.
+    Extracts and transforms the relevant fields (range, azimuth, elevation, rcs, speed, and location) from a
+    CtcInCommonMeasurement_3DPositionStruct object.
     :param body: A CtcInCommonMeasurement_3DPositionStruct object containing encoded information on an object.
-    :return: A DataFrame with the relevant (transformed) fields from body.
+    :return: A dictionary with the relevant (transformed) fields from body.
     """
     # extract fields from body (which is a CtcInCommonMeasurement_3DPositionStruct object)
     uuid = body.trackNumber
@@ -71,7 +109,7 @@ def ctc_to_pd(body):
     rcs = body.RCS / 1000
 
     # calculate the latitude, longitude, and altitude (using (40, -90, 200) as the reference point)
-    lat, lon, alt = calculate_position(range_, azimuth, elevation, 40.0, -90.0, 200.0)
+    lat, lon, alt = calculate_position(range_, azimuth, elevation, *REFERENCE_POINT)
 
     # use inverse transformations to get the three directional velocity components
     velocityNorth = body.velocityNorth / 16
@@ -81,21 +119,112 @@ def ctc_to_pd(body):
     # calculate speed using magnitude formula
     speed = calculate_speed(velocityNorth, velocityEast, velocityUp)
 
-    # stick all the calculated fields into a DataFrame and return it
-    data = {
-        'UUID': [uuid],
-        'Speed': [speed],
-        'AZ': [azimuth],
-        'EL': [elevation],
-        'Range': [range_],
-        'Position (lat)': [lat],
-        'Position (lon)': [lon],
-        'Position (alt MSL)': [alt],
-        'Radar Cross Section': [rcs]
+    # stick all the calculated fields into a dictionary and return it
+    return {
+        'UUID': uuid,
+        'Speed': speed,
+        'AZ': azimuth,
+        'EL': elevation,
+        'Range': range_,
+        'Position (lat)': lat,
+        'Position (lon)': lon,
+        'Position (alt MSL)': alt,
+        'Radar Cross Section': rcs
     }
 
-    df = pd.DataFrame(data)
-    return df
+
+def ctc_to_pd(body):
+    """
+    Extracts, transforms, and combines into a DataFrame the relevant fields (range, azimuth, elevation, rcs, speed, and
+    location) from a CtcInCommonMeasurement_3DPositionStruct object.
+    :param body: A CtcInCommonMeasurement_3DPositionStruct object containing encoded information on an object.
+    :return: A DataFrame with the relevant (transformed) fields from body.
+    """
+    return pd.DataFrame([ctc_to_record(body)])
+
+
+def split_messages(buffer, lengths):
+    """
+    Splits a buffer of messages stored back to back by type, and views each type's messages as a structured array
+    (see MESSAGE_DTYPES). A buffer holding only measurements (the common case) is viewed in place, without copying;
+    otherwise each type's messages are gathered with one fancy index. No Python object is created per message.
+    :param buffer: A bytes-like object holding the messages back to back.
+    :param lengths: The length of each message (in bytes), in order.
+    :return: A tuple (dictionary mapping each message type (1, 2 and 3) to a structured array of its messages, in the
+    order they were received, number of malformed messages: too short, of an unknown type, or whose length doesn't
+    match their type).
+    """
+    messages = dict(NO_MESSAGES)
+
+    # a single message (what one recv returns) is checked without any array operation
+    if len(lengths) == 1:
+        length = lengths[0]
+        dtype = MESSAGE_DTYPES.get(buffer[MSG_TYPE_OFFSET]) if length >= HEADER_DTYPE.itemsize else None
+        if dtype is None or length != dtype.itemsize:
+            return messages, 1
+        messages[buffer[MSG_TYPE_OFFSET]] = np.frombuffer(buffer, dtype=dtype, count=1)
+        return messages, 0
+
+    lengths = np.asarray(lengths, dtype=np.int64)
+    raw = np.frombuffer(buffer, dtype=np.uint8, count=int(lengths.sum()))
+    size = MEASUREMENT_DTYPE.itemsize
+    if len(lengths) > 0 and (lengths == size).all() and (raw[MSG_TYPE_OFFSET::size] == 1).all():
+        messages[1] = raw.view(MEASUREMENT_DTYPE)
+        return messages, 0
+
+    # the type of every message long enough to have a header (the others are malformed)
+    offsets = np.cumsum(lengths) - lengths
+    types = np.zeros(len(lengths), dtype=np.uint8)
+    has_header = lengths >= HEADER_DTYPE.itemsize
+    types[has_header] = raw[offsets[has_header] + MSG_TYPE_OFFSET]
+
+    malformed = len(lengths)
+    for msg_type, dtype in MESSAGE_DTYPES.items():
+        starts = offsets[(types == msg_type) & (lengths == dtype.itemsize)]
+        malformed -= len(starts)
+        if len(starts) > 0:
+            messages[msg_type] = raw[starts[:, None] + np.arange(dtype.itemsize)].view(dtype).reshape(-1)
+    return messages, malformed
+
+
+def measurements_to_pd(messages):
+    """
+    Extracts and transforms the relevant fields of many measurements at once: the vectorized ctc_to_record, which
+    gives exactly the same values.
+    :param messages: A structured array of measurement messages (MEASUREMENT_DTYPE, see split_messages).
+    :return: A DataFrame with one row per message and the fields of ctc_to_record as columns.
+    """
+    # to get the azimuth, elevation, and range use the inverse transformation that was used to encode them
+    azimuth = (messages['azimuth'] * 360.0) / (2 ** 32)
+    elevation = (messages['elevation'] * 180.0) / (2 ** 16)
+    range_ = messages['range'] / 16
+    rcs = messages['RCS'] / 1000
+
+    lat, lon, alt = calculate_position(range_, azimuth, elevation, *REFERENCE_POINT)
+    speed = calculate_speed(messages['velocityNorth'] / 16, messages['velocityEast'] / 16, messages['velocityUp'] / 16)
+
+    return pd.DataFrame({
+        'UUID': messages['trackNumber'].astype(np.int64),
+        'Speed': speed,
+        'AZ': azimuth,
+        'EL': elevation,
+        'Range': range_,
+        'Position (lat)': lat,
+        'Position (lon)': lon,
+        'Position (alt MSL)': alt,
+        'Radar Cross Section': rcs
+    })
+
+
+def assemble_measurements(pending):
+    """
+    Turns the measurements collected by a MicroBatcher (structured arrays of measurement messages) into one batch.
+    :param pending: The list of structured arrays.
+    :return: A DataFrame with one row per measurement (see measurements_to_pd).
+    """
+    # joining the arrays' bytes is much faster than np.concatenate, which copies structured arrays field by field
+    return measurements_to_pd(pending[0] if len(pending) == 1 else
+                              np.frombuffer(b''.join(pending), dtype=MEASUREMENT_DTYPE))
 
 
 def decode_message(message):
@@ -166,42 +295,131 @@ def decode_message(message):
     return header, body
 
 
+def kernel_drops(sock):
+    """
+    Reads the number of datagrams the kernel dropped for a UDP socket because its receive buffer was full (Linux only,
+    from /proc/net/udp).
+    :param sock: The socket.
+    :return: The number of dropped datagrams, or None if it can't be read.
+    """
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        for table in ('/proc/net/udp', '/proc/net/udp6'):
+            with open(table) as file:
+                next(file)
+                for line in file:
+                    fields = line.split()
+                    if fields[9] == inode:
+                        return int(fields[12])
+    except (OSError, IndexError, ValueError):
+        return None
+    return None
+
+
 class Receiver:
     """
     This class is responsible for receiving and decoding messages from the radar system or the transmitter program, and
-    for sending the decoded data through the classification model.
+    for sending the decoded data through the classification model. Outside of the demo, measurements are classified in
+    micro-batches (see MicroBatcher). Every wakeup receives all the datagrams that are waiting, into a preallocated
+    buffer, and decodes them in bulk (see split_messages): measurements go to the model, track drops remove their
+    tracks from the model's dictionary, and the latest sensor status is kept. When the model falls behind, the
+    overload policy decides which measurements are dropped (see relieve_overload).
 
     Attributes:
         model: The classification model which takes in the message data and generates predictions
         host: The IP address to connect with the radar system on.
         port: The port to connect with the radar system on.
         demo: A NetworkDemo object used to run the demo, or None if the demo is not being run.
+        batcher: The MicroBatcher that collects measurements and passes them to the model.
+        receive_buffer: The requested size of the socket's kernel receive buffer (SO_RCVBUF), or None for the default.
+        overload_policy: What to do when the backlog passes overload_backlog (one of OVERLOAD_POLICIES).
+        overload_backlog: The number of measurements waiting to be classified beyond which the policy applies.
+        buffer: The preallocated buffer datagrams are received into, back to back.
+        lengths: The length of each datagram in buffer.
+        socket: The listening socket (None until listening starts).
+        sensor_status: The latest sensor status message (a SENSOR_STATUS_DTYPE record), or None.
+        sensor_statuses: The number of sensor status messages received.
+        tracks_dropped: The number of tracks removed by track drop messages.
+        dropped: A dictionary mapping each reason a message was dropped for ('malformed', 'coalesced' and 'shed') to
+        the number of messages dropped for it (the kernel's drops are read from the socket, see kernel_drops).
+        wakeups: The number of times the receiver woke up to datagrams.
+        datagrams: The number of datagrams received.
+        largest_drain: The largest number of datagrams received in one wakeup.
+        overloads: The number of wakeups whose backlog passed overload_backlog.
     """
-    def __init__(self, model, host, port, demo=None):
+    def __init__(self, model, host, port, demo=None, batch_size=c.BATCH_SIZE, batch_timeout=c.BATCH_TIMEOUT_MS / 1000,
+                 receive_buffer=c.RECEIVE_BUFFER_BYTES, overload_policy=c.OVERLOAD_POLICY,
+                 overload_backlog=c.OVERLOAD_BACKLOG, drain_bytes=c.DRAIN_BUFFER_BYTES):
         self.model = model  # the classifier
         self.host = host    # IP address to connect on
         self.port = port    # port to connect on
         self.demo = demo    # NetworkDemo object (if running the demo) or None (if not running demo)
 
+        # collects measurements until batch_size of them or batch_timeout seconds, then classifies them all at once
+        self.batcher = MicroBatcher(self.model.make_inference, batch_size, batch_timeout,
+                                    assemble=assemble_measurements)
+
+        # every wakeup receives the waiting datagrams into the same buffer, so receiving allocates nothing per datagram
+        self.receive_buffer = receive_buffer
+        self.overload_policy = overload_policy
+        self.overload_backlog = overload_backlog
+        self.buffer = bytearray(drain_bytes)
+        self.lengths = np.zeros(drain_bytes // HEADER_DTYPE.itemsize, dtype=np.int64)
+        self.socket = None
+
+        # counters of the messages that aren't measurements, of the dropped messages and of the wakeups
+        self.sensor_status = None
+        self.sensor_statuses = 0
+        self.tracks_dropped = 0
+        self.dropped = {'malformed': 0, 'coalesced': 0, 'shed': 0}
+        self.wakeups = 0
+        self.datagrams = 0
+        self.largest_drain = 0
+        self.overloads = 0
+
     def receive_messages(self):
         """
-        Creates a UDP socket and listens for incoming messages from the radar system or transmitter program. Once a
-        message is received, it is decoded and sent to the classification model.
+        Creates a UDP socket and listens for incoming messages from the radar system or transmitter program. Each time
+        messages arrive, every waiting message is received (see drain), decoded and routed (see route).
         :return: None (control is never returned from this function unless the program is killed).
         """
         # create a UDP socket
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            # size the kernel's receive buffer, which holds the datagrams that arrive while a batch is classified
+            if self.receive_buffer:
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+
             # bind the UDP socket to the address and port
             s.bind((self.host, self.port))
+            self.socket = s
 
             # keep the receiver listening indefinitely
-            print(f"Listening on {self.host}:{self.port}")
+            print(f"Listening on {self.host}:{self.port} (receive buffer: "
+                  f"{s.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)} bytes)")
             while True:
-                # buffer size is 1024 bytes
-                data = s.recv(1024)
+                # classify the pending batch once its deadline has passed, otherwise only wait for the next message
+                # until the deadline (or indefinitely if nothing is pending)
+                wait = self.batcher.time_left()
+                if wait == 0:
+                    self.flush_batch()
+                    wait = None
+                s.settimeout(wait)
+
+                try:
+                    count, end_of_time_point = self.drain(s)
+                except socket.timeout:
+                    continue
+                self.wakeups += 1
+                self.datagrams += count
+                self.largest_drain = max(self.largest_drain, count)
+
+                # the messages are routed before the demo's end-of-time-point message, which is always the last one
+                messages = count - 1 if end_of_time_point else count
+                if messages > 0:
+                    self.route(self.buffer, self.lengths[:messages], time.perf_counter())
 
                 # when using the demo, 1-byte messages signify the last message of a time point
-                if len(data) == 1:
+                if end_of_time_point:
                     # not really sure what would happen if a non-demo 1-byte message was received...
                     try:
                         self.demo.update_plot()
@@ -209,25 +427,156 @@ class Receiver:
                     except Exception as e:
                         print(e)
 
-                # if the message isn't 1-byte, we assume it's a valid radar message with a header and a body
-                else:
-                    # decode the message into the header and body
-                    (header, body) = decode_message(data)
-
-                    # messages of type 1 (CtcInCommonMeasurement_3DPositionStruct) are what we're interested in
-                    if header.msgType == 1:
-                        # convert the CtcInCommonMeasurement_3DPositionStruct object to a DataFrame
-                        data_pd = ctc_to_pd(body)
-
-                        # if running the demo
-                        if self.demo is not None:
-                            # add the gt class (held in track descriptor flag field) to the DataFrame
-                            data_pd["Class"] = body.trackDescriptorFlag
-                            self.demo.run_test(data_pd)
-
-                        # if not running the demo (i.e., standard inferencing)
-                        else:
-                            self.model.make_inference(data_pd)
+    def drain(self, s):
+        """
+        Waits for the next datagram (for as long as the socket's timeout), then receives every datagram that's already
+        waiting without blocking again, back to back into the preallocated buffer (their lengths go to self.lengths).
+        Draining stops early when the buffer is full, and after a 1-byte datagram (the demo's end of a time point).
+        :param s: The socket.
+        :return: A tuple (number of datagrams received, True if the last one is a 1-byte datagram).
+        """
+        view = memoryview(self.buffer)
+        count = used = 0
+        while count < len(self.lengths) and len(view) - used >= c.MAX_DATAGRAM_BYTES:
+            try:
+                size = s.recv_into(view[used:], c.MAX_DATAGRAM_BYTES)
+            except BlockingIOError:
+                break
+
+            # once a datagram arrived, only the ones already waiting are received
+            if count == 0:
+                s.settimeout(0.0)
+            self.lengths[count] = size
+            count += 1
+            used += size
+            if size == 1:
+                return count, True
+        return count, False
+
+    def route(self, buffer, lengths, now=None):
+        """
+        Decodes a buffer of messages received from the radar (see split_messages) and routes them by type: measurements
+        are added to the batch (or passed to the demo), track drops remove their tracks from the model's dictionary,
+        and the latest sensor status is kept.
+        :param buffer: A bytes-like object holding the messages back to back (it can be reused once route returns).
+        :param lengths: The length of each message (in bytes), in order.
+        :param now: The time the messages arrived at (on the time.perf_counter clock), defaults to the current time.
+        :return: None
+        """
+        messages, malformed = split_messages(buffer, lengths)
+        self.dropped['malformed'] += malformed
+
+        # messages of type 1 (CtcInCommonMeasurement_3DPositionStruct) are what we're interested in; the ones kept are
+        # copied out of the buffer, which is reused by the next wakeup
+        measurements = self.relieve_overload(messages[1])
+        if len(measurements) > 0:
+            # if running the demo, pass the measurements one at a time with their gt class (held in the track
+            # descriptor flag field)
+            if self.demo is not None:
+                data_pd = measurements_to_pd(measurements)
+                data_pd["Class"] = measurements['trackDescriptorFlag']
+                for row in range(len(data_pd)):
+                    self.demo.run_test(data_pd.iloc[row:row + 1])
+
+            # if not running the demo (i.e., standard inferencing), add the measurements to the batch
+            else:
+                batches = self.batcher.batches
+                self.batcher.add_many(measurements.copy(), len(measurements), now)
+                if self.batcher.batches != batches:
+                    self.report_stats()
+
+        # messages of type 2 (CtcInCommonTrackDropStruct) end their tracks; the pending batch is classified first, so
+        # the dropped tracks' last measurements don't bring them back afterwards
+        drops = messages[2]
+        if len(drops) > 0:
+            self.drop_tracks(drops['trackNumber'].tolist())
+
+        # messages of type 3 (CtcInCommonSensorStatusStruct) describe the sensor; only the latest one is kept
+        statuses = messages[3]
+        if len(statuses) > 0:
+            self.sensor_status = statuses[-1:].copy()[0]
+            self.sensor_statuses += len(statuses)
+
+    def drop_tracks(self, uuids):
+        """
+        Classifies the pending batch, then removes tracks dropped by the radar from the model's dictionary.
+        :param uuids: The track numbers of the dropped tracks.
+        :return: None
+        """
+        self.flush_batch()
+        self.tracks_dropped += self.model.records.drop_tracks(uuids)
+
+    def relieve_overload(self, measurements):
+        """
+        Applies the overload policy when the backlog (the measurements just received plus the ones waiting for their
+        batch) is larger than overload_backlog: 'coalesce' keeps only the latest of the received measurements of each
+        track (a track is classified from its latest state anyway), and 'shed' drops the oldest received measurements
+        until the backlog fits. The dropped measurements are counted in self.dropped.
+        :param measurements: A structured array of the measurements just received (MEASUREMENT_DTYPE).
+        :return: The measurements kept, in the order they were received.
+        """
+        backlog = len(self.batcher) + len(measurements)
+        if self.overload_policy == 'none' or backlog <= self.overload_backlog:
+            return measurements
+        self.overloads += 1
+
+        if self.overload_policy == 'coalesce':
+            # the last occurrence of each track number is the first one of the reversed array
+            _, last = np.unique(measurements['trackNumber'][::-1], return_index=True)
+            kept = measurements[np.sort(len(measurements) - 1 - last)]
+        else:
+            kept = measurements[len(measurements) - max(self.overload_backlog - len(self.batcher), 0):]
+        self.dropped['coalesced' if self.overload_policy == 'coalesce' else 'shed'] += len(measurements) - len(kept)
+        return kept
+
+    def flush_batch(self):
+        """
+        Classifies the measurements collected so far (if any).
+        :return: None
+        """
+        batches = self.batcher.batches
+        self.batcher.flush()
+        if self.batcher.batches != batches:
+            self.report_stats()
+
+    def report_stats(self):
+        """
+        Prints the batch and prediction cache statistics every BATCH_STATS_INTERVAL batches.
+        :return: None
+        """
+        if self.batcher.batches % c.BATCH_STATS_INTERVAL == 0:
+            print(self.batcher.format_stats())
+            self.print_model_stats()
+
+    def print_model_stats(self):
+        """
+        Prints the prediction cache, cascade and early exit statistics of the model, and the receive statistics.
+        :return: None
+        """
+        cache = self.model.records.cache_stats()
+        print(f"prediction cache: {cache['hit_rate']:.1%} hit rate ({cache['hits']} hits, {cache['misses']} misses)")
+        if self.model.cascade is not None:
+            cascade = self.model.cascade_stats()
+            print(f"cascade: {cascade['escalated_fraction']:.1%} of tracks escalated to the full model "
+                  f"({cascade['escalated']} of {cascade['rows']})")
+        if self.model.cutoff is not None:
+            trees = self.model.early_exit_stats()
+            print(f"early exit: {trees['mean_trees']:.1f} of {trees['n_trees']} trees evaluated per track on average")
+        print(f"other messages: {self.tracks_dropped} tracks dropped, {self.sensor_statuses} sensor status")
+        print(self.format_receive_stats())
+
+    def format_receive_stats(self):
+        """
+        Formats the receive statistics (wakeups, datagrams per wakeup, and the messages dropped and why) as a single
+        line, for printing.
+        :return: The formatted statistics.
+        """
+        kernel = kernel_drops(self.socket) if self.socket is not None else None
+        mean = self.datagrams / self.wakeups if self.wakeups else 0.0
+        return (f"receive: {self.datagrams} datagrams in {self.wakeups} wakeups (mean {mean:.1f}, largest "
+                f"{self.largest_drain}), {self.overloads} overloaded; dropped: {self.dropped['coalesced']} coalesced, "
+                f"{self.dropped['shed']} shed, {self.dropped['malformed']} malformed, "
+                f"{'unknown' if kernel is None else kernel} by the kernel (receive buffer full)")
 
     def begin_listening(self):
         """